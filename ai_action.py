@@ -0,0 +1,130 @@
+"""
+AI 回复的结构化表示。
+
+结构化输出模式 (AI_STRUCTURED=1) 下，请求带上 ACTION_SCHEMA（Gemini responseSchema /
+OpenAI json_schema），回复一定是 {"task": ..., "action": ..., "points": [...]}；
+parse_action 只做一次 json.loads 加字段校验，得到 AIAction，再转换成主循环使用的动作字典。
+旧格式 ({"x", "y", "hold"} / {"clicks"} / {"action": "wait"}) 也能解析。
+"""
+import json
+import os
+
+ACTIONS = ("click", "hold", "clicks", "wait")
+
+# 同时满足 Gemini responseSchema 和 OpenAI strict json_schema 的写法：
+# 所有字段都必填、不允许额外字段、不使用可选 / 可空类型
+ACTION_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "task": {"type": "string"},
+        "action": {"type": "string", "enum": list(ACTIONS)},
+        "points": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {"x": {"type": "integer"}, "y": {"type": "integer"}},
+                "required": ["x", "y"],
+                "additionalProperties": False,
+            },
+        },
+    },
+    "required": ["task", "action", "points"],
+    "additionalProperties": False,
+}
+
+
+class ActionError(ValueError):
+    """回复不是合法的动作"""
+
+
+class AIAction:
+    """task: 任务名；action: click / hold / clicks / wait；points: [(x, y), ...]（基准分辨率坐标）"""
+
+    __slots__ = ("task", "action", "points")
+
+    def __init__(self, task: str, action: str, points=()):
+        self.task = task
+        self.action = action
+        self.points = [tuple(p) for p in points]
+
+    def to_coords(self) -> dict:
+        """转换成主循环 / 决策缓存使用的动作字典"""
+        if self.action == "wait":
+            return {"action": "wait", "task": self.task}
+        if self.action == "clicks":
+            return {"clicks": list(self.points), "task": self.task}
+        x, y = self.points[0]
+        return {"x": x, "y": y, "hold": self.action == "hold", "task": self.task}
+
+    def __repr__(self):
+        return f"AIAction({self.task!r}, {self.action!r}, {self.points!r})"
+
+
+def _strip_fence(text: str) -> str:
+    # 有的模型即使要求 JSON 也会包一层 ```json ... ```
+    text = text.strip()
+    if text.startswith("```"):
+        text = text.split("\n", 1)[1] if "\n" in text else ""
+        text = text.rsplit("```", 1)[0]
+    return text.strip()
+
+
+def _point(value, width: int, height: int) -> tuple:
+    if isinstance(value, dict):
+        x, y = value.get("x"), value.get("y")
+    elif isinstance(value, (list, tuple)) and len(value) == 2:
+        x, y = value
+    else:
+        raise ActionError(f"无效的坐标: {value!r}")
+    if isinstance(x, bool) or isinstance(y, bool) or not isinstance(x, (int, float)) or not isinstance(y, (int, float)):
+        raise ActionError(f"坐标不是数字: {value!r}")
+    x, y = int(x), int(y)
+    if not (0 <= x <= width and 0 <= y <= height):
+        raise ActionError(f"坐标超出 {width}x{height}: ({x}, {y})")
+    return x, y
+
+
+def parse_action(text: str, width: int = None, height: int = None) -> AIAction:
+    """
+    一次解析并校验，失败抛出 ActionError。
+    width / height 为坐标允许的范围（基准分辨率，默认 BASE_WIDTH x BASE_HEIGHT）。
+    """
+    width = width or int(os.getenv("BASE_WIDTH", 1280))
+    height = height or int(os.getenv("BASE_HEIGHT", 720))
+    try:
+        data = json.loads(_strip_fence(text))
+    except ValueError as e:
+        raise ActionError(f"不是合法的 JSON: {e}")
+    if not isinstance(data, dict):
+        raise ActionError("回复不是 JSON 对象")
+    task = data.get("task")
+    task = task if isinstance(task, str) and task else "unknown"
+    action = data.get("action")
+
+    if "points" in data:
+        if action not in ACTIONS:
+            raise ActionError(f"未知的 action: {action!r}")
+        if not isinstance(data["points"], list):
+            raise ActionError("points 不是数组")
+        points = [_point(p, width, height) for p in data["points"]]
+    # 旧格式
+    elif action == "wait":
+        points = []
+    elif "clicks" in data:
+        if not isinstance(data["clicks"], list):
+            raise ActionError("clicks 不是数组")
+        action, points = "clicks", [_point(p, width, height) for p in data["clicks"]]
+    elif "x" in data and "y" in data:
+        action = "hold" if data.get("hold") is True else "click"
+        points = [_point(data, width, height)]
+    else:
+        raise ActionError("缺少坐标")
+
+    if action == "wait":
+        return AIAction(task, "wait")
+    if not points:
+        raise ActionError(f"{action} 没有坐标")
+    if action in ("click", "hold") and len(points) != 1:
+        # 单击 / 长按给了多个点：按顺序点击处理
+        action = "clicks"
+    return AIAction(task, action, points)
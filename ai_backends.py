@@ -0,0 +1,286 @@
+"""
+视觉模型提供方 (backend)。
+
+每个 backend 只负责把 (prompt, 图片) 组装成自己的 HTTP 请求、从响应里取出文本和 token 用量；
+连接池、截止时间、重试、限速和路由都由 ai_client.AIClient 负责。
+
+AI_BACKENDS 指向一个 JSON 文件（默认 ai_backends.json），格式见 ai_backends.example.json；
+文件不存在时只使用由 API_KEY / MODEL_NAME / API_ENDPOINT 配置的 Gemini，与原来一致。
+"""
+import json
+import os
+import threading
+import time
+from collections import deque
+
+
+class LatencyWindow:
+    """最近 size 次成功请求的耗时（秒），用于计算分位数"""
+
+    def __init__(self, size: int = 200):
+        self.size = size
+        self._samples = deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def add(self, seconds: float):
+        with self._lock:
+            self._samples.append(seconds)
+
+    def __len__(self):
+        return len(self._samples)
+
+    def quantile(self, q: float) -> float:
+        with self._lock:
+            samples = sorted(self._samples)
+        if not samples:
+            return 0.0
+        return samples[min(int(q * len(samples)), len(samples) - 1)]
+
+
+class BackendStats:
+    """
+    单个 backend 的滚动统计：耗时分位数、最近 window 次的错误率、累计花费。
+    连续失败 failure_threshold 次后熔断 cooldown 秒；冷却结束后放行请求，再失败一次立即重新熔断。
+    """
+
+    def __init__(self, window: int = 50, failure_threshold: int = 3, cooldown: float = 30.0):
+        self.latency = LatencyWindow(window)
+        self.outcomes = deque(maxlen=window)
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.consecutive_failures = 0
+        self.down_until = 0.0
+        self.calls = 0
+        self.errors = 0
+        self.tokens_in = 0
+        self.tokens_out = 0
+        self.cost = 0.0
+        self._lock = threading.Lock()
+
+    def record_success(self, seconds: float, tokens_in: int = 0, tokens_out: int = 0, cost: float = 0.0):
+        with self._lock:
+            self.calls += 1
+            self.outcomes.append(True)
+            self.consecutive_failures = 0
+            self.tokens_in += tokens_in
+            self.tokens_out += tokens_out
+            self.cost += cost
+        self.latency.add(seconds)
+
+    def record_failure(self):
+        with self._lock:
+            self.calls += 1
+            self.errors += 1
+            self.outcomes.append(False)
+            self.consecutive_failures += 1
+            if self.consecutive_failures >= self.failure_threshold:
+                self.down_until = time.monotonic() + self.cooldown
+
+    def healthy(self) -> bool:
+        return time.monotonic() >= self.down_until
+
+    def error_rate(self) -> float:
+        with self._lock:
+            if not self.outcomes:
+                return 0.0
+            return 1 - sum(self.outcomes) / len(self.outcomes)
+
+    def to_dict(self) -> dict:
+        return {
+            "calls": self.calls,
+            "errors": self.errors,
+            "error_rate": round(self.error_rate(), 3),
+            "p50": round(self.latency.quantile(0.5), 3),
+            "p95": round(self.latency.quantile(0.95), 3),
+            "tokens_in": self.tokens_in,
+            "tokens_out": self.tokens_out,
+            "cost": round(self.cost, 6),
+            "healthy": self.healthy(),
+        }
+
+
+class Backend:
+    """
+    name: 日志和统计里使用的名字
+    price_in / price_out: 每百万输入 / 输出 token 的价格，用于估算花费
+    fallback_only: 只在其他 backend 都失败或熔断时使用
+    """
+
+    kind = ""
+    local = False
+
+    def __init__(self, name: str, model: str = "", price_in: float = 0.0, price_out: float = 0.0,
+                 fallback_only: bool = False, failure_threshold: int = 3, cooldown: float = 30.0):
+        self.name = name
+        self.model = model
+        self.price_in = price_in
+        self.price_out = price_out
+        self.fallback_only = fallback_only
+        self.stats = BackendStats(failure_threshold=failure_threshold, cooldown=cooldown)
+
+    def request(self, prompt: str, image_b64: str, mime_type: str, options: dict) -> tuple:
+        """返回 (url, headers, json body)"""
+        raise NotImplementedError
+
+    def parse(self, data: dict) -> tuple:
+        """从响应 JSON 中取出 (文本, 输入 token, 输出 token)，格式不对时抛出 ValueError"""
+        raise NotImplementedError
+
+    def cost(self, tokens_in: int, tokens_out: int) -> float:
+        return (tokens_in * self.price_in + tokens_out * self.price_out) / 1e6
+
+    def __repr__(self):
+        return f"{type(self).__name__}({self.name})"
+
+
+def _base_url(endpoint: str, default: str) -> str:
+    endpoint = (endpoint or default).rstrip("/")
+    return endpoint if "://" in endpoint else f"https://{endpoint}"
+
+
+def _gemini_schema(schema):
+    """responseSchema 只支持 OpenAPI 子集，去掉 additionalProperties 等不认识的字段"""
+    if isinstance(schema, dict):
+        return {k: _gemini_schema(v) for k, v in schema.items() if k != "additionalProperties"}
+    if isinstance(schema, list):
+        return [_gemini_schema(v) for v in schema]
+    return schema
+
+
+class GeminiBackend(Backend):
+    """Gemini REST generateContent"""
+
+    kind = "gemini"
+
+    def __init__(self, name: str, model: str, api_key: str = None, endpoint: str = None, **kwargs):
+        super().__init__(name, model, **kwargs)
+        self.api_key = api_key
+        self.base_url = _base_url(endpoint, "generativelanguage.googleapis.com")
+
+    def request(self, prompt, image_b64, mime_type, options):
+        model = self.model if self.model.startswith("models/") else f"models/{self.model}"
+        parts = [{"text": prompt}]
+        if image_b64 is not None:
+            parts.append({"inline_data": {"mime_type": mime_type, "data": image_b64}})
+        body = {"contents": [{"role": "user", "parts": parts}]}
+        config = {}
+        if options.get("max_output_tokens"):
+            config["maxOutputTokens"] = options["max_output_tokens"]
+        if options.get("schema"):
+            config["responseMimeType"] = "application/json"
+            config["responseSchema"] = _gemini_schema(options["schema"])
+        if config:
+            body["generationConfig"] = config
+        url = f"{self.base_url}/v1beta/{model}:generateContent"
+        return url, {"x-goog-api-key": self.api_key or ""}, body
+
+    def parse(self, data):
+        try:
+            parts = data["candidates"][0]["content"]["parts"]
+        except (KeyError, IndexError, TypeError):
+            raise ValueError(f"响应中没有候选结果: {str(data)[:200]}")
+        usage = data.get("usageMetadata") or {}
+        return ("".join(p.get("text", "") for p in parts),
+                int(usage.get("promptTokenCount", 0)), int(usage.get("candidatesTokenCount", 0)))
+
+
+class OpenAIBackend(Backend):
+    """
+    任何 OpenAI 兼容的 /chat/completions 接口（OpenAI、各类代理、vLLM / Ollama 等本地服务）
+    response_format: 结构化输出时使用的方式，json_schema（默认）/ json_object（只保证是 JSON，
+        适合不支持 json_schema 的服务）/ none（不发送 response_format）
+    """
+
+    kind = "openai"
+    RESPONSE_FORMATS = ("json_schema", "json_object", "none")
+
+    def __init__(self, name: str, model: str, api_key: str = None, base_url: str = None,
+                 response_format: str = "json_schema", **kwargs):
+        super().__init__(name, model, **kwargs)
+        if response_format not in self.RESPONSE_FORMATS:
+            raise ValueError(f"未知的 response_format: {response_format}")
+        self.api_key = api_key
+        self.base_url = _base_url(base_url, "api.openai.com/v1")
+        self.response_format = response_format
+
+    def request(self, prompt, image_b64, mime_type, options):
+        content = [{"type": "text", "text": prompt}]
+        if image_b64 is not None:
+            content.append({"type": "image_url", "image_url": {"url": f"data:{mime_type};base64,{image_b64}"}})
+        body = {"model": self.model, "messages": [{"role": "user", "content": content}]}
+        if options.get("max_output_tokens"):
+            body["max_tokens"] = options["max_output_tokens"]
+        if options.get("schema") and self.response_format == "json_schema":
+            body["response_format"] = {"type": "json_schema",
+                                       "json_schema": {"name": "action", "schema": options["schema"], "strict": True}}
+        elif options.get("schema") and self.response_format == "json_object":
+            body["response_format"] = {"type": "json_object"}
+        headers = {"Authorization": f"Bearer {self.api_key}"} if self.api_key else {}
+        return f"{self.base_url}/chat/completions", headers, body
+
+    def parse(self, data):
+        try:
+            text = data["choices"][0]["message"]["content"] or ""
+        except (KeyError, IndexError, TypeError):
+            raise ValueError(f"响应中没有 choices: {str(data)[:200]}")
+        usage = data.get("usage") or {}
+        return text, int(usage.get("prompt_tokens", 0)), int(usage.get("completion_tokens", 0))
+
+
+class LocalBackend(Backend):
+    """
+    本地替身：不发网络请求，直接返回固定回复（默认"等待"）。
+    作为最后的兜底，远程 backend 全部不可用时让主循环继续等待下一帧，而不是报错。
+    """
+
+    kind = "local"
+    local = True
+
+    def __init__(self, name: str = "local", reply: str = '{"task": "等待", "action": "wait"}', **kwargs):
+        kwargs.setdefault("fallback_only", True)
+        super().__init__(name, "local", **kwargs)
+        self.reply = reply
+
+    def respond(self, prompt: str, image_b64: str, mime_type: str, options: dict) -> str:
+        return self.reply
+
+
+BACKEND_TYPES = {"gemini": GeminiBackend, "openai": OpenAIBackend, "local": LocalBackend}
+
+
+def make_backend(config: dict) -> Backend:
+    """
+    由配置字典创建 backend。api_key_env 指定从哪个环境变量读取密钥（不要把密钥写进配置文件）。
+    """
+    config = dict(config)
+    kind = config.pop("type", "gemini")
+    if kind not in BACKEND_TYPES:
+        raise ValueError(f"未知的 backend 类型: {kind}")
+    config.pop("enabled", None)
+    key_env = config.pop("api_key_env", None)
+    if key_env:
+        config["api_key"] = os.getenv(key_env)
+    config.setdefault("name", kind)
+    return BACKEND_TYPES[kind](**config)
+
+
+def default_backends() -> list:
+    """没有 AI_BACKENDS 配置时：API_KEY / MODEL_NAME / API_ENDPOINT 指定的 Gemini"""
+    return [GeminiBackend("gemini", os.getenv("MODEL_NAME") or "", api_key=os.getenv("API_KEY"),
+                          endpoint=os.getenv("API_ENDPOINT"))]
+
+
+def load_backends(path: str = None) -> list:
+    path = path or os.getenv("AI_BACKENDS", "ai_backends.json")
+    if not path or not os.path.exists(path):
+        return default_backends()
+    with open(path, "r", encoding="utf-8") as f:
+        configs = json.load(f)
+    backends = [make_backend(c) for c in configs if c.get("enabled", True)]
+    if not backends:
+        raise ValueError(f"{path}: 没有启用任何 backend")
+    names = [b.name for b in backends]
+    if len(set(names)) != len(names):
+        raise ValueError(f"{path}: backend 名字重复")
+    print(f"[AI] 从 {path} 载入 backend: {', '.join(names)}")
+    return backends
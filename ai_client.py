@@ -0,0 +1,393 @@
+"""
+AI 请求层：限速、连接池、截止时间、重试、对冲请求，以及在多个 backend (见 ai_backends.py) 之间路由。
+"""
+import asyncio
+import base64
+import os
+import random
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import httpx
+
+from ai_backends import Backend, load_backends
+from metrics import count, observe
+
+
+class TokenBucket:
+    """
+    令牌桶限流：平均每秒 rate 个请求，最多攒 burst 个。
+    线程安全，可以在多个会话（线程 / 事件循环）之间共享同一个实例。
+    """
+
+    def __init__(self, rate: float, burst: int = 1):
+        self.rate = rate
+        self.burst = max(burst, 1)
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls) -> "TokenBucket":
+        """AI_RATE_PER_MIN (0 表示不限速) / AI_RATE_BURST"""
+        per_min = float(os.getenv("AI_RATE_PER_MIN", 0))
+        if per_min <= 0:
+            return None
+        return cls(per_min / 60.0, int(os.getenv("AI_RATE_BURST", 1)))
+
+    def _refill(self, now: float):
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def try_acquire(self) -> float:
+        """取一个令牌；成功返回 0，否则返回还需等待的秒数"""
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return 0.0
+            return (1 - self._tokens) / self.rate
+
+    def acquire(self, timeout: float = None) -> bool:
+        """阻塞直到取得令牌，超时返回 False"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            delay = self.try_acquire()
+            if not delay:
+                return True
+            if deadline is not None and time.monotonic() + delay > deadline:
+                return False
+            time.sleep(delay)
+
+    async def acquire_async(self):
+        while True:
+            delay = self.try_acquire()
+            if not delay:
+                return
+            await asyncio.sleep(delay)
+
+
+_limiter = None
+_limiter_lock = threading.Lock()
+
+
+def get_rate_limiter() -> TokenBucket:
+    """进程内所有会话共享的 AI 限速器；AI_RATE_PER_MIN 未设置时返回 None"""
+    global _limiter
+    if _limiter is None:
+        with _limiter_lock:
+            if _limiter is None:
+                _limiter = TokenBucket.from_env() or False
+    return _limiter or None
+
+
+class AIError(Exception):
+    """AI 请求在截止时间内没有成功"""
+
+
+class RetryableError(AIError):
+    def __init__(self, message: str, retry_after: float = None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class AIReply:
+    """一次成功的 AI 回复：文本、实际回答的 backend、耗时（秒）、请求体上传用时（秒，本地 backend 为 None）"""
+
+    __slots__ = ("text", "backend", "latency", "upload")
+
+    def __init__(self, text: str, backend: Backend, latency: float, upload: float = None):
+        self.text = text
+        self.backend = backend
+        self.latency = latency
+        self.upload = upload
+
+    @property
+    def fallback(self) -> bool:
+        """由兜底 backend（例如本地替身）给出，不应缓存"""
+        return self.backend.fallback_only
+
+    def __str__(self):
+        return self.text
+
+
+class AIClient:
+    """
+    在多个 backend 之间路由的 AI 客户端。
+
+    - 所有远程 backend 共用一个 httpx.Client 连接池（走 PROXY_URL），保持长连接
+    - 每次调用有总截止时间 deadline，单次尝试不超过 attempt_timeout
+    - 每次请求发给"最快的健康 backend"：按最近的 p50 耗时（错误率加权）排序，熔断中的跳过，
+      还没有耗时数据的 backend 优先尝试一次；explore 的概率随机挑一个，让慢的 backend 也能更新统计
+    - 失败时依次切换到下一个 backend；一轮全部失败后按带抖动的指数退避重试（尊重 Retry-After）
+    - hedge=True 时，请求超过该 backend 的 p95 耗时（至少 hedge_min_delay）仍未返回，
+      就向排在第二的 backend（只有一个时发给同一个）发一个相同请求，取先返回的结果
+    - 所有远程请求经过共享的 TokenBucket 限速和 max_concurrency 并发上限
+    """
+
+    def __init__(self, backends: list, proxy: str = None, deadline: float = 20.0, attempt_timeout: float = 10.0,
+                 connect_timeout: float = 5.0, max_retries: int = 3, backoff_base: float = 0.5,
+                 backoff_cap: float = 8.0, hedge: bool = False, hedge_min_samples: int = 20,
+                 hedge_min_delay: float = 1.0, max_concurrency: int = 4, limiter: TokenBucket = None,
+                 max_output_tokens: int = 0, explore: float = 0.05):
+        if not backends:
+            raise ValueError("至少需要一个 backend")
+        self.backends = list(backends)
+        self.deadline = deadline
+        self.attempt_timeout = attempt_timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self.hedge = hedge
+        self.hedge_min_samples = hedge_min_samples
+        self.hedge_min_delay = hedge_min_delay
+        self.limiter = limiter
+        self.max_output_tokens = max_output_tokens
+        self.explore = explore
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+        self._http = httpx.Client(
+            proxy=proxy or None,
+            timeout=httpx.Timeout(attempt_timeout, connect=connect_timeout),
+            limits=httpx.Limits(max_connections=max_concurrency * 2, max_keepalive_connections=max_concurrency * 2),
+        )
+        self._pool = None
+        self._pool_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self.counters = {"calls": 0, "attempts": 0, "retries": 0, "failovers": 0, "hedges": 0,
+                         "hedge_wins": 0, "failures": 0}
+
+    @classmethod
+    def from_env(cls, backends: list = None) -> "AIClient":
+        """
+        AI_BACKENDS (backend 配置文件，给出 backends 时不读取) / PROXY_URL，以及
+        AI_DEADLINE / AI_ATTEMPT_TIMEOUT / AI_MAX_RETRIES / AI_HEDGE / AI_HEDGE_MIN_DELAY / AI_MAX_CONCURRENCY /
+        AI_MAX_OUTPUT_TOKENS
+        """
+        return cls(
+            backends or load_backends(),
+            proxy=os.getenv("PROXY_URL"),
+            deadline=float(os.getenv("AI_DEADLINE", 20)),
+            attempt_timeout=float(os.getenv("AI_ATTEMPT_TIMEOUT", 10)),
+            max_retries=int(os.getenv("AI_MAX_RETRIES", 3)),
+            hedge=os.getenv("AI_HEDGE", "0") == "1",
+            hedge_min_delay=float(os.getenv("AI_HEDGE_MIN_DELAY", 1)),
+            max_concurrency=int(os.getenv("AI_MAX_CONCURRENCY", 4)),
+            limiter=get_rate_limiter(),
+            max_output_tokens=int(os.getenv("AI_MAX_OUTPUT_TOKENS", 0)),
+        )
+
+    # --- 路由 ---
+
+    def route(self) -> list:
+        """本次请求尝试 backend 的顺序：健康的按预计耗时排序，兜底 backend 放在最后"""
+        healthy = [b for b in self.backends if not b.fallback_only and b.stats.healthy()]
+
+        def expected(backend: Backend) -> float:
+            stats = backend.stats
+            if not len(stats.latency):
+                return 0.0
+            return stats.latency.quantile(0.5) * (1 + 2 * stats.error_rate())
+
+        order = sorted(healthy, key=expected)
+        if len(order) > 1 and random.random() < self.explore:
+            order.insert(0, order.pop(random.randrange(1, len(order))))
+        return order + [b for b in self.backends if b.fallback_only]
+
+    # --- 单次请求 ---
+
+    def _attempt(self, backend: Backend, payload: tuple, timeout: float) -> AIReply:
+        """向一个 backend 发送一次请求；可重试的错误抛出 RetryableError"""
+        prompt, image_b64, mime_type, options = payload
+        start = time.monotonic()
+        if backend.local:
+            text = backend.respond(prompt, image_b64, mime_type, options)
+            backend.stats.record_success(time.monotonic() - start)
+            return AIReply(text, backend, time.monotonic() - start)
+        url, headers, body = backend.request(prompt, image_b64, mime_type, options)
+        marks = {}
+
+        def trace(event: str, info: dict):
+            # httpcore 的连接事件：从开始发送请求头到请求体发送完毕即上传用时
+            if event.endswith("send_request_headers.started"):
+                marks["start"] = time.monotonic()
+            elif event.endswith("send_request_body.complete"):
+                marks["sent"] = time.monotonic()
+
+        try:
+            with self._slots:
+                self._count("attempts")
+                resp = self._http.post(
+                    url, json=body, headers=headers,
+                    timeout=httpx.Timeout(timeout, connect=min(timeout, self._http.timeout.connect or timeout)),
+                    extensions={"trace": trace},
+                )
+            if resp.status_code in (408, 429) or resp.status_code >= 500:
+                retry_after = resp.headers.get("retry-after")
+                try:
+                    retry_after = float(retry_after) if retry_after else None
+                except ValueError:
+                    retry_after = None
+                raise RetryableError(f"{backend.name}: HTTP {resp.status_code}: {resp.text[:200]}", retry_after)
+            if resp.status_code >= 400:
+                raise AIError(f"{backend.name}: HTTP {resp.status_code}: {resp.text[:200]}")
+            try:
+                text, tokens_in, tokens_out = backend.parse(resp.json())
+            except ValueError as e:
+                raise AIError(f"{backend.name}: {e}")
+        except httpx.TransportError as e:
+            # 超时、连接、协议、代理错误等都可能是暂时的（或只是这个 backend 的问题），交给故障切换和重试
+            backend.stats.record_failure()
+            raise RetryableError(f"{backend.name}: {type(e).__name__}: {e}")
+        except AIError:
+            backend.stats.record_failure()
+            raise
+        latency = time.monotonic() - start
+        backend.stats.record_success(latency, tokens_in, tokens_out, backend.cost(tokens_in, tokens_out))
+        upload = marks["sent"] - marks["start"] if "start" in marks and "sent" in marks else None
+        observe("ai_attempt", latency, backend=backend.name)
+        return AIReply(text, backend, latency, upload)
+
+    def _hedged_attempt(self, backend: Backend, backup_backend: Backend, payload: tuple,
+                        timeout: float) -> AIReply:
+        """超过 p95 没有返回就向 backup_backend 再发一个相同的请求，取先成功的那个"""
+        # p95 很小时也至少等 hedge_min_delay，避免轻微抖动就翻倍请求量
+        threshold = max(backend.stats.latency.quantile(0.95), self.hedge_min_delay)
+        with self._pool_lock:
+            if self._pool is None:
+                self._pool = ThreadPoolExecutor(max_workers=8, thread_name_prefix="ai-hedge")
+        primary = self._pool.submit(self._attempt, backend, payload, timeout)
+        done, _ = wait([primary], timeout=threshold)
+        if done:
+            return primary.result()
+        # 没有令牌时不发对冲请求，避免超出限速
+        if self.limiter is not None and self.limiter.try_acquire() > 0:
+            return primary.result()
+        self._count("hedges")
+        print(f"[AI] {backend.name} 超过 p95 ({threshold:.2f}s)，向 {backup_backend.name} 发出对冲请求")
+        backup = self._pool.submit(self._attempt, backup_backend, payload, max(timeout - threshold, 0.1))
+        pending = {primary, backup}
+        error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                try:
+                    reply = future.result()
+                except AIError as e:
+                    error = e
+                    continue
+                if future is backup:
+                    self._count("hedge_wins")
+                # 另一个请求无法中途取消，结果直接丢弃
+                return reply
+        raise error
+
+    # --- 对外接口 ---
+
+    def generate(self, prompt: str, image: bytes = None, mime_type: str = "image/jpeg", schema: dict = None,
+                 max_output_tokens: int = None) -> AIReply:
+        """
+        在 deadline 内返回回复 (AIReply)，失败抛出 AIError。
+        schema: 要求 backend 按此 JSON Schema 输出（结构化输出）；max_output_tokens 默认取客户端配置
+        """
+        self._count("calls")
+        options = {"max_output_tokens": max_output_tokens if max_output_tokens is not None else self.max_output_tokens,
+                   "schema": schema}
+        payload = (prompt, base64.b64encode(image).decode("ascii") if image is not None else None, mime_type, options)
+        start = time.monotonic()
+        last_error = None
+        # 返回过 4xx（408 / 429 除外）或无法解析的回复的 backend：之后几轮不再请求
+        rejected = set()
+        for attempt in range(self.max_retries + 1):
+            retry_after = None
+            order = [b for b in self.route() if b not in rejected]
+            if not order:
+                break
+            for i, backend in enumerate(order):
+                remaining = self.deadline - (time.monotonic() - start)
+                if remaining <= 0.1:
+                    break
+                if i:
+                    self._count("failovers")
+                    print(f"[AI] 切换到 {backend.name}")
+                if not backend.local and self.limiter is not None and not self.limiter.acquire(timeout=remaining):
+                    last_error = AIError("等待限速令牌超时")
+                    break
+                timeout = min(self.attempt_timeout, self.deadline - (time.monotonic() - start))
+                remote = [b for b in order if not b.local]
+                try:
+                    if (self.hedge and not backend.local
+                            and len(backend.stats.latency) >= self.hedge_min_samples):
+                        backup = next((b for b in remote if b is not backend), backend)
+                        return self._hedged_attempt(backend, backup, payload, timeout)
+                    return self._attempt(backend, payload, timeout)
+                except RetryableError as e:
+                    last_error = e
+                    if e.retry_after is not None:
+                        retry_after = max(retry_after or 0, e.retry_after)
+                except AIError as e:
+                    # 4xx / 响应格式错误：同一个 backend 重试没有意义，但其他 backend 可能可用
+                    last_error = e
+                    rejected.add(backend)
+                print(f"[AI] {last_error}")
+            if attempt == self.max_retries or all(b in rejected for b in order):
+                break
+            # full jitter：在 [0, min(cap, base * 2^n)] 中随机等待
+            delay = random.uniform(0, min(self.backoff_cap, self.backoff_base * 2 ** attempt))
+            if retry_after is not None:
+                delay = max(delay, retry_after)
+            if time.monotonic() - start + delay >= self.deadline:
+                break
+            self._count("retries")
+            print(f"[AI] 所有 backend 均失败，{delay:.2f}s 后重试 ({attempt + 1}/{self.max_retries})")
+            time.sleep(delay)
+        self._count("failures")
+        raise AIError(f"{self.deadline:.0f}s 内未能完成请求: {last_error}")
+
+    def _count(self, key: str):
+        with self._stats_lock:
+            self.counters[key] += 1
+        count(f"ai_{key}")
+
+    def stats(self) -> dict:
+        with self._stats_lock:
+            stats = dict(self.counters)
+        stats["backends"] = {b.name: b.stats.to_dict() for b in self.backends}
+        return stats
+
+    def warmup(self):
+        """提前建立到各远程 backend (经代理) 的 TLS 连接"""
+        for backend in self.backends:
+            if backend.local:
+                continue
+            try:
+                self._http.head(backend.base_url, timeout=5)
+            except Exception as e:
+                print(f"[AI] 预连接 {backend.name} 失败: {e}")
+
+    def close(self):
+        self._http.close()
+        if self._pool is not None:
+            self._pool.shutdown(wait=False)
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_ai_client() -> AIClient:
+    """进程内唯一的 AI 客户端，所有会话共用同一个连接池和限速器"""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = AIClient.from_env()
+    return _client
+
+
+def set_ai_client(client: AIClient) -> None:
+    """替换全局 AI 客户端（例如回放基准测试中换成不发网络请求的替身）"""
+    global _client
+    with _client_lock:
+        _client = client
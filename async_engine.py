@@ -0,0 +1,334 @@
+"""
+基于 playwright.async_api 的流水线引擎。
+
+同步版 main.main 每轮严格按 截图 → OCR → Gemini → 点击 → sleep 顺序执行，等待 AI 时浏览器空闲。
+这里拆成三个并发阶段，阶段之间用有界队列连接：
+
+    capture (截图) --frames--> analyze (检测器/OCR/固定逻辑, AI 请求异步发出) --decisions--> act (点击)
+
+AI 请求第 N 帧时，第 N+1 帧已经在截图和 OCR；
+决策执行前如果已经有更新的帧表明画面变了（或者该帧截取于上一次操作完成之前），则丢弃这个过期决策。
+
+用法: python async_engine.py [--browser chromium|edge|remote]
+"""
+import argparse
+import asyncio
+import os
+import threading
+import time
+
+from playwright.async_api import async_playwright
+
+import main as bot
+from capture import Capture
+from frame import Frame
+from frame_cache import FrameCache
+from preclick import PreClickVerifier
+from replay import get_replay_recorder
+from ocr_region import warmup_ocr_async
+from waiter import Waiter
+
+
+class SyncPage:
+    """
+    把 async Page 包装成 Capture / Waiter / main.execute_action 需要的同步接口。
+    只能在工作线程里调用：每个操作提交给事件循环执行并等待结果，这样点击、等待画面稳定、
+    点击前核对都和同步版走同一套代码。
+    """
+
+    def __init__(self, page, loop: asyncio.AbstractEventLoop):
+        self.page = page
+        self.loop = loop
+        self.mouse = _SyncMouse(self)
+
+    def call(self, coro):
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result()
+
+    @property
+    def viewport_size(self):
+        return self.page.viewport_size
+
+    def screenshot(self, **kwargs) -> bytes:
+        return self.call(self.page.screenshot(**kwargs))
+
+    def evaluate(self, expression: str, arg=None):
+        return self.call(self.page.evaluate(expression, arg))
+
+
+class _SyncMouse:
+    def __init__(self, page: SyncPage):
+        self._page = page
+
+    def move(self, x, y):
+        self._page.call(self._page.page.mouse.move(x, y))
+
+    def down(self):
+        self._page.call(self._page.page.mouse.down())
+
+    def up(self):
+        self._page.call(self._page.page.mouse.up())
+
+    def click(self, x, y):
+        self._page.call(self._page.page.mouse.click(x, y))
+
+
+class Decision:
+    __slots__ = ("seq", "frame", "coords", "signatures")
+
+    def __init__(self, seq: int, frame: Frame, coords: dict, signatures: dict):
+        self.seq = seq
+        self.frame = frame
+        self.coords = coords
+        self.signatures = signatures
+
+
+async def put_latest(queue: asyncio.Queue, item):
+    """队列满时丢弃最旧的一项，保证消费者拿到的总是最新的数据"""
+    while queue.full():
+        try:
+            queue.get_nowait()
+        except asyncio.QueueEmpty:
+            break
+    await queue.put(item)
+
+
+class Pipeline:
+    """
+    interval: 两次截图之间的最小间隔（秒）
+    ai_concurrency: 本会话同时在途的 AI 请求数
+    name: 会话名，用于日志
+    executor: 执行 OCR / 检测的线程池，None 时使用事件循环默认线程池；多会话时共享同一个
+    ai_slots: 全局 AI 并发信号量，多会话时共享；None 时每个会话各自一个
+    """
+
+    def __init__(self, page, interval: float = 0.5, ai_concurrency: int = 1, jpeg_quality: int = 0,
+                 name: str = "", executor=None, ai_slots: asyncio.Semaphore = None):
+        self.page = page
+        self.name = name
+        self.interval = interval
+        self.jpeg_quality = jpeg_quality
+        self.executor = executor
+        self.frames = asyncio.Queue(maxsize=1)
+        self.decisions = asyncio.Queue(maxsize=4)
+        self.ai_concurrency = ai_concurrency
+        self.ai_slots = ai_slots or asyncio.Semaphore(ai_concurrency)
+        self._ai_inflight = 0
+        self.frame_cache = FrameCache.from_env(bot.OCR_REGIONS)
+        self.seq = 0
+        self.latest_signatures = {}
+        self.latest_seq = 0
+        self.last_action_done = 0.0
+        self.last_executed_seq = 0
+        self.stats = {"frames": 0, "analyzed": 0, "ai_requests": 0, "actions": 0, "stale": 0}
+        self._ai_tasks = set()
+        # 执行阶段的同步接口，事件循环启动后在 run() 里创建
+        self.sync_page = None
+        self.capture = None
+        self.waiter = None
+        self.verifier = None
+
+    @classmethod
+    def from_env(cls, page, **kwargs) -> "Pipeline":
+        """ASYNC_INTERVAL / ASYNC_AI_CONCURRENCY / CAPTURE_MODE=jpeg 时使用 CAPTURE_QUALITY"""
+        quality = int(os.getenv("CAPTURE_QUALITY", 80)) if os.getenv("CAPTURE_MODE") == "jpeg" else 0
+        return cls(
+            page,
+            interval=float(os.getenv("ASYNC_INTERVAL", 0.5)),
+            ai_concurrency=int(os.getenv("ASYNC_AI_CONCURRENCY", 1)),
+            jpeg_quality=quality,
+            **kwargs,
+        )
+
+    @property
+    def tag(self) -> str:
+        return f"[{self.name}] " if self.name else ""
+
+    async def in_executor(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.executor, func, *args)
+
+    async def viewport(self) -> tuple:
+        viewport = self.page.viewport_size
+        if viewport is None:
+            # no_viewport 的上下文（type=context）和 CDP 接管的浏览器没有固定视口，按窗口实际大小
+            width, height = await self.page.evaluate("[innerWidth, innerHeight]")
+            return width, height
+        return viewport["width"], viewport["height"]
+
+    async def capture_loop(self):
+        while True:
+            if bot.AutomationState.paused:
+                await asyncio.sleep(0.5)
+                continue
+            start = time.monotonic()
+            if self.jpeg_quality:
+                data = await self.page.screenshot(type="jpeg", quality=self.jpeg_quality)
+            else:
+                data = await self.page.screenshot()
+            self.seq += 1
+            self.stats["frames"] += 1
+            await put_latest(self.frames, (self.seq, Frame(data, viewport=await self.viewport(), captured_at=time.time())))
+            await asyncio.sleep(max(self.interval - (time.monotonic() - start), 0))
+
+    async def analyze_loop(self):
+        while True:
+            seq, frame = await self.frames.get()
+            vw, vh = frame.viewport
+            # 签名计算和 OCR 都是 CPU 密集型，放到线程里，不阻塞事件循环
+            signatures = await self.in_executor(self.frame_cache.observe, frame)
+            self.latest_signatures, self.latest_seq = signatures, seq
+            self.stats["analyzed"] += 1
+
+            coords = self.frame_cache.get("decision", bot.DECISION_REGIONS)
+            if coords is None:
+                coords, msginfo = await self.in_executor(bot.decide_local, frame, vw, vh, self.frame_cache)
+                recorder = get_replay_recorder()
+                if recorder is not None and coords is not None:
+                    await self.in_executor(recorder.record, frame, coords,
+                                           self.frame_cache.peek("ocr", bot.OCR_REGIONS), "local")
+                if coords is None:
+                    # 交给 AI，不等待结果，继续分析下一帧
+                    task = asyncio.create_task(self.ask_ai(seq, frame, signatures, msginfo))
+                    self._ai_tasks.add(task)
+                    task.add_done_callback(self._ai_tasks.discard)
+                    continue
+                self.frame_cache.put("decision", coords)
+            else:
+                print(f"{self.tag}[帧缓存] 画面未变化，复用上一轮决策 ({coords.get('task')})")
+
+            if coords.get("action") != "wait":
+                await put_latest(self.decisions, Decision(seq, frame, coords, signatures))
+
+    async def ask_ai(self, seq: int, frame: Frame, signatures: dict, msginfo: str):
+        if self._ai_inflight >= self.ai_concurrency:
+            # 本会话已有请求在途，新帧的请求直接放弃，等下一帧再判断
+            return
+        self._ai_inflight += 1
+        try:
+            # 共享信号量按先来后到唤醒，多个会话轮流使用 AI
+            async with self.ai_slots:
+                if self.changed_since(seq, signatures):
+                    # 排队等待期间画面已经变了，不再为旧画面请求 AI
+                    self.stats["stale"] += 1
+                    return
+                self.stats["ai_requests"] += 1
+                vw, vh = frame.viewport
+                coords = await asyncio.to_thread(bot.decide_action_with_ai, frame, vw, vh, msginfo)
+            recorder = get_replay_recorder()
+            if recorder is not None:
+                await asyncio.to_thread(recorder.record, frame, coords, (False, msginfo), "ai")
+        finally:
+            self._ai_inflight -= 1
+        if coords and coords.get("action") != "wait":
+            await put_latest(self.decisions, Decision(seq, frame, coords, signatures))
+
+    def is_stale(self, decision: Decision) -> bool:
+        """决策所基于的帧已经过时：截取于上一次操作完成之前，或者之后的帧画面已经变化"""
+        if decision.seq <= self.last_executed_seq:
+            return True
+        if decision.frame.captured_at is not None and decision.frame.captured_at < self.last_action_done:
+            return True
+        return self.changed_since(decision.seq, decision.signatures)
+
+    def changed_since(self, seq: int, signatures: dict) -> bool:
+        """第 seq 帧之后分析过的帧画面是否已经变化"""
+        if self.latest_seq > seq:
+            for name, old in signatures.items():
+                new = self.latest_signatures.get(name)
+                if new is not None and self.frame_cache.changed(old, new):
+                    return True
+        return False
+
+    async def act_loop(self):
+        while True:
+            decision = await self.decisions.get()
+            if bot.AutomationState.paused:
+                continue
+            if self.is_stale(decision):
+                self.stats["stale"] += 1
+                print(f"{self.tag}[流水线] 丢弃过期决策 #{decision.seq} ({decision.coords.get('task')})")
+                continue
+            await self.execute(decision.coords, *decision.frame.viewport)
+            self.last_executed_seq = decision.seq
+            self.last_action_done = time.time()
+            self.stats["actions"] += 1
+
+    async def execute(self, coords: dict, vw: int, vh: int):
+        """与同步版共用 main.execute_action：点击前核对、按任务类别等待画面稳定、长按直到自动按钮变化"""
+        print(f"{self.tag}Task: {coords.get('task', 'unknown')}")
+        await asyncio.to_thread(bot.execute_action, self.sync_page, coords, vw, vh, self.waiter, self.verifier)
+
+    def probe(self) -> Frame:
+        """Waiter 的廉价截图，在执行线程里调用"""
+        return self.capture.probe(self.sync_page.call(self.viewport()))
+
+    async def report_loop(self, every: float = 60):
+        while True:
+            await asyncio.sleep(every)
+            print(f"{self.tag}[流水线] {self.stats}")
+
+    async def run(self, report: bool = True):
+        self.sync_page = SyncPage(self.page, asyncio.get_running_loop())
+        self.capture = Capture(self.sync_page, mode="jpeg" if self.jpeg_quality else "full",
+                               quality=self.jpeg_quality or 80)
+        self.waiter = Waiter.from_env(self.probe, bot.OCR_REGIONS)
+        self.verifier = PreClickVerifier.from_env(self.capture, self.frame_cache)
+        tasks = [
+            asyncio.create_task(self.capture_loop()),
+            asyncio.create_task(self.analyze_loop()),
+            asyncio.create_task(self.act_loop()),
+        ]
+        if report:
+            tasks.append(asyncio.create_task(self.report_loop()))
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            for task in tasks + list(self._ai_tasks):
+                task.cancel()
+
+
+async def launch(p, browser_type: str):
+    """与 main.main 相同的浏览器启动逻辑 (async 版)，返回 context"""
+    if browser_type.lower() == "edge":
+        print("使用 Microsoft Edge 浏览器")
+        return await p.chromium.launch_persistent_context("./browser_data_edge", headless=False, channel="msedge")
+    if browser_type.lower() == "remote":
+        print("连接远程浏览器 (ws://localhost:9222)")
+        browser = await p.chromium.connect_over_cdp("ws://localhost:9222")
+        return browser.contexts[0] if browser.contexts else await browser.new_context()
+    print("使用 Chromium 浏览器")
+    return await p.chromium.launch_persistent_context("./browser_data", headless=False)
+
+
+async def run(browser_type: str = "chromium"):
+    print("Starting DA FU WENG (大富翁) automation (async pipeline)...")
+    async with async_playwright() as p:
+        context = await launch(p, browser_type)
+        page = context.pages[0] if context.pages else await context.new_page()
+        try:
+            print(f"Navigating to {bot.TARGET_URL}...")
+            await page.goto(bot.TARGET_URL)
+            warmup_ocr_async()
+
+            print("\n" + "="*50)
+            print("请在浏览器中手动登录游戏")
+            print("登录完成后，按回车键开始自动化...")
+            print("="*50 + "\n")
+            await asyncio.to_thread(input)
+
+            threading.Thread(target=bot.keyboard_listener, daemon=True).start()
+            print("开始流水线自动化。按 Ctrl+C 停止，按 'P' 键暂停/恢复。")
+            await Pipeline.from_env(page).run()
+        finally:
+            await context.close()
+            print("浏览器已关闭。")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='大富翁游戏自动化 (异步流水线)')
+    parser.add_argument('--browser', type=str, choices=['chromium', 'edge', 'remote'], default='chromium',
+                        help='浏览器类型 (默认: chromium)')
+    args = parser.parse_args()
+    try:
+        asyncio.run(run(browser_type=args.browser))
+    except KeyboardInterrupt:
+        print("\n自动化被用户停止。")
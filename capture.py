@@ -0,0 +1,173 @@
+"""
+截图采集层。
+
+CAPTURE_MODE:
+- full:       每轮 page.screenshot() 整帧 PNG（默认，与原来一致）
+- jpeg:       整帧 JPEG (CAPTURE_QUALITY)，编码比 PNG 快得多，适合不需要无损的场景
+- clip:       只截取 OCR / 检测器需要的区域 (clip=)，整帧在 AI 真正需要时才截取
+- screencast: 订阅 CDP Page.startScreencast，持续接收 JPEG 帧，取帧不再需要一次截图往返
+"""
+import base64
+import io
+import os
+import time
+
+import numpy as np
+from PIL import Image
+
+from frame import Frame
+from metrics import span
+
+CAPTURE_MODES = ("full", "jpeg", "clip", "screencast")
+# probe 截图时隐藏点击指示器 (main.click_indicator_script)：它的脉冲动画会被当成画面对点击的反应
+PROBE_STYLE = "#click-indicator { visibility: hidden !important; }"
+
+
+def _decode(data: bytes) -> np.ndarray:
+    with Image.open(io.BytesIO(data)) as img:
+        return np.asarray(img.convert("RGB"))
+
+
+class Capture:
+    def __init__(self, page, mode: str = "full", quality: int = 80, regions=None):
+        if mode not in CAPTURE_MODES:
+            raise ValueError(f"未知的 CAPTURE_MODE: {mode}")
+        self.page = page
+        self.mode = mode
+        self.quality = quality
+        # clip 模式下每帧截取的区域 (left, top, right, bottom)
+        self.regions = [tuple(r) for r in (regions or [])]
+        self._cdp = None
+        self._latest = None      # (data, received_at)
+        self._pending_ack = None
+        self._consumed = None
+        self.frames = 0
+        self.full_captures = 0
+
+    @classmethod
+    def from_env(cls, page, regions=None) -> "Capture":
+        """CAPTURE_MODE / CAPTURE_QUALITY"""
+        return cls(
+            page,
+            mode=os.getenv("CAPTURE_MODE", "full"),
+            quality=int(os.getenv("CAPTURE_QUALITY", 80)),
+            regions=regions,
+        )
+
+    def full(self) -> bytes:
+        """截取整帧；jpeg / clip / screencast 模式下使用 JPEG"""
+        self.full_captures += 1
+        if self.mode == "full":
+            return self.page.screenshot()
+        return self.page.screenshot(type="jpeg", quality=self.quality)
+
+    def clip(self, coords, style: str = None) -> np.ndarray:
+        """截取单个区域 (无损 PNG，供 OCR 使用)"""
+        left, top, right, bottom = coords
+        options = {"style": style} if style else {}
+        data = self.page.screenshot(clip={"x": left, "y": top, "width": right - left, "height": bottom - top},
+                                    **options)
+        return _decode(data)
+
+    def region(self, coords) -> np.ndarray:
+        """
+        只取一个区域（点击前核对用）：screencast 模式从最新推送帧裁剪，其他模式 clip 截图。
+        不计入 frames / full_captures。
+        """
+        if self.mode == "screencast":
+            data = self._screencast_frame()
+            if data is not None:
+                return Frame(data).crop(coords)
+        return self.clip(coords)
+
+    def grab(self, viewport: tuple) -> Frame:
+        """采集一帧"""
+        self.frames += 1
+        now = time.time()
+        with span("capture", mode=self.mode):
+            if self.mode == "clip":
+                regions = {coords: self.clip(coords) for coords in self.regions}
+                return Frame(viewport=viewport, captured_at=now, regions=regions, loader=self.full)
+            if self.mode == "screencast":
+                data = self._screencast_frame()
+                if data is not None:
+                    return Frame(data, viewport=viewport, captured_at=now)
+            return Frame(self.full(), viewport=viewport, captured_at=now)
+
+    def probe(self, viewport: tuple = None, quality: int = 30) -> Frame:
+        """
+        只用来判断画面是否变化的廉价截图：clip 模式截取区域，screencast 模式取最新推送帧，
+        其他模式截取低质量 JPEG。不计入 frames / full_captures。
+        截图时隐藏点击指示器；screencast 推送的帧做不到，指示器仍然可见。
+        """
+        now = time.time()
+        if self.mode == "clip":
+            regions = {coords: self.clip(coords, PROBE_STYLE) for coords in self.regions}
+            return Frame(viewport=viewport, captured_at=now, regions=regions, loader=self.full)
+        if self.mode == "screencast":
+            data = self._screencast_frame()
+            if data is not None:
+                return Frame(data, viewport=viewport, captured_at=now)
+        return Frame(self.page.screenshot(type="jpeg", quality=quality, style=PROBE_STYLE),
+                     viewport=viewport, captured_at=now)
+
+    # --- CDP screencast ---
+
+    def start(self, viewport: tuple = None):
+        """screencast 模式下开始推流，其他模式无操作"""
+        if self.mode != "screencast" or self._cdp is not None:
+            return
+        try:
+            self._cdp = self.page.context.new_cdp_session(self.page)
+        except Exception as e:
+            print(f"[采集] 无法创建 CDP 会话，改用整帧截图: {e}")
+            self.mode = "jpeg"
+            return
+        self._cdp.on("Page.screencastFrame", self._on_frame)
+        params = {"format": "jpeg", "quality": self.quality, "everyNthFrame": 1}
+        if viewport:
+            params["maxWidth"], params["maxHeight"] = viewport
+        self._cdp.send("Page.startScreencast", params)
+        print("[采集] 已开始 CDP screencast")
+
+    def stop(self):
+        if self._cdp is None:
+            return
+        try:
+            self._cdp.send("Page.stopScreencast")
+            self._cdp.detach()
+        except Exception:
+            pass
+        self._cdp = None
+
+    def _on_frame(self, params: dict):
+        # 只记录，不在事件回调里调用 send；ack 在取帧时发送，浏览器收到 ack 后才推下一帧
+        self._latest = (base64.b64decode(params["data"]), time.time())
+        self._pending_ack = params["sessionId"]
+
+    def _ack(self):
+        if self._pending_ack is not None and self._cdp is not None:
+            session_id, self._pending_ack = self._pending_ack, None
+            try:
+                self._cdp.send("Page.screencastFrameAck", {"sessionId": session_id})
+            except Exception as e:
+                print(f"[采集] screencast ack 失败: {e}")
+
+    def _screencast_frame(self, timeout: float = 0.1) -> bytes:
+        """
+        返回最新的 screencast 画面。浏览器只在画面重绘时推帧，
+        短时间内没有新帧说明画面没变，直接复用上一帧；从未收到过帧时返回 None（调用方改用截图）。
+        """
+        if self._cdp is None:
+            return None
+        self._ack()
+        deadline = time.monotonic() + timeout
+        while self._latest is None or self._latest is self._consumed:
+            if time.monotonic() >= deadline:
+                break
+            # 同步 API 在等待期间分发 CDP 事件
+            self.page.wait_for_timeout(10)
+        if self._latest is None:
+            return None
+        self._consumed = self._latest
+        return self._latest[0]
@@ -0,0 +1,216 @@
+"""
+decide_action_with_ai 的决策缓存 (LRU + TTL)。
+
+确认弹窗、蛋糕塔、相同的事件弹窗一天会重复出现上千次。
+用截图的差值哈希 (dHash)、颜色缩略图加 OCR 文本作为指纹，命中时直接返回之前解析好的动作字典，
+不再调用 model.generate_content。可选地用 sqlite 持久化，重启后依然有效。
+
+dHash 只看灰度的明暗走向，分不出只有颜色或一个小按钮不同的画面（橙色 / 绿色骰子、置灰的按钮）。
+所以指纹里还有整帧和自动按钮区域的颜色缩略图，每一格的颜色差都在 max_color_diff 以内才算同一画面。
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+from PIL import Image
+
+from frame import Frame
+from regions import COORDS
+
+BASE_WIDTH = int(os.getenv("BASE_WIDTH", 1280))
+BASE_HEIGHT = int(os.getenv("BASE_HEIGHT", 720))
+
+
+def dhash(img: Image.Image, width: int = 16, height: int = 16) -> int:
+    """
+    差值哈希：缩小成 (width+1) x height 的灰度图，比较水平相邻像素的亮度，得到 width*height 位整数。
+    对压缩噪声、轻微亮度变化不敏感。
+    """
+    small = np.asarray(img.convert("L").resize((width + 1, height), Image.Resampling.BOX), dtype=np.int16)
+    bits = (small[:, 1:] > small[:, :-1]).ravel()
+    return int.from_bytes(np.packbits(bits).tobytes(), "big")
+
+
+def color_signature(frame: Frame) -> bytes:
+    """整帧 16x9 和自动按钮区域 8x8 的 RGB 缩略图（逐格平均颜色），拼成字节串"""
+    sx, sy = frame.width / BASE_WIDTH, frame.height / BASE_HEIGHT
+    left, top, right, bottom = COORDS
+    button = frame.crop((int(left * sx), int(top * sy), int(right * sx), int(bottom * sy)))
+    whole = frame.resized((16, 9), Image.Resampling.BOX)
+    button = Image.fromarray(np.ascontiguousarray(button)).resize((8, 8), Image.Resampling.BOX)
+    return np.asarray(whole).tobytes() + np.asarray(button).tobytes()
+
+
+def _color_diff(a: bytes, b: bytes) -> int:
+    if len(a) != len(b):
+        return 255
+    return int(np.abs(np.frombuffer(a, np.uint8).astype(np.int16) - np.frombuffer(b, np.uint8)).max())
+
+
+def _normalize_text(text: str) -> str:
+    return "".join((text or "").split())
+
+
+def _restore_clicks(action: dict) -> dict:
+    # JSON 中的 [x, y] 还原成 main 循环使用的 (x, y)
+    if "clicks" in action:
+        action["clicks"] = [tuple(c) for c in action["clicks"]]
+    return action
+
+
+class DecisionCache:
+    """
+    指纹相同 (OCR 文本一致、dHash 汉明距离 <= max_distance、颜色缩略图每格差值 <= max_color_diff)
+    即视为同一画面；有多条符合时取最接近的一条。
+    max_size 条以内按最近使用淘汰（数据库同样只保留最新的 max_size 条），超过 ttl 秒的条目视为过期。
+    """
+
+    def __init__(self, max_size: int = 1000, ttl: float = 6 * 3600, max_distance: int = 4,
+                 max_color_diff: int = 16, db_path: str = None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.max_distance = max_distance
+        self.max_color_diff = max_color_diff
+        self.db_path = db_path
+        self._entries = OrderedDict()  # (hash, text, colors) -> (action, created)
+        self._lock = threading.Lock()
+        self._db = None
+        self.lookups = 0
+        self.hits = 0
+        self.api_calls = 0
+        if db_path:
+            self._open_db()
+
+    @classmethod
+    def from_env(cls) -> "DecisionCache":
+        """AI_CACHE_SIZE / AI_CACHE_TTL / AI_CACHE_MAX_DISTANCE / AI_CACHE_MAX_COLOR_DIFF / AI_CACHE_DB"""
+        return cls(
+            max_size=int(os.getenv("AI_CACHE_SIZE", 1000)),
+            ttl=float(os.getenv("AI_CACHE_TTL", 6 * 3600)),
+            max_distance=int(os.getenv("AI_CACHE_MAX_DISTANCE", 4)),
+            max_color_diff=int(os.getenv("AI_CACHE_MAX_COLOR_DIFF", 16)),
+            db_path=os.getenv("AI_CACHE_DB", "") or None,
+        )
+
+    def _open_db(self):
+        try:
+            self._db = sqlite3.connect(self.db_path, check_same_thread=False)
+            # 旧版本的表没有颜色指纹，里面的决策可能把颜色不同的画面混在一起，直接丢弃
+            self._db.execute("DROP TABLE IF EXISTS decisions")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS decisions_v2 ("
+                "hash TEXT NOT NULL, text TEXT NOT NULL, colors TEXT NOT NULL, action TEXT NOT NULL, "
+                "created REAL NOT NULL, PRIMARY KEY (hash, text, colors))"
+            )
+            self._prune_db()
+            self._db.commit()
+            rows = self._db.execute(
+                "SELECT hash, text, colors, action, created FROM decisions_v2 ORDER BY created DESC LIMIT ?",
+                (self.max_size,)
+            ).fetchall()
+        except sqlite3.Error as e:
+            print(f"[AI缓存] 打开数据库失败，仅使用内存缓存: {e}")
+            self._db = None
+            return
+        for h, text, colors, action, created in reversed(rows):
+            self._entries[(int(h, 16), text, bytes.fromhex(colors))] = (_restore_clicks(json.loads(action)), created)
+        print(f"[AI缓存] 从 {self.db_path} 载入 {len(rows)} 条决策")
+
+    def _prune_db(self):
+        """删除过期的行和最新 max_size 条以外的行"""
+        self._db.execute("DELETE FROM decisions_v2 WHERE created < ?", (time.time() - self.ttl,))
+        self._db.execute(
+            "DELETE FROM decisions_v2 WHERE rowid NOT IN "
+            "(SELECT rowid FROM decisions_v2 ORDER BY created DESC LIMIT ?)", (self.max_size,)
+        )
+
+    def key(self, frame: Frame, text: str = "") -> tuple:
+        return (frame.memo("dhash", lambda: dhash(frame.gray())), _normalize_text(text),
+                frame.memo("color_signature", lambda: color_signature(frame)))
+
+    def _closest(self, key: tuple):
+        """OCR 文本相同、在阈值以内且距离最小的条目"""
+        if key in self._entries:
+            return key
+        h, text, colors = key
+        best, best_distance = None, None
+        for k in self._entries:
+            if k[1] != text:
+                continue
+            distance = bin(k[0] ^ h).count("1")
+            if distance > self.max_distance:
+                continue
+            color_diff = _color_diff(k[2], colors)
+            if color_diff > self.max_color_diff:
+                continue
+            if best is None or (distance, color_diff) < best_distance:
+                best, best_distance = k, (distance, color_diff)
+        return best
+
+    def get(self, key: tuple) -> dict:
+        """返回缓存的动作字典副本，未命中返回 None"""
+        now = time.time()
+        with self._lock:
+            self.lookups += 1
+            match = self._closest(key)
+            if match is None:
+                return None
+            action, created = self._entries[match]
+            if now - created > self.ttl:
+                del self._entries[match]
+                return None
+            self._entries.move_to_end(match)
+            self.hits += 1
+            return dict(action)
+
+    def put(self, key: tuple, action: dict):
+        created = time.time()
+        with self._lock:
+            self._entries[key] = (dict(action), created)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+            if self._db is not None:
+                try:
+                    self._db.execute(
+                        "INSERT OR REPLACE INTO decisions_v2 (hash, text, colors, action, created) VALUES (?, ?, ?, ?, ?)",
+                        (format(key[0], "x"), key[1], key[2].hex(), json.dumps(action, ensure_ascii=False), created),
+                    )
+                    self._prune_db()
+                    self._db.commit()
+                except sqlite3.Error as e:
+                    print(f"[AI缓存] 写入数据库失败: {e}")
+
+    def record_api_call(self):
+        with self._lock:
+            self.api_calls += 1
+
+    def stats(self) -> dict:
+        return {
+            "lookups": self.lookups,
+            "hits": self.hits,
+            "hit_ratio": self.hits / self.lookups if self.lookups else 0.0,
+            "api_calls": self.api_calls,
+            "api_calls_saved": self.hits,
+            "size": len(self._entries),
+        }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_decision_cache() -> DecisionCache:
+    """进程内唯一的决策缓存；AI_CACHE=0 时返回 None"""
+    global _cache
+    if os.getenv("AI_CACHE", "1") == "0":
+        return None
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = DecisionCache.from_env()
+    return _cache
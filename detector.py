@@ -0,0 +1,281 @@
+"""
+颜色探针 + 模板匹配检测器。
+
+骰子按钮、自动标识、常见的确认/关闭按钮每次都画在同样的位置、同样的样子，
+在 OCR 和 AI 之前用 numpy 直接比对像素即可在几毫秒内给出决策。
+模板库位于 TEMPLATE_DIR/library.json，所有坐标都基于 BASE_WIDTH x BASE_HEIGHT 基准分辨率。
+"""
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+from PIL import Image
+
+from frame import Frame, as_frame
+
+BASE_WIDTH = int(os.getenv("BASE_WIDTH", 1280))
+BASE_HEIGHT = int(os.getenv("BASE_HEIGHT", 720))
+TEMPLATE_DIR = os.getenv("TEMPLATE_DIR", "templates")
+LIBRARY_FILE = "library.json"
+
+
+def to_array(image) -> np.ndarray:
+    """接受 Frame / PNG 字节 / PIL 图片 / RGB 数组，返回 RGB 数组"""
+    return as_frame(image).array
+
+
+def to_gray(arr: np.ndarray) -> np.ndarray:
+    """RGB 数组转 float32 灰度 (ITU-R 601-2)"""
+    return arr[..., :3] @ np.array([0.299, 0.587, 0.114], dtype=np.float32)
+
+
+class ColorProbe:
+    """
+    颜色探针：在若干个基准坐标点附近取平均颜色，与期望颜色比较。
+    所有点的颜色都落在 tolerance 以内时才算匹配。
+    """
+
+    def __init__(self, name: str, points, color, action: dict, tolerance: float = 30,
+                 radius: int = 2, enabled: bool = True, **_):
+        self.name = name
+        self.points = [tuple(p) for p in points]
+        self.colors = [tuple(c) for c in color] if isinstance(color[0], (list, tuple)) else [tuple(color)] * len(self.points)
+        self.action = action
+        self.tolerance = tolerance
+        self.radius = radius
+        self.enabled = enabled
+
+    def boxes(self, width: int, height: int) -> list:
+        """在当前分辨率下需要读取的像素区域 (left, top, right, bottom)"""
+        sx, sy = width / BASE_WIDTH, height / BASE_HEIGHT
+        r = self.radius
+        return [(max(int(bx * sx) - r, 0), max(int(by * sy) - r, 0), int(bx * sx) + r + 1, int(by * sy) + r + 1)
+                for bx, by in self.points]
+
+    def match(self, frame: Frame) -> float:
+        """返回置信度 0~1，任一点不匹配返回 0"""
+        worst = 0.0
+        for box, color in zip(self.boxes(frame.width, frame.height), self.colors):
+            patch = frame.crop(box)[..., :3]
+            if not patch.size:
+                return 0.0
+            diff = np.abs(patch.reshape(-1, 3).mean(axis=0) - color).max()
+            if diff > self.tolerance:
+                return 0.0
+            worst = max(worst, diff)
+        return 1.0 - worst / (2 * self.tolerance) if self.tolerance else 1.0
+
+
+class Template:
+    """
+    模板匹配：在 search 区域 (基准坐标) 内做归一化互相关 (等价于 TM_CCOEFF_NORMED)。
+    """
+
+    def __init__(self, name: str, file: str, search, action: dict, threshold: float = 0.9,
+                 enabled: bool = True, directory: str = TEMPLATE_DIR, **_):
+        self.name = name
+        self.file = file
+        self.search = tuple(search)
+        self.action = action
+        self.threshold = threshold
+        self.enabled = enabled
+        with Image.open(os.path.join(directory, file)) as img:
+            self.gray = to_gray(np.asarray(img.convert("RGB"), dtype=np.float32))
+        t0 = self.gray - self.gray.mean()
+        self._t0 = t0
+        self._t_norm = float(np.sqrt((t0 * t0).sum()))
+
+    def boxes(self, width: int, height: int) -> list:
+        """在当前分辨率下需要读取的像素区域 (left, top, right, bottom)"""
+        left, top, right, bottom = self.search
+        sx, sy = width / BASE_WIDTH, height / BASE_HEIGHT
+        return [(int(left * sx), int(top * sy), int(right * sx), int(bottom * sy))]
+
+    def match(self, frame: Frame) -> tuple:
+        """返回 (得分, 中心 x, 中心 y)，坐标为基准分辨率"""
+        w, h = frame.width, frame.height
+        left, top, right, bottom = self.search
+        crop = frame.crop(self.boxes(w, h)[0])[..., :3]
+        if (w, h) == (BASE_WIDTH, BASE_HEIGHT):
+            region = to_gray(crop.astype(np.float32))
+        else:
+            # 非基准分辨率时先把搜索区域缩放回基准尺寸
+            crop = Image.fromarray(np.ascontiguousarray(crop)).resize((right - left, bottom - top), Image.Resampling.BILINEAR)
+            region = to_gray(np.asarray(crop, dtype=np.float32))
+
+        th, tw = self.gray.shape
+        if region.shape[0] < th or region.shape[1] < tw or not self._t_norm:
+            return 0.0, 0, 0
+        windows = np.lib.stride_tricks.sliding_window_view(region, (th, tw))
+        # 模板已去均值，分子不需要再减窗口均值
+        num = np.einsum("ijkl,kl->ij", windows, self._t0, optimize=True)
+        # 积分图求每个窗口的方差
+        n = th * tw
+        integral = np.pad(region, ((1, 0), (1, 0))).cumsum(0).cumsum(1)
+        integral_sq = np.pad(region * region, ((1, 0), (1, 0))).cumsum(0).cumsum(1)
+
+        def window_sum(ii):
+            return ii[th:, tw:] - ii[:-th, tw:] - ii[th:, :-tw] + ii[:-th, :-tw]
+
+        var = window_sum(integral_sq) - window_sum(integral) ** 2 / n
+        score = num / (np.sqrt(np.maximum(var, 0)) * self._t_norm + 1e-6)
+        iy, ix = np.unravel_index(int(np.argmax(score)), score.shape)
+        return float(score[iy, ix]), int(left + ix + tw // 2), int(top + iy + th // 2)
+
+
+class Detector:
+    """按模板库顺序依次尝试颜色探针和模板，返回第一个足够可信的决策"""
+
+    def __init__(self, directory: str = TEMPLATE_DIR):
+        self.directory = directory
+        self.probes = []
+        self.templates = []
+        self.hits = 0
+        self.misses = 0
+        self.load()
+
+    def load(self):
+        path = os.path.join(self.directory, LIBRARY_FILE)
+        if not os.path.exists(path):
+            return
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                library = json.load(f)
+            self.probes = [ColorProbe(**p) for p in library.get("probes", [])]
+            self.templates = [Template(directory=self.directory, **t) for t in library.get("templates", [])]
+        except Exception as e:
+            print(f"[检测器] 加载模板库失败: {e}")
+
+    def regions(self, width: int, height: int) -> list:
+        """检测需要读取的全部像素区域，供只截取部分区域的采集模式使用"""
+        boxes = []
+        for entry in self.probes + self.templates:
+            if entry.enabled:
+                boxes.extend(entry.boxes(width, height))
+        return boxes
+
+    def detect(self, image) -> dict:
+        """命中返回动作字典 (与 decide_fixed_action 相同格式)，否则返回 None"""
+        frame = as_frame(image)
+        start = time.perf_counter()
+        for probe in self.probes:
+            if not probe.enabled:
+                continue
+            confidence = probe.match(frame)
+            if confidence:
+                return self._decision(probe.name, dict(probe.action), confidence, start)
+
+        for template in self.templates:
+            if not template.enabled:
+                continue
+            score, x, y = template.match(frame)
+            if score >= template.threshold:
+                action = dict(template.action)
+                # 没有指定坐标时点击匹配到的模板中心
+                if "x" not in action and "clicks" not in action and action.get("action") != "wait":
+                    action["x"], action["y"] = x, y
+                return self._decision(template.name, action, score, start)
+
+        self.misses += 1
+        return None
+
+    def _decision(self, name: str, action: dict, confidence: float, start: float) -> dict:
+        self.hits += 1
+        action.setdefault("task", name)
+        action["confidence"] = round(float(confidence), 3)
+        print(f"[检测器] 命中 {name} (置信度 {confidence:.2f}, {(time.perf_counter() - start) * 1000:.1f}ms)")
+        return action
+
+
+_detector = None
+
+
+def get_detector() -> Detector:
+    global _detector
+    if _detector is None:
+        _detector = Detector()
+    return _detector
+
+
+def detector_enabled() -> bool:
+    """
+    DETECTOR=1 时开启。随仓库提供的模板库还没有按实际画面校准（探针都是关闭的），所以默认关闭；
+    用 probe / add-template 校准并启用条目后再打开。
+    """
+    return os.getenv("DETECTOR", "0") == "1"
+
+
+def detect(image) -> dict:
+    """在 OCR / AI 之前运行的快速检测，未开启时返回 None"""
+    if not detector_enabled():
+        return None
+    return get_detector().detect(image)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="颜色探针 / 模板库工具")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+
+    p_probe = sub.add_parser("probe", help="打印截图中某些基准坐标的颜色，用于校准探针")
+    p_probe.add_argument("image")
+    p_probe.add_argument("points", nargs="+", help="x,y 基准坐标")
+    p_probe.add_argument("--radius", type=int, default=2)
+
+    p_add = sub.add_parser("add-template", help="从截图裁剪模板并加入模板库")
+    p_add.add_argument("image")
+    p_add.add_argument("--name", required=True)
+    p_add.add_argument("--box", type=int, nargs=4, required=True, metavar=("LEFT", "TOP", "RIGHT", "BOTTOM"))
+    p_add.add_argument("--margin", type=int, default=40, help="搜索区域在模板四周扩展的像素")
+    p_add.add_argument("--task", default=None)
+    p_add.add_argument("--threshold", type=float, default=0.9)
+
+    p_test = sub.add_parser("test", help="对截图运行检测器")
+    p_test.add_argument("image")
+    args = parser.parse_args()
+
+    if args.cmd == "probe":
+        frame = to_array(Image.open(args.image))
+        h, w = frame.shape[:2]
+        for point in args.points:
+            bx, by = (int(v) for v in point.split(","))
+            x, y = int(bx * w / BASE_WIDTH), int(by * h / BASE_HEIGHT)
+            r = args.radius
+            patch = frame[max(y - r, 0):y + r + 1, max(x - r, 0):x + r + 1, :3]
+            print(f"({bx},{by}): {[int(v) for v in patch.reshape(-1, 3).mean(axis=0)]}")
+
+    elif args.cmd == "add-template":
+        os.makedirs(TEMPLATE_DIR, exist_ok=True)
+        with Image.open(args.image) as img:
+            img = img.convert("RGB")
+            if img.size != (BASE_WIDTH, BASE_HEIGHT):
+                img = img.resize((BASE_WIDTH, BASE_HEIGHT), Image.Resampling.BILINEAR)
+            file = f"{args.name}.png"
+            img.crop(tuple(args.box)).save(os.path.join(TEMPLATE_DIR, file))
+        left, top, right, bottom = args.box
+        m = args.margin
+        entry = {
+            "name": args.name,
+            "file": file,
+            "search": [max(left - m, 0), max(top - m, 0), min(right + m, BASE_WIDTH), min(bottom + m, BASE_HEIGHT)],
+            "threshold": args.threshold,
+            "action": {"task": args.task or args.name},
+        }
+        path = os.path.join(TEMPLATE_DIR, LIBRARY_FILE)
+        library = {"probes": [], "templates": []}
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                library = json.load(f)
+        library.setdefault("templates", [])
+        library["templates"] = [t for t in library["templates"] if t.get("name") != args.name] + [entry]
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(library, f, ensure_ascii=False, indent=2)
+        print(f"模板 {args.name} 已保存到 {path}")
+
+    elif args.cmd == "test":
+        print(Detector().detect(Image.open(args.image)))
+
+
+if __name__ == "__main__":
+    main()
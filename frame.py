@@ -0,0 +1,136 @@
+"""
+一帧截图的共享表示。
+
+一次循环里同一张截图会被 OCR、检测器、帧缓存、AI 压缩多次使用。
+Frame 只解码一次，裁剪、灰度图、缩略图、JPEG 数据都在第一次用到时计算并缓存。
+Frame 也可以只包含若干截取的区域 (regions)，整帧由 loader 在真正需要时才获取。
+"""
+import io
+
+import numpy as np
+from PIL import Image
+
+from metrics import span
+
+
+class Frame:
+    """
+    data: page.screenshot() 返回的编码数据 (PNG/JPEG)，也可以直接给出 PIL 图片或 RGB 数组。
+    viewport: (width, height)，缺省时取图片尺寸。
+    regions: {(left, top, right, bottom): RGB 数组}，单独截取的区域。
+    loader: 无参函数，返回整帧的编码数据；只有在需要整帧时才调用。
+    """
+
+    def __init__(self, data: bytes = None, image: Image.Image = None, array: np.ndarray = None,
+                 viewport: tuple = None, captured_at: float = None, regions: dict = None, loader=None):
+        if data is None and image is None and array is None and loader is None:
+            raise ValueError("Frame 需要 data / image / array / loader 之一")
+        if data is None and image is None and array is None and viewport is None:
+            raise ValueError("只有 loader 的 Frame 需要给出 viewport")
+        self.data = data
+        self.regions = dict(regions or {})
+        self._loader = loader
+        self._image = image.convert("RGB") if image is not None and image.mode != "RGB" else image
+        self._array = array
+        self._viewport = viewport
+        self.captured_at = captured_at
+        self._memo = {}
+
+    @property
+    def loaded(self) -> bool:
+        """整帧数据是否已经就绪（不会触发 loader）"""
+        return self.data is not None or self._image is not None or self._array is not None
+
+    @property
+    def image(self) -> Image.Image:
+        """解码后的 RGB 图片（只解码一次）"""
+        if self._image is None:
+            if self.data is None and self._array is None:
+                # 只截取了部分区域，此时才去获取整帧
+                self.data = self._loader()
+            if self._array is not None:
+                self._image = Image.fromarray(np.ascontiguousarray(self._array))
+            else:
+                with span("decode"), Image.open(io.BytesIO(self.data)) as img:
+                    self._image = img.convert("RGB")
+        return self._image
+
+    @property
+    def array(self) -> np.ndarray:
+        """RGB 数组 (HxWx3 uint8)"""
+        if self._array is None:
+            self._array = np.asarray(self.image)
+        return self._array
+
+    @property
+    def size(self) -> tuple:
+        if self._array is not None:
+            return self._array.shape[1], self._array.shape[0]
+        if not self.loaded:
+            return self._viewport
+        return self.image.size
+
+    @property
+    def width(self) -> int:
+        return self.size[0]
+
+    @property
+    def height(self) -> int:
+        return self.size[1]
+
+    @property
+    def viewport(self) -> tuple:
+        return self._viewport or self.size
+
+    def _cached(self, key, build):
+        value = self._memo.get(key)
+        if value is None:
+            value = self._memo[key] = build()
+        return value
+
+    def crop(self, coords) -> np.ndarray:
+        """(left, top, right, bottom) 区域，返回整帧（或包含它的已截取区域）数组上的视图"""
+        left, top, right, bottom = coords
+        if not self.loaded:
+            for (r_left, r_top, r_right, r_bottom), arr in self.regions.items():
+                if r_left <= left and r_top <= top and right <= r_right and bottom <= r_bottom:
+                    return arr[top - r_top:bottom - r_top, left - r_left:right - r_left]
+        return self.array[top:bottom, left:right]
+
+    def gray(self) -> Image.Image:
+        """整帧灰度图"""
+        return self._cached("gray", lambda: self.image.convert("L"))
+
+    def resized(self, size: tuple, resample=Image.Resampling.LANCZOS) -> Image.Image:
+        """缩放后的 RGB 图片"""
+        return self._cached(("resized", size, resample), lambda: self.image.resize(size, resample))
+
+    def encode(self, fmt: str = "JPEG", scale: float = 0.5, quality: int = 50,
+               resample=Image.Resampling.LANCZOS) -> bytes:
+        """按给定比例缩放并编码，结果按参数缓存"""
+        def build():
+            size = (int(self.width * scale), int(self.height * scale))
+            img = self.image if scale == 1 else self.resized(size, resample)
+            buffer = io.BytesIO()
+            img.save(buffer, format=fmt, quality=quality)
+            return buffer.getvalue()
+        return self._cached(("encode", fmt, scale, quality, resample), build)
+
+    def jpeg(self, scale: float = 0.5, quality: int = 50) -> bytes:
+        """发给 AI 的 JPEG 数据"""
+        return self.encode("JPEG", scale, quality)
+
+    def memo(self, key, build):
+        """供其他模块挂载按帧缓存的派生数据（例如签名、指纹）"""
+        return self._cached(key, build)
+
+
+def as_frame(image, viewport: tuple = None) -> Frame:
+    """把 Frame / 编码字节 / PIL 图片 / RGB 数组统一转换成 Frame"""
+    if isinstance(image, Frame):
+        return image
+    if isinstance(image, (bytes, bytearray)):
+        return Frame(bytes(image), viewport=viewport)
+    if isinstance(image, np.ndarray):
+        return Frame(array=image, viewport=viewport)
+    return Frame(image=image, viewport=viewport)
@@ -0,0 +1,131 @@
+"""
+按区域比较低分辨率缩略图的帧缓存。
+
+画面在等待动画、自动行走时经常一帧都不变，此时没有必要重新 OCR、重新请求 AI。
+每帧为每个区域计算一个灰度缩略图（签名），存入缓存的结果会记住当时各区域的签名，
+只要相关区域的签名差异在阈值以内，就直接复用之前的结果。
+"""
+import os
+import time
+
+import numpy as np
+from PIL import Image
+
+from frame import as_frame
+from regions import FULL_FRAME
+
+
+def region_signature(region: np.ndarray, size=(32, 32)) -> np.ndarray:
+    """把 RGB 区域缩小成 size 大小的灰度缩略图 (float32)"""
+    img = Image.fromarray(np.ascontiguousarray(region)).convert("L")
+    return np.asarray(img.resize(size, Image.Resampling.BOX), dtype=np.float32)
+
+
+class FrameCache:
+    """
+    regions: {区域名: (left, top, right, bottom)}，另外总会包含整帧 FULL_FRAME。
+    mean_diff / max_diff: 缩略图平均/最大灰度差超过任一阈值即视为该区域发生了变化。
+    max_reuse / ttl: 同一条缓存最多复用多少次、最长保留多少秒，超过后强制重新计算。
+    """
+
+    def __init__(self, regions: dict, mean_diff: float = 1.5, max_diff: float = 12.0,
+                 max_reuse: int = 10, ttl: float = 30.0, enabled: bool = True):
+        self.regions = dict(regions)
+        self.mean_diff = mean_diff
+        self.max_diff = max_diff
+        self.max_reuse = max_reuse
+        self.ttl = ttl
+        self.enabled = enabled
+        self.current = {}
+        self._entries = {}
+        self.hits = {}
+        self.misses = {}
+
+    @classmethod
+    def from_env(cls, regions: dict) -> "FrameCache":
+        """FRAME_CACHE / FRAME_CACHE_MEAN_DIFF / FRAME_CACHE_MAX_DIFF / FRAME_CACHE_MAX_REUSE / FRAME_CACHE_TTL"""
+        return cls(
+            regions,
+            mean_diff=float(os.getenv("FRAME_CACHE_MEAN_DIFF", 1.5)),
+            max_diff=float(os.getenv("FRAME_CACHE_MAX_DIFF", 12)),
+            max_reuse=int(os.getenv("FRAME_CACHE_MAX_REUSE", 10)),
+            ttl=float(os.getenv("FRAME_CACHE_TTL", 30)),
+            enabled=os.getenv("FRAME_CACHE", "1") != "0",
+        )
+
+    def observe(self, image) -> dict:
+        """
+        计算新一帧各区域的签名，之后的 get() 都以这一帧为准。
+        只截取了部分区域的帧不计算整帧签名，此时只比较已截取的区域。
+        """
+        if not self.enabled:
+            self.current = {}
+            return self.current
+        frame = as_frame(image)
+        signatures = {name: region_signature(frame.crop(coords)) for name, coords in self.regions.items()}
+        if frame.loaded:
+            signatures[FULL_FRAME] = region_signature(frame.array, (64, 36))
+        self.current = signatures
+        return signatures
+
+    def changed(self, old: np.ndarray, new: np.ndarray) -> bool:
+        diff = np.abs(old - new)
+        return float(diff.mean()) > self.mean_diff or float(diff.max()) > self.max_diff
+
+    def get(self, key: str, regions=None):
+        """
+        如果 regions (默认全部区域+整帧) 自存入 key 以来都没有变化，返回缓存值，否则返回 None。
+        """
+        entry = self._entries.get(key)
+        if not self._valid(entry, regions):
+            return self._miss(key)
+        value, signatures, stored_at, reuse = entry
+        self._entries[key] = (value, signatures, stored_at, reuse + 1)
+        self.hits[key] = self.hits.get(key, 0) + 1
+        return value
+
+    def peek(self, key: str, regions=None):
+        """与 get 相同，但不计入命中统计和复用次数"""
+        entry = self._entries.get(key)
+        return entry[0] if self._valid(entry, regions) else None
+
+    def _valid(self, entry, regions) -> bool:
+        if entry is None or not self.current:
+            return False
+        value, signatures, stored_at, reuse = entry
+        if reuse >= self.max_reuse or time.monotonic() - stored_at > self.ttl:
+            return False
+        if regions is not None:
+            names = list(regions)
+        else:
+            names = [name for name in signatures if name != FULL_FRAME or FULL_FRAME in self.current]
+        for name in names:
+            if name not in signatures or name not in self.current:
+                return False
+            if self.changed(signatures[name], self.current[name]):
+                return False
+        return True
+
+    def _miss(self, key: str):
+        self.misses[key] = self.misses.get(key, 0) + 1
+        return None
+
+    def put(self, key: str, value):
+        """以当前帧的签名存入 value"""
+        if not self.current:
+            return
+        self._entries[key] = (value, dict(self.current), time.monotonic(), 0)
+
+    def invalidate(self, key: str = None):
+        if key is None:
+            self._entries.clear()
+        else:
+            self._entries.pop(key, None)
+
+    def stats(self) -> dict:
+        """{key: (命中, 未命中, 命中率)}"""
+        result = {}
+        for key in set(self.hits) | set(self.misses):
+            hits, misses = self.hits.get(key, 0), self.misses.get(key, 0)
+            result[key] = (hits, misses, hits / (hits + misses) if hits + misses else 0.0)
+        return result
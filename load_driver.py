@@ -0,0 +1,235 @@
+"""
+决策流水线压测：N 个模拟会话并发调用 decide_action_with_ai，请求本地的模拟 AI 服务 (mock_ai_server.py)，
+用来找出吞吐上限。
+
+    python load_driver.py --sessions 1,2,4,8,16 --duration 20 --latency 0.8 --dist lognormal --spread 0.4
+    python load_driver.py --url http://127.0.0.1:8765 --protocol gemini --sessions 4,8
+
+- 不给 --url 时在进程内启动模拟服务。耗时、错误、脚本等参数与 mock_ai_server.py 相同
+- 每个会话循环地取一帧，然后调用 decide_action_with_ai。帧来自 --corpus 回放语料中的截图，没有语料时使用生成的画面。
+  解码、编码、限速、路由、重试、解析都与主循环相同，AI_MAX_CONCURRENCY / AI_RATE_PER_MIN / AI_DEADLINE 等
+  按 .env 生效
+- 压测时关闭决策缓存、场景模型和录制，保证每次都真正请求 AI
+- 每档会话数跑 --duration 秒，报告吞吐（成功决策/秒）、耗时 p50 / p95 / p99、失败率，以及服务端收到的请求数和错误数；
+  吞吐不再随会话数增加（提升不到 5%）时，该档即为上限
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import threading
+import time
+from urllib.request import urlopen
+
+import numpy as np
+from PIL import Image, ImageDraw
+
+from mock_ai_server import add_profile_args, serve, state_from_args
+
+SATURATION_GAIN = 0.05
+
+
+def _prepare_env(structured: bool):
+    """在导入 main 之前设置：每次都请求 AI，不经过代理"""
+    os.environ["AI_CACHE"] = "0"
+    os.environ["SCENE_MODEL"] = ""
+    os.environ["SCENE_LOG"] = "0"
+    os.environ["REPLAY_RECORD"] = "0"
+    os.environ["PROXY_URL"] = ""
+    no_proxy = os.getenv("NO_PROXY", "")
+    os.environ["NO_PROXY"] = ",".join(filter(None, [no_proxy, "127.0.0.1", "localhost"]))
+    if structured:
+        os.environ["AI_STRUCTURED"] = "1"
+
+
+def synthetic_frames(count: int = 8, size: tuple = (1280, 720), seed: int = 0) -> list:
+    """生成 [(PNG 数据, viewport, msginfo)]；画面不能是纯色，纯色会被当作加载中而不请求 AI"""
+    rng = np.random.default_rng(seed)
+    frames = []
+    for _ in range(count):
+        img = Image.new("RGB", size, tuple(int(v) for v in rng.integers(0, 120, 3)))
+        draw = ImageDraw.Draw(img)
+        for _ in range(12):
+            x, y = int(rng.integers(0, size[0] - 100)), int(rng.integers(0, size[1] - 60))
+            w, h = int(rng.integers(40, 300)), int(rng.integers(30, 200))
+            draw.rectangle((x, y, x + w, y + h), fill=tuple(int(v) for v in rng.integers(0, 256, 3)))
+        buffer = io.BytesIO()
+        img.save(buffer, format="PNG")
+        frames.append((buffer.getvalue(), size, ""))
+    return frames
+
+
+def corpus_frames(directory: str) -> list:
+    """回放语料中的截图和当时的 OCR 文字"""
+    from replay import load_corpus
+
+    frames = []
+    for record in load_corpus(directory):
+        with open(record["path"], "rb") as f:
+            data = f.read()
+        ocr = record.get("ocr")
+        frames.append((data, tuple(record["viewport"]), ocr[1] if ocr else ""))
+    return frames
+
+
+def _quantiles(values: list) -> dict:
+    if not values:
+        return {"p50": 0.0, "p95": 0.0, "p99": 0.0}
+    p50, p95, p99 = np.percentile(values, [50, 95, 99])
+    return {"p50": round(float(p50), 3), "p95": round(float(p95), 3), "p99": round(float(p99), 3)}
+
+
+class LoadDriver:
+    """
+    backend_config: 指向模拟服务的 backend 配置 (ai_backends.make_backend)
+    server_stats: 无参函数，返回服务端的 /stats
+    """
+
+    def __init__(self, frames: list, backend_config: dict, server_stats, reset_peak=None):
+        from ai_backends import make_backend
+        from ai_client import AIClient
+
+        self.frames = frames
+        self.backend_config = backend_config
+        self.server_stats = server_stats
+        self.reset_peak = reset_peak
+        self._make_client = lambda: AIClient.from_env([make_backend(backend_config)])
+
+    def _session(self, bot, index: int, deadline: float, results: list):
+        from frame import Frame
+
+        i = index
+        while time.monotonic() < deadline:
+            data, viewport, msginfo = self.frames[i % len(self.frames)]
+            i += 1
+            start = time.monotonic()
+            # 每次都用新的 Frame，解码和缩放都计入耗时
+            action = bot.decide_action_with_ai(Frame(data, viewport=viewport), viewport[0], viewport[1], msginfo)
+            results.append((time.monotonic() - start, action is not None))
+
+    def run_level(self, sessions: int, duration: float) -> dict:
+        import main as bot
+        from ai_client import set_ai_client
+
+        client = self._make_client()
+        set_ai_client(client)
+        client.warmup()
+        if self.reset_peak is not None:
+            self.reset_peak()
+        before = self.server_stats()
+        results = []
+        start = time.monotonic()
+        deadline = start + duration
+        threads = [threading.Thread(target=self._session, args=(bot, i, deadline, results),
+                                    name=f"load-{i}", daemon=True) for i in range(sessions)]
+        with contextlib.redirect_stdout(io.StringIO()):
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        elapsed = time.monotonic() - start
+        after = self.server_stats()
+        client_stats = client.stats()
+        client_stats.pop("backends", None)
+        client.close()
+
+        ok = sum(1 for _, success in results if success)
+        return {
+            "sessions": sessions,
+            "decisions": len(results),
+            "ok": ok,
+            "seconds": round(elapsed, 2),
+            "throughput": round(ok / elapsed, 2) if elapsed else 0.0,
+            "failure_rate": round(1 - ok / len(results), 4) if results else 0.0,
+            "latency": _quantiles([latency for latency, _ in results]),
+            "server_requests": after["requests"] - before["requests"],
+            "server_errors": after["errors"] - before["errors"],
+            "peak_inflight": after.get("peak_inflight"),
+            "client": client_stats,
+        }
+
+
+def saturation(levels: list) -> dict:
+    """第一档之后吞吐提升不到 SATURATION_GAIN 的前一档；一直在提升时返回最后一档"""
+    for current, following in zip(levels, levels[1:]):
+        if following["throughput"] < current["throughput"] * (1 + SATURATION_GAIN):
+            return current
+    return levels[-1]
+
+
+def print_level(level: dict):
+    lat = level["latency"]
+    client = level["client"]
+    print(f"{level['sessions']:>6}{level['throughput']:>10.2f}{lat['p50']:>9.2f}{lat['p95']:>9.2f}{lat['p99']:>9.2f}"
+          f"{level['failure_rate']:>9.1%}{level['server_requests']:>9}{level['server_errors']:>7}"
+          f"{client.get('retries', 0):>7}{level['peak_inflight'] if level['peak_inflight'] is not None else '-':>7}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="决策流水线压测（本地模拟 AI 服务）")
+    parser.add_argument("--sessions", default="1,2,4,8,16", help="依次测试的会话数，逗号分隔")
+    parser.add_argument("--duration", type=float, default=20.0, help="每档持续的秒数")
+    parser.add_argument("--url", default=None, help="已启动的模拟服务地址；不给时在进程内启动")
+    parser.add_argument("--protocol", choices=["openai", "gemini"], default="openai")
+    parser.add_argument("--corpus", default=os.getenv("REPLAY_DIR", "replay"), help="回放语料目录，不存在时使用生成的画面")
+    parser.add_argument("--structured", action="store_true", help="使用结构化输出 (AI_STRUCTURED=1)")
+    parser.add_argument("--save", default=None, help="把结果保存为 JSON")
+    add_profile_args(parser)
+    args = parser.parse_args()
+
+    _prepare_env(args.structured)
+    levels = [int(n) for n in args.sessions.split(",") if n.strip()]
+
+    reset_peak = None
+    if args.url:
+        url = args.url.rstrip("/")
+
+        def server_stats():
+            with urlopen(f"{url}/stats", timeout=5) as resp:
+                return json.load(resp)
+    else:
+        state = state_from_args(args)
+        server = serve(state, port=0)
+        url = f"http://127.0.0.1:{server.server_port}"
+        server_stats = state.to_dict
+        reset_peak = state.reset_peak
+        print(f"进程内模拟服务: {url} ({args.dist}, 平均 {args.latency}s"
+              f"{', 错误 ' + args.errors if args.errors else ''}{', 503 ' + str(args.error_rate) if args.error_rate else ''})")
+
+    if args.protocol == "gemini":
+        backend_config = {"type": "gemini", "name": "mock-gemini", "model": "mock", "endpoint": url}
+    else:
+        backend_config = {"type": "openai", "name": "mock-openai", "model": "mock", "base_url": f"{url}/v1",
+                          "response_format": "json_object"}
+
+    frames = corpus_frames(args.corpus) if os.path.exists(os.path.join(args.corpus, "corpus.jsonl")) else []
+    if frames:
+        print(f"使用回放语料 {args.corpus}: {len(frames)} 帧")
+    else:
+        frames = synthetic_frames()
+        print(f"使用 {len(frames)} 张生成的画面")
+    print(f"AI_MAX_CONCURRENCY={os.getenv('AI_MAX_CONCURRENCY', 4)} AI_RATE_PER_MIN={os.getenv('AI_RATE_PER_MIN', 0)} "
+          f"AI_DEADLINE={os.getenv('AI_DEADLINE', 20)}")
+
+    driver = LoadDriver(frames, backend_config, server_stats, reset_peak)
+    print(f"\n{'会话':>6}{'决策/秒':>10}{'p50 s':>9}{'p95 s':>9}{'p99 s':>9}{'失败率':>9}{'请求':>9}{'错误':>7}"
+          f"{'重试':>7}{'并发':>7}")
+    results = []
+    for sessions in levels:
+        level = driver.run_level(sessions, args.duration)
+        results.append(level)
+        print_level(level)
+
+    best = saturation(results)
+    print(f"\n吞吐上限约 {best['throughput']:.2f} 决策/秒（{best['sessions']} 个会话，p95 {best['latency']['p95']:.2f}s）")
+    if best is not results[-1]:
+        print("继续增加会话只会增加排队和耗时")
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump({"levels": results, "ceiling": best}, f, ensure_ascii=False, indent=2)
+        print(f"结果已保存到 {args.save}")
+
+
+if __name__ == "__main__":
+    main()
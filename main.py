@@ -1,9 +1,9 @@
-from playwright.sync_api import sync_playwright
+from __future__ import annotations
+
 import time
+# 启动计时起点：之后的模块导入计入启动报告的"导入"阶段
+_STARTED = time.perf_counter()
 import threading
-import msvcrt
-import google.generativeai as genai
-import base64
 import re
 import json
 import argparse
@@ -13,9 +13,18 @@ from dotenv import load_dotenv
 # Load environment variables
 load_dotenv()
 
-# Configure Google AI
-import httpx
-from ocr_region import ocr
+# 决策流水线用到的模块（httpx、numpy / PIL、sqlite、onnxruntime 等）都在函数内导入：
+# 登录提示出现之前只加载这里和 regions / startup，其余在登录期间由后台预热线程加载
+from typing import TYPE_CHECKING
+
+from regions import COORDS, FULL_FRAME, MSG_COORDS
+from startup import StartupTimer, warm_ai, warm_capture, warm_ocr, warm_pipeline
+
+if TYPE_CHECKING:
+    from frame import Frame
+    from frame_cache import FrameCache
+    from preclick import PreClickVerifier
+    from waiter import Waiter
 
 # Configuration - 代理模型
 API_KEY = os.getenv("API_KEY")
@@ -28,6 +37,18 @@ PROXY_URL = os.getenv("PROXY_URL")
 # 基准分辨率
 BASE_WIDTH = int(os.getenv("BASE_WIDTH", 1280))
 BASE_HEIGHT = int(os.getenv("BASE_HEIGHT", 720))
+# 结构化输出：请求带 JSON Schema、使用精简提示词并限制输出长度，回复一次解析成动作
+AI_STRUCTURED = os.getenv("AI_STRUCTURED", "0") == "1"
+AI_STRUCTURED_MAX_TOKENS = int(os.getenv("AI_STRUCTURED_MAX_TOKENS", 256))
+# 登录期间预热 AI 连接、决策流水线和截图路径（OCR 总是预热），回车后最多再等 STARTUP_WARMUP_WAIT 秒
+STARTUP_WARMUP = os.getenv("STARTUP_WARMUP", "1") != "0"
+STARTUP_WARMUP_WAIT = float(os.getenv("STARTUP_WARMUP_WAIT", 30))
+
+# OCR 关注的区域，帧缓存按这些区域判断画面是否变化
+OCR_REGIONS = {"消息区域": MSG_COORDS, "自动按钮": COORDS}
+# 复用决策要求整帧也没有变化：检测器和 AI 看的是整帧，只比较两个 OCR 区域不够。
+# 只截取了部分区域的帧（CAPTURE_MODE=clip）没有整帧签名，决策不缓存
+DECISION_REGIONS = (*OCR_REGIONS, FULL_FRAME)
 
 def convert_coordinates(base_x: int, base_y: int, current_width: int, current_height: int) -> tuple:
     """将1280x720基准分辨率的坐标转换为当前分辨率的坐标"""
@@ -44,10 +65,9 @@ def convert_coordinates(base_x: int, base_y: int, current_width: int, current_he
     print(f"坐标转换: ({base_x},{base_y}) -> ({new_x},{new_y}) [缩放: {scale_x:.2f}x{scale_y:.2f}]")
     return new_x, new_y
 
-def draw_click_indicator(page, x, y, color):
-    """在屏幕上绘制点击指示器（线程运行）"""
-    try:
-        page.evaluate(f"""
+def click_indicator_script(x, y, color) -> str:
+    """生成在页面上绘制点击指示器的脚本"""
+    return f"""
             (function() {{
                 // Remove old indicator if exists
                 const old = document.getElementById('click-indicator');
@@ -84,7 +104,12 @@ def draw_click_indicator(page, x, y, color):
                 // Remove after 2 seconds
                 setTimeout(() => div.remove(), 2000);
             }})();
-        """)
+        """
+
+def draw_click_indicator(page, x, y, color):
+    """在屏幕上绘制点击指示器（线程运行）"""
+    try:
+        page.evaluate(click_indicator_script(x, y, color))
     except Exception as e:
         print(f"绘制指示器失败: {e}")
 
@@ -114,164 +139,299 @@ GAME_PROMPT_TEMPLATE = """你是一个游戏自动化助手，帮我玩大富翁
 任务名示例：骰子、确认、猜拳、轰炸、愿望、掠夺、动画
 """
 
+# 结构化输出模式的提示词：输出格式由 ACTION_SCHEMA 约束，这里只描述规则
+COMPACT_PROMPT_TEMPLATE = """大富翁游戏截图 {width}x{height}，坐标按1280x720基准给出。选出要操作的按钮：
+- 骰子(1171,621)：橙色或显示免费时长按(hold)切换为绿色自动；绿色不操作；攻击城市时的相似按钮不点
+- 确定/确认/关闭按钮：click
+- 猜拳：剪刀(555,650)/石头(635,650)/布(715,650) 选一个 click
+- 攻击城市轰炸：clicks (308,227)(427,127)(319,463)
+- 愿望：click (455,450)
+- 掠夺钱箱：clicks (227,420)(327,420)(447,405)(587,434)(697,420)
+- 蛋糕塔：click 左上角返回
+- 无需操作：wait，points 为空
+task 取：骰子、确认、猜拳、轰炸、愿望、掠夺、动画、等待。只回复 JSON。"""
 
 
-# 创建带代理的 httpx 客户端
-http_client = httpx.Client(proxy=PROXY_URL)
 
-genai.configure(
-    api_key=API_KEY,
-    transport='rest',
-    client_options={'api_endpoint': API_ENDPOINT}
-)
+# AI 客户端（带代理的连接池、超时、重试、限速）在第一次请求时创建，见 ai_client.py
 
-# 设置全局代理（通过环境变量方式）
-# 设置全局代理（通过环境变量方式）
-os.environ['HTTP_PROXY'] = PROXY_URL
-os.environ['HTTPS_PROXY'] = PROXY_URL
+def decide_action_with_ai(frame: Frame, viewport_width, viewport_height, msginfo: str = ""):
+    """Sends the screenshot (in-memory Frame) to the AI and gets coordinates to click.
 
-model = genai.GenerativeModel(MODEL_NAME)
+    相同画面 (截图指纹 + OCR 文本 msginfo) 的决策会被缓存，命中时不再请求 AI；
+    本地场景分类器 (SCENE_MODEL) 足够确定时也不请求 AI。
+    """
+    from ai_action import ACTION_SCHEMA
+    from ai_client import get_ai_client
+    from decision_cache import get_decision_cache
+    from frame import as_frame
+    from metrics import count, span
+    from payload_encoder import get_payload_encoder
+    from scene_model import get_scene_logger, get_scene_model
 
-def decide_action_with_ai(image_bytes, viewport_width, viewport_height):
-    """Sends the screenshot bytes (in-memory) to the AI and gets coordinates to click."""
-    print(f"Sending screenshot bytes to AI...")
+    print(f"Sending screenshot to AI...")
 
     # Format prompt with viewport size
-    prompt = GAME_PROMPT_TEMPLATE.format(width=viewport_width, height=viewport_height)
+    template = COMPACT_PROMPT_TEMPLATE if AI_STRUCTURED else GAME_PROMPT_TEMPLATE
+    prompt = template.format(width=viewport_width, height=viewport_height)
 
+    frame = as_frame(frame)
+    cache = get_decision_cache()
     try:
-        # Compress image to reduce size
-        from PIL import Image
-        import io
-
-        with Image.open(io.BytesIO(image_bytes)) as img:
-            # Scale down to 50%
-            new_size = (img.width // 2, img.height // 2)
-            img = img.resize(new_size, Image.Resampling.LANCZOS)
-
-            # Convert to JPEG with lower quality (keep colors)
-            buffer = io.BytesIO()
-            img.convert('RGB').save(buffer, format='JPEG', quality=50)
-            image_data = buffer.getvalue()
-
-        print(f"Compressed image size: {len(image_data) // 1024}KB")
-        # 小于10kb直接等待
-        if len(image_data) < 10240:
+        if cache is not None:
+            cache_key = cache.key(frame, msginfo)
+            cached = cache.get(cache_key)
+            if cached is not None:
+                count("decision_cache_hits")
+                print(f"[AI缓存] 命中 ({cached.get('task')})，跳过AI请求 {cache.stats()}")
+                return cached
+
+        # 加载中 / 黑屏直接等待
+        encoder = get_payload_encoder()
+        if encoder.blank(frame):
             return {"action": "wait", "task": "等待"}
 
-        # Create image part for Gemini
-        image_part = {
-            "mime_type": "image/jpeg",
-            "data": image_data
-        }
-
-        response = model.generate_content([prompt, image_part])
-        content = response.text
-        print(f"AI Response: {content}")
-        
-        # Extract task name
-        task_match = re.search(r'"task"\s*:\s*"([^"]+)"', content)
-        task = task_match.group(1) if task_match else "unknown"
-        
-        # Check if AI says to wait
-        if '"action"' in content and 'wait' in content.lower():
-            print(f"AI says to wait... (task: {task})")
-            return {"action": "wait", "task": task}
-        
-        # Check for multi-click array
-        if '"clicks"' in content:
-            import json
-            # Try to extract JSON from response
-            json_match = re.search(r'\{[^{}]*"clicks"\s*:\s*\[[^\]]+\][^{}]*\}', content, re.DOTALL)
-            if json_match:
-                try:
-                    data = json.loads(json_match.group())
-                    clicks = data.get("clicks", [])
-                    if clicks:
-                        return {"clicks": [(c["x"], c["y"]) for c in clicks], "task": task}
-                except:
-                    pass
-        
-        # Parse single coordinate
-        match = re.search(r'"x"\s*:\s*(\d+)', content)
-        match_y = re.search(r'"y"\s*:\s*(\d+)', content)
-        if match and match_y:
-            x = int(match.group(1))
-            y = int(match_y.group(1))
-            # Check if hold/long press is needed
-            hold = '"hold"' in content.lower() and 'true' in content.lower()
-            return {"x": x, "y": y, "hold": hold, "task": task}
+        scene = get_scene_model()
+        predicted = scene.decide(frame, msginfo) if scene is not None else None
+        if predicted is not None and not scene.should_audit():
+            return predicted
+
+        # 按 PAYLOAD_* 配置缩放、编码（尺寸 / 字节预算、格式、灰度、ROI）
+        payload = encoder.encode(frame, msginfo)
+        print(f"Compressed image size: {len(payload) // 1024}KB ({payload.mime_type} {payload.size[0]}x{payload.size[1]}"
+              f" q{payload.quality}{' ROI ' + payload.roi if payload.roi else ''})")
+
+        if cache is not None:
+            cache.record_api_call()
+        # 超过 AI_DEADLINE 仍未成功会抛出 AIError，不会卡住主循环
+        with span("ai"):
+            if AI_STRUCTURED:
+                reply = get_ai_client().generate(prompt, payload.data, payload.mime_type, schema=ACTION_SCHEMA,
+                                                 max_output_tokens=AI_STRUCTURED_MAX_TOKENS)
+            else:
+                reply = get_ai_client().generate(prompt, payload.data, payload.mime_type)
+        encoder.record_upload(reply.upload)
+        content = reply.text
+        print(f"AI Response ({reply.backend.name}, {reply.latency:.2f}s): {content}")
+
+        with span("parse"):
+            action = parse_ai_response(content, strict=AI_STRUCTURED)
+        # 兜底 backend 的回复（本地替身的"等待"）不代表这个画面的正确决策，不缓存、不作为训练样本
+        if action is not None and not reply.fallback:
+            if cache is not None:
+                cache.put(cache_key, action)
+            logger = get_scene_logger()
+            if logger is not None:
+                logger.log(frame, msginfo, action)
+            if predicted is not None:
+                scene.record_audit(predicted, action)
+                print(f"[场景] 核对: 模型 {predicted.get('task')} / AI {action.get('task')} {scene.stats()}")
+        return action
         
     except Exception as e:
         print(f"AI Request failed: {e}")
     
     return None
+
+
+def parse_ai_response(content: str, strict: bool = False) -> dict:
+    """Parses the AI reply text into an action dict, or None.
+
+    先按 JSON 一次解析并校验 (ai_action.parse_action)；strict=True（结构化输出模式）时解析失败直接返回 None，
+    否则退回旧的正则提取，兼容不严格输出 JSON 的模型。
+    """
+    from ai_action import ActionError, parse_action
+
+    try:
+        action = parse_action(content, BASE_WIDTH, BASE_HEIGHT)
+        if action.action == "wait":
+            print(f"AI says to wait... (task: {action.task})")
+        return action.to_coords()
+    except ActionError as e:
+        if strict:
+            print(f"AI 回复不符合格式: {e}")
+            return None
+
+    # Extract task name
+    task_match = re.search(r'"task"\s*:\s*"([^"]+)"', content)
+    task = task_match.group(1) if task_match else "unknown"
+    
+    # Check if AI says to wait
+    if '"action"' in content and 'wait' in content.lower():
+        print(f"AI says to wait... (task: {task})")
+        return {"action": "wait", "task": task}
+    
+    # Check for multi-click array
+    if '"clicks"' in content:
+        # Try to extract JSON from response
+        json_match = re.search(r'\{[^{}]*"clicks"\s*:\s*\[[^\]]+\][^{}]*\}', content, re.DOTALL)
+        if json_match:
+            try:
+                data = json.loads(json_match.group())
+                clicks = data.get("clicks", [])
+                if clicks:
+                    return {"clicks": [(c["x"], c["y"]) for c in clicks], "task": task}
+            except:
+                pass
+    
+    # Parse single coordinate
+    match = re.search(r'"x"\s*:\s*(\d+)', content)
+    match_y = re.search(r'"y"\s*:\s*(\d+)', content)
+    if match and match_y:
+        x = int(match.group(1))
+        y = int(match_y.group(1))
+        # Check if hold/long press is needed
+        hold = re.search(r'"hold"\s*:\s*true', content, re.IGNORECASE) is not None
+        return {"x": x, "y": y, "hold": hold, "task": task}
+    
+    return None
     
 def decide_fixed_action(msginfo: str, viewport_width: int, viewport_height: int) -> dict:
-    """Based on OCR text (msginfo), return a fixed action if applicable."""
+    """Based on OCR text (msginfo), return a fixed action if applicable.
+
+    规则（关键字、优先级、坐标）在 rules.json 中，修改后自动重新载入，见 rule_engine.py。
+    """
     if not msginfo:
         return None
-        
-    import random
+    from rule_engine import get_rule_engine
+
+    return get_rule_engine().decide(msginfo)
+
+def decide_local(frame: Frame, viewport_width: int, viewport_height: int, frame_cache: FrameCache = None) -> tuple:
+    """
+    不调用 AI 的本地决策：检测器 -> OCR -> 固定逻辑。
+    返回 (动作, msginfo)；动作为 None 表示需要交给 AI。
+    """
+    from detector import detect
+    from metrics import span
+    from ocr_region import ocr
+
+    # 先用颜色探针/模板匹配快速判断，命中点击动作则跳过 OCR 和 AI。
+    # 判定为等待（例如绿色骰子自动行走）时仍要看 OCR：自动模式下出现的愿望/擂台/攻击等事件需要处理
+    with span("detect"):
+        detected = detect(frame)
+    if detected and detected.get("action") != "wait":
+        return detected, ""
+
+    # 检查截图区域是否存在"自动"二字, 并获取OCR信息
+    # ocr() returns (bool, str) -> (is_auto, msginfo)
+    # OCR 区域没有变化时复用上一次的识别结果
+    ocr_result = frame_cache.get("ocr", OCR_REGIONS) if frame_cache else None
+    if ocr_result is None:
+        with span("ocr"):
+            ocr_result = ocr(frame)
+        if frame_cache:
+            frame_cache.put("ocr", ocr_result)
+    else:
+        print("[帧缓存] OCR 区域未变化，复用上一次的识别结果")
+    is_auto, msginfo = ocr_result
+
+    if is_auto:
+        print("检测到'自动'模式，跳过AI分析，等待下一轮...")
+        return {"action": "wait", "task": "自动"}, msginfo
+
+    # 优先检查是否存在固定逻辑 (Attack, Wish, Loot, RPS, etc.)
+    fixed_coords = decide_fixed_action(msginfo, viewport_width, viewport_height)
+    if fixed_coords:
+        print(f"Fixed action triggered: {fixed_coords.get('task')}")
+        return fixed_coords, msginfo
+
+    if detected:
+        print(f"检测器判定无需操作 ({detected.get('task')})，等待下一轮...")
+        return detected, msginfo
+
+    return None, msginfo
+
+
+def decide_action(frame: Frame, viewport_width: int, viewport_height: int, frame_cache: FrameCache = None) -> dict:
+    """
+    对一帧截图做决策：检测器 -> OCR -> 固定逻辑 -> AI。
+    无需操作时返回 {"action": "wait"}，AI 失败时返回 None。
+    """
+    coords, msginfo = decide_local(frame, viewport_width, viewport_height, frame_cache)
+    if coords is not None:
+        return coords
+
+    # Get coordinates from AI (pass the in-memory frame, not a file)
+    return decide_action_with_ai(frame, viewport_width, viewport_height, msginfo)
+
+def execute_action(page, coords: dict, viewport_width: int, viewport_height: int, waiter: Waiter,
+                   verifier: PreClickVerifier):
+    """
+    执行一个决策：点击前核对自动模式，单击 / 连点 / 长按，之后等画面稳定。
+    同步主循环和异步流水线 (async_engine) 共用，page 只需要 mouse / evaluate。
+    """
+    from metrics import span
+
+    vw, vh = viewport_width, viewport_height
+    task = coords.get("task", "unknown")
+    # Handle wait action
+    if coords.get("action") == "wait":
+        print("No action needed, waiting...")
+        waiter.wait_change(waiter.limits["idle"], min_s=0.2)
+        return
+    # 只核对自动按钮区域，区域未变化时不再重新识别
+    if verifier.is_auto((vw, vh)):
+        print("检测到'自动'模式，跳过点击，等待下一轮...")
+        waiter.wait_change(waiter.limits["idle"], min_s=0.2)
+        return
+    # Handle multi-click
+    if "clicks" in coords:
+        clicks = coords["clicks"]
+        print(f"Multi-click: {len(clicks)} positions")
+        for i, (cx, cy) in enumerate(clicks):
+            # 坐标转换
+            cx, cy = convert_coordinates(cx, cy, vw, vh)
+            print(f"  [{i+1}/{len(clicks)}] Clicking at ({cx}, {cy})")
+            
+            # Draw indicator
+            draw_click_indicator(page, cx, cy, "255, 0, 0")
+            
+            with span("input", kind="click"):
+                page.mouse.click(cx, cy)
+            # 等这一下点击的反应（弹窗、选中效果）结束再点下一个
+            waiter.wait_settle(task, waiter.limits["click"], min_s=0.15, kind="连点")
+        # Wait before next iteration
+        waiter.wait_settle(task, waiter.limits["sequence"])
+        return
+
+    # Handle single click or hold
+    x = coords["x"]
+    y = coords["y"]
+    # 坐标转换
+    x, y = convert_coordinates(x, y, vw, vh)
+    hold = coords.get("hold", False)
     
-    # Keyword detection (case insensitive) -> Action
-    msginfo = msginfo.strip()
-        
-    # 3. 愿望 (Wish) -> Single Click
-    if "愿望" in msginfo:
-        # 455,450
-        print(f"Fixed Action: Detected '愿望', executing fixed click.")
-        return {"x": 455, "y": 450, "task": "愿望-固定"}
- 
-    # 2. 攻击 (Attack) -> Fixed Sequence
-    if "攻击" in msginfo:
-        # 308,227; 427,127; 319,463
-        print(f"Fixed Action: Detected '攻击', executing fixed sequence.")
-        return {
-            "task": "攻击-固定",
-            "clicks": [
-                (308, 227),
-                (427, 127),
-                (319, 463)
-            ]
-        }
-
-        
-    # 4. 掠夺 (Loot) -> Fixed Sequence
-    if "掠夺" in msginfo:
-        # 227,420; 327,420; 447,405; 587,434; 697,420
-        print(f"Fixed Action: Detected '掠夺', executing fixed sequence.")
-        return {
-            "task": "掠夺-固定",
-            "clicks": [
-                 (227, 420),
-                 (327, 420),
-                 (447, 405),
-                 (587, 434),
-                 (697, 420)
-            ]
-        }
-        
-   # 1. 猜拳 (Rock-Paper-Scissors) -> Random
-    if "猜拳" in msginfo or '擂台' in msginfo:
-        # Options: 剪刀(555,650), 石头(635,650), 布(715,650)
-        options = [
-            {"name": "剪刀", "x": 555, "y": 650},
-            {"name": "石头", "x": 635, "y": 650},
-            {"name": "布", "x": 715, "y": 650}
-        ]
-        choice = random.choice(options)
-        print(f"Fixed Action: Detected '猜拳', choosing Random -> {choice['name']}")
-        return {"x": choice['x'], "y": choice['y'], "task": "猜拳-随机"}
-
-
-    return None
+    if hold:
+        print(f"Long pressing at ({x}, {y})")
+    else:
+        print(f"Clicking at ({x}, {y})")
+    
+    # Draw click indicator on page (green for hold, red for click)
+    indicator_color = "0, 255, 0" if hold else "255, 0, 0"
+    
+    # Use thread to draw indicator to avoid blocking
+    # Playwright sync API is not thread safe, calling directly (it's fast enough without sleep)
+    draw_click_indicator(page, x, y, indicator_color)
+
+    # 操作之前的画面：之后先确认画面有了反应，再判断是否稳定
+    baseline = waiter.signatures() if waiter.enabled else None
+    if hold:
+        # Long press: 按住直到自动按钮区域变化（最多 3 秒）
+        held = waiter.hold_until_change(page, x, y, task, names=("自动按钮",))
+        print(f"Released after {held:.2f}s")
+    else:
+        with span("input", kind="click"):
+            page.mouse.click(x, y)
+    waiter.wait_settle(task, waiter.limits["click"], baseline=baseline)
 
 class AutomationState:
     paused = False
 
 def keyboard_listener():
     """监听键盘输入，控制暂停/恢复"""
+    import msvcrt  # 只有 Windows 有，回放 / 压测工具导入 main 时不需要
+
     while True:
         if msvcrt.kbhit():
             # 读取按键，不回显
@@ -289,8 +449,13 @@ def keyboard_listener():
 
 def main(browser_type="chromium"):
     print("Starting DA FU WENG (大富翁) automation...")
+    startup = StartupTimer(_STARTED)
+    startup.mark("导入", time.perf_counter() - _STARTED)
+
+    from playwright.sync_api import sync_playwright
 
     with sync_playwright() as p:
+        launch_start = time.perf_counter()
         # Use persistent context to save cookies and session
         # 不同浏览器使用不同的数据目录
         if browser_type.lower() == "edge":
@@ -316,17 +481,55 @@ def main(browser_type="chromium"):
                 headless=False
             )
         page = context.pages[0] if context.pages else context.new_page()
+        startup.mark("启动浏览器", time.perf_counter() - launch_start)
+        capture = None
         
         try:
             print(f"Navigating to {TARGET_URL}...")
-            page.goto(TARGET_URL)
-            
+            with startup.phase("打开页面"):
+                page.goto(TARGET_URL)
+            viewport = page.viewport_size
+            vw, vh = viewport['width'], viewport['height']
+
+            # 用户登录期间在后台加载并预热 OCR 模型；STARTUP_WARMUP=1 时同时建立 AI 连接、初始化决策流水线
+            startup.background("OCR", warm_ocr)
+            if STARTUP_WARMUP:
+                startup.background("AI连接", warm_ai)
+                startup.background("流水线", warm_pipeline, (vw, vh))
+
+            def open_capture():
+                # 采集层：clip 模式下只截取 OCR / 检测器需要的区域
+                nonlocal capture
+                from capture import Capture
+                from detector import detector_enabled, get_detector
+
+                capture_regions = list(OCR_REGIONS.values()) + (get_detector().regions(vw, vh) if detector_enabled() else [])
+                capture = Capture.from_env(page, capture_regions)
+                capture.start((vw, vh))
+                print(f"截图模式: {capture.mode}")
+                if STARTUP_WARMUP:
+                    warm_capture(capture, (vw, vh), OCR_REGIONS)
+
             # Wait for manual login
             print("\n" + "="*50)
             print("请在浏览器中手动登录游戏")
             print("登录完成后，按回车键开始自动化...")
             print("="*50 + "\n")
-            input()
+            # 等待回车的同时在主线程创建采集层并预热截图路径（Playwright 同步 API 只能在主线程调用）
+            startup.wait_login(open_capture if STARTUP_WARMUP else None)
+            if capture is None:
+                open_capture()
+            if STARTUP_WARMUP:
+                startup.wait_tasks(STARTUP_WARMUP_WAIT)
+
+            from frame_cache import FrameCache
+            from metrics import count, get_metrics, span, summary as metrics_summary
+            from payload_encoder import get_payload_encoder
+            from preclick import PreClickVerifier
+            from replay import get_replay_recorder
+            from rule_engine import get_rule_engine
+            from scene_model import get_scene_model
+            from waiter import Waiter
             
             # 启动键盘监听线程
             threading.Thread(target=keyboard_listener, daemon=True).start()
@@ -335,6 +538,19 @@ def main(browser_type="chromium"):
             print("【提示】运行过程中按 'P' 键可以暂停/恢复自动化。")
             
             loop_count = 0
+            frame_cache = FrameCache.from_env(OCR_REGIONS)
+
+            def probe():
+                vp = page.viewport_size
+                return capture.probe((vp['width'], vp['height']))
+
+            # 用区域签名判断画面变化 / 稳定，代替固定的 sleep
+            waiter = Waiter.from_env(probe, OCR_REGIONS).save_at_exit()
+            verifier = PreClickVerifier.from_env(capture, frame_cache)
+            # REPLAY_RECORD=1 时把每个新决策连同整帧截图录制下来，供 replay.py 离线回放
+            recorder = get_replay_recorder()
+            # METRICS=1 时启动指标端点 (METRICS_PORT) 和追踪文件 (METRICS_TRACE)
+            get_metrics()
             last_task = None  # Track last task (no duplicate suppression)
             
             while True:
@@ -344,31 +560,45 @@ def main(browser_type="chromium"):
 
                 loop_count += 1
 
-                    # Capture screenshot to memory (bytes)
-                image_bytes = page.screenshot()
-                print(f"\n[Loop {loop_count}] Screenshot captured ({len(image_bytes) // 1024}KB)")
-                
                 # Get viewport size
                 viewport = page.viewport_size
                 vw, vh = viewport['width'], viewport['height']
 
-                # 检查截图区域是否存在"自动"二字, 并获取OCR信息
-                # ocr() returns (bool, str) -> (is_auto, msginfo)
-                is_auto, msginfo = ocr(image_bytes)
-                
-                if is_auto:
-                    print("检测到'自动'模式，跳过AI分析，等待下一轮...")
-                    time.sleep(1)
-                    continue
-
-                # 优先检查是否存在固定逻辑 (Attack, Wish, Loot, RPS, etc.)
-                fixed_coords = decide_fixed_action(msginfo, vw, vh)
-                if fixed_coords:
-                     print(f"Fixed action triggered: {fixed_coords.get('task')}")
-                     coords = fixed_coords
+                # Capture screenshot to memory
+                # 整帧只解码一次，OCR / 检测器 / 帧缓存 / AI 共享
+                loop_start = time.perf_counter()
+                frame = capture.grab((vw, vh))
+                if frame.loaded:
+                    print(f"\n[Loop {loop_count}] Screenshot captured ({len(frame.data) // 1024}KB)")
+                else:
+                    print(f"\n[Loop {loop_count}] Captured {len(frame.regions)} regions")
+
+                # 画面与上一轮相比没有变化时，直接复用上一轮的决策
+                frame_cache.observe(frame)
+                coords = frame_cache.get("decision", DECISION_REGIONS)
+                if coords is not None:
+                    count("frame_cache_hits")
+                    print(f"[帧缓存] 画面未变化，复用上一轮决策 ({coords.get('task')})")
                 else:
-                    # Get coordinates from AI (pass bytes, not a file)
-                    coords = decide_action_with_ai(image_bytes, vw, vh)
+                    with span("decide"):
+                        coords = decide_action(frame, vw, vh, frame_cache)
+                    if coords is not None and FULL_FRAME in frame_cache.current:
+                        frame_cache.put("decision", coords)
+                    if recorder is not None:
+                        recorder.record(frame, coords, frame_cache.peek("ocr", OCR_REGIONS))
+                # 前几轮截图 + 决策的耗时：第一轮后打印启动报告，之后与稳定状态比较
+                startup.record_loop(time.perf_counter() - loop_start)
+
+                if loop_count % 50 == 0:
+                    print(f"[帧缓存] 命中统计: {frame_cache.stats()}")
+                    print(f"[等待] 动画耗时统计: {waiter.summary()}")
+                    print(f"[编码] 图片统计: {get_payload_encoder().stats()}")
+                    print(f"[规则] 命中统计: {get_rule_engine().stats()}")
+                    print(f"[核对] 点击前核对: {verifier.stats()}")
+                    if get_metrics() is not None:
+                        print(f"[指标] 各阶段耗时: {metrics_summary()}")
+                    if get_scene_model() is not None:
+                        print(f"[场景] 模型统计: {get_scene_model().stats()}")
                 
                 if coords:
                     current_task = coords.get("task", "unknown")
@@ -376,71 +606,17 @@ def main(browser_type="chromium"):
                     last_task = current_task
                     print(f"Task: {current_task}")
                     
-                    # Handle wait action
-                    if coords.get("action") == "wait":
-                        print("No action needed, waiting...")
-                        time.sleep(1)
-                        continue
-                    image_bytes = page.screenshot()
-                    ena,msginfo = ocr(image_bytes)
-                    if ena:
-                        print("检测到'自动'模式，跳过点击，等待下一轮...")
-                        time.sleep(1)
-                        continue
-                    # Handle multi-click
-                    if "clicks" in coords:
-                        clicks = coords["clicks"]
-                        print(f"Multi-click: {len(clicks)} positions")
-                        for i, (cx, cy) in enumerate(clicks):
-                            # 坐标转换
-                            cx, cy = convert_coordinates(cx, cy, vw, vh)
-                            print(f"  [{i+1}/{len(clicks)}] Clicking at ({cx}, {cy})")
-                            
-                            # Draw indicator
-                            draw_click_indicator(page, cx, cy, "255, 0, 0")
-                            
-                            page.mouse.click(cx, cy)
-                            time.sleep(1)  # 1 second interval between clicks
-                        # Wait before next iteration
-                        time.sleep(10)
-                        continue
-             
-                    # Handle single click or hold
-                    x = coords["x"]
-                    y = coords["y"]
-                    # 坐标转换
-                    x, y = convert_coordinates(x, y, vw, vh)
-                    hold = coords.get("hold", False)
-                    
-                    if hold:
-                        print(f"Long pressing at ({x}, {y})")
-                    else:
-                        print(f"Clicking at ({x}, {y})")
-                    
-                    # Draw click indicator on page (green for hold, red for click)
-                    indicator_color = "0, 255, 0" if hold else "255, 0, 0"
-                    
-                    # Use thread to draw indicator to avoid blocking
-                    # Playwright sync API is not thread safe, calling directly (it's fast enough without sleep)
-                    draw_click_indicator(page, x, y, indicator_color)
-               
-                    if hold:
-                        # Long press: hold for 3 seconds
-                        page.mouse.move(x, y)
-                        page.mouse.down()
-                        time.sleep(3)
-                        page.mouse.up()
-                    else:
-                        page.mouse.click(x, y)
+                    execute_action(page, coords, vw, vh, waiter, verifier)
                 else:
                     print("No action needed, waiting...")
-            
-                time.sleep(1)
+                    waiter.wait_change(waiter.limits["idle"], min_s=0.2)
         except KeyboardInterrupt:
             print("\n自动化被用户停止。")
         except Exception as e:
             print(f"发生错误: {e}")
         finally:
+            if capture is not None:
+                capture.stop()
             context.close()
             print("浏览器已关闭。")
 
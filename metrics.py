@@ -0,0 +1,256 @@
+"""
+各阶段耗时与计数。
+
+    with span("capture"):
+        ...
+    count("ai_calls")
+    observe("ocr_variant", seconds, variant="Original", region="消息区域")
+
+- 直方图：每个 (阶段, 标签) 的耗时分桶 + 最近 window 次的 p50 / p95 / p99
+- 计数器：AI 请求、缓存命中、尝试的 OCR 变体等
+- METRICS_TRACE：每个 span 追加一行 JSON（名字、开始时间、耗时、标签、线程）
+- METRICS_PORT：本地 HTTP 端点 /metrics，Prometheus 文本格式
+
+METRICS=0（默认）时 span() 返回同一个空的上下文管理器，count() / observe() 直接返回，几乎没有开销。
+OCR 服务的工作进程是单独的进程，其中的 OCR 变体耗时不会出现在主进程的统计里。
+"""
+import atexit
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+from collections import deque
+from contextlib import nullcontext
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+QUANTILES = (0.5, 0.95, 0.99)
+PREFIX = "dafuweng"
+
+_NOOP = nullcontext()
+
+
+class Histogram:
+    """累计分桶（Prometheus histogram）+ 最近 window 个样本（用于分位数）"""
+
+    __slots__ = ("buckets", "count", "sum", "recent")
+
+    def __init__(self, window: int = 1024):
+        self.buckets = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.recent = deque(maxlen=window)
+
+    def observe(self, seconds: float):
+        self.buckets[bisect_left(BUCKETS, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+        self.recent.append(seconds)
+
+    def quantile(self, q: float) -> float:
+        samples = sorted(self.recent)
+        if not samples:
+            return 0.0
+        return samples[min(int(q * len(samples)), len(samples) - 1)]
+
+
+def _key(name: str, labels: dict) -> tuple:
+    return (name, tuple(sorted(labels.items())))
+
+
+class Metrics:
+    def __init__(self, trace_path: str = None, window: int = 1024):
+        self.window = window
+        self.histograms = {}
+        self.counters = {}
+        self._lock = threading.Lock()
+        self._trace = open(trace_path, "a", encoding="utf-8") if trace_path else None
+        self._server = None
+        if self._trace is not None:
+            atexit.register(self.close)
+
+    def observe(self, name: str, seconds: float, start: float = None, **labels):
+        key = _key(name, labels)
+        with self._lock:
+            hist = self.histograms.get(key)
+            if hist is None:
+                hist = self.histograms[key] = Histogram(self.window)
+            hist.observe(seconds)
+            if self._trace is not None:
+                record = {"name": name, "start": round(start if start is not None else time.time() - seconds, 6),
+                          "dur": round(seconds, 6), "thread": threading.current_thread().name}
+                if labels:
+                    record["labels"] = labels
+                self._trace.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+    def count(self, name: str, n: int = 1, **labels):
+        key = _key(name, labels)
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + n
+
+    def span(self, name: str, **labels) -> "Span":
+        return Span(self, name, labels)
+
+    def summary(self) -> dict:
+        """{阶段: {count, p50, p95, p99 (毫秒)}}，标签拼在名字后面"""
+        with self._lock:
+            items = list(self.histograms.items())
+            counters = dict(self.counters)
+        result = {}
+        for (name, labels), hist in items:
+            label = name + "".join(f"[{v}]" for _, v in labels)
+            result[label] = {"count": hist.count,
+                             **{f"p{int(q * 100)}": round(hist.quantile(q) * 1000, 1) for q in QUANTILES}}
+        for (name, labels), value in counters.items():
+            result[name + "".join(f"[{v}]" for _, v in labels)] = value
+        return result
+
+    def prometheus(self) -> str:
+        """Prometheus 文本格式"""
+        with self._lock:
+            histograms = sorted(self.histograms.items())
+            counters = sorted(self.counters.items())
+        lines = []
+        seen = set()
+        for (name, labels), value in counters:
+            metric = f"{PREFIX}_{name}_total"
+            if metric not in seen:
+                seen.add(metric)
+                lines.append(f"# TYPE {metric} counter")
+            lines.append(f"{metric}{_labels(labels)} {value}")
+        for (name, labels), hist in histograms:
+            metric = f"{PREFIX}_{name}_seconds"
+            if metric not in seen:
+                seen.add(metric)
+                lines.append(f"# TYPE {metric} histogram")
+            cumulative = 0
+            for bound, n in zip(BUCKETS + (float("inf"),), hist.buckets):
+                cumulative += n
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(f"{metric}_bucket{_labels(labels + (('le', le),))} {cumulative}")
+            lines.append(f"{metric}_sum{_labels(labels)} {hist.sum:.6f}")
+            lines.append(f"{metric}_count{_labels(labels)} {hist.count}")
+        for (name, labels), hist in histograms:
+            metric = f"{PREFIX}_{name}_recent_seconds"
+            if metric not in seen:
+                seen.add(metric)
+                lines.append(f"# TYPE {metric} gauge")
+            for q in QUANTILES:
+                lines.append(f"{metric}{_labels(labels + (('quantile', str(q)),))} {hist.quantile(q):.6f}")
+        return "\n".join(lines) + "\n"
+
+    def serve(self, port: int, host: str = "127.0.0.1"):
+        """后台线程提供 GET /metrics"""
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, fmt, *args):
+                pass
+
+            def do_GET(self):
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                data = metrics.prometheus().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, name="metrics-http", daemon=True).start()
+        print(f"[指标] Prometheus 端点: http://{host}:{self._server.server_port}/metrics")
+        return self._server
+
+    def close(self):
+        with self._lock:
+            if self._trace is not None:
+                self._trace.close()
+                self._trace = None
+        if self._server is not None:
+            self._server.shutdown()
+            self._server = None
+
+
+def _labels(labels: tuple) -> str:
+    if not labels:
+        return ""
+    body = ",".join(f'{k}="{_escape(v)}"' for k, v in labels)
+    return "{" + body + "}"
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class Span:
+    __slots__ = ("metrics", "name", "labels", "start", "wall")
+
+    def __init__(self, metrics: Metrics, name: str, labels: dict):
+        self.metrics = metrics
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.wall = time.time()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        labels = self.labels if exc_type is None else {**self.labels, "error": exc_type.__name__}
+        self.metrics.observe(self.name, time.perf_counter() - self.start, self.wall, **labels)
+        return False
+
+
+_metrics = None
+_lock = threading.Lock()
+_enabled = None
+
+
+def enabled() -> bool:
+    global _enabled
+    if _enabled is None:
+        _enabled = os.getenv("METRICS", "0") == "1"
+    return _enabled
+
+
+def get_metrics() -> Metrics:
+    """METRICS=1 时返回全局 Metrics（按 METRICS_TRACE / METRICS_PORT 打开追踪文件和 HTTP 端点），否则返回 None"""
+    global _metrics
+    if not enabled():
+        return None
+    if _metrics is None:
+        with _lock:
+            if _metrics is None:
+                metrics = Metrics(os.getenv("METRICS_TRACE", "") or None)
+                port = int(os.getenv("METRICS_PORT", 9108))
+                if port:
+                    try:
+                        metrics.serve(port)
+                    except OSError as e:
+                        print(f"[指标] 无法监听端口 {port}: {e}")
+                _metrics = metrics
+    return _metrics
+
+
+def span(name: str, **labels):
+    if not enabled():
+        return _NOOP
+    return get_metrics().span(name, **labels)
+
+
+def observe(name: str, seconds: float, **labels):
+    if enabled():
+        get_metrics().observe(name, seconds, **labels)
+
+
+def count(name: str, n: int = 1, **labels):
+    if enabled():
+        get_metrics().count(name, n, **labels)
+
+
+def summary() -> dict:
+    return get_metrics().summary() if enabled() else {}
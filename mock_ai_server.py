@@ -0,0 +1,371 @@
+"""
+离线测试用的本地 AI 服务：同时模拟 Gemini REST（genai.configure(transport="rest") 使用的接口）和 OpenAI 兼容接口。
+
+    POST /v1beta/models/<model>:generateContent   (Gemini)
+    POST /v1/chat/completions                     (OpenAI 兼容)
+    GET  /v1beta/models, /v1/models               (模型列表)
+    GET  /stats                                   (请求数、各类错误数、最大并发等)
+
+用法:
+    python mock_ai_server.py --port 8765 --latency 0.8 --jitter 0.3 --error-rate 0.05
+    python mock_ai_server.py --dist lognormal --latency 0.8 --spread 0.4 --errors 503:0.03,429:0.02,timeout:0.01
+    python mock_ai_server.py --script mock_script.json --max-concurrency 8
+
+- 耗时分布 --dist: constant / uniform（latency ± spread，--jitter 是它的旧写法）/ normal（标准差 spread）/
+  lognormal（中位数 latency，对数标准差 spread）/ exponential（均值 latency）
+- 错误 --errors: 种类:概率，逗号分隔。503 / 500 / 429 返回对应状态码（503 / 429 带 Retry-After）；
+  timeout 挂起 --hang 秒后返回 504（客户端通常先超时）；garbage 返回 200 但内容不是 JSON；
+  empty 返回 200 但没有候选结果。--error-rate 等同于 503:概率
+- --max-concurrency: 同时处理的请求超过该数时直接返回 429，模拟中转服务的并发上限
+- 脚本 --script（JSON），按顺序 (sequence) 或按权重随机 (random) 选择回复：
+    {"mode": "sequence", "replies": [
+        {"reply": {"task": "愿望", "action": "click", "points": [{"x": 455, "y": 450}]}},
+        {"reply": "不是 JSON 的回复", "weight": 2},
+        {"match": "猜拳", "protocol": "openai", "reply": {...}, "latency": 2.0},
+        {"error": "503"}
+    ]}
+  match 为请求提示词中出现的文字，protocol 为 gemini / openai，不满足的条目跳过；
+  条目中的 latency（秒）覆盖全局耗时；命中带 reply 的条目时不再按 --errors 随机出错，error 条目总是出错。
+  直接给出数组时等同于 sequence。
+
+然后在 ai_backends.json 中加入
+    {"name": "mock-gemini", "type": "gemini", "model": "mock", "endpoint": "http://127.0.0.1:8765"}
+或  {"name": "mock-openai", "type": "openai", "model": "mock", "base_url": "http://127.0.0.1:8765/v1"}
+压测决策流水线的吞吐上限见 load_driver.py。
+"""
+import argparse
+import json
+import math
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_REPLY = '{"task": "等待", "action": "wait", "points": []}'
+LATENCY_DISTS = ("constant", "uniform", "normal", "lognormal", "exponential")
+ERROR_KINDS = ("503", "500", "429", "timeout", "garbage", "empty")
+
+
+def parse_errors(spec: str) -> dict:
+    """"503:0.03,timeout:0.01" -> {"503": 0.03, "timeout": 0.01}"""
+    errors = {}
+    for item in (spec or "").split(","):
+        if not item.strip():
+            continue
+        kind, _, rate = item.partition(":")
+        kind = kind.strip()
+        if kind not in ERROR_KINDS:
+            raise ValueError(f"未知的错误类型: {kind}")
+        errors[kind] = float(rate)
+    return errors
+
+
+def load_script(path: str) -> tuple:
+    """返回 (mode, 条目列表)"""
+    with open(path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    if isinstance(data, list):
+        data = {"replies": data}
+    mode = data.get("mode", "sequence")
+    if mode not in ("sequence", "random"):
+        raise ValueError(f"未知的脚本模式: {mode}")
+    entries = data["replies"]
+    for entry in entries:
+        if entry.get("error") is not None and entry["error"] not in ERROR_KINDS:
+            raise ValueError(f"未知的错误类型: {entry['error']}")
+        if entry.get("error") is None and "reply" not in entry:
+            raise ValueError(f"脚本条目需要 reply 或 error: {entry}")
+    return mode, entries
+
+
+def prompt_text(protocol: str, body: dict) -> str:
+    """请求中的提示词文字（用于脚本的 match）"""
+    texts = []
+    if protocol == "gemini":
+        for content in body.get("contents", []):
+            texts += [p.get("text", "") for p in content.get("parts", []) if isinstance(p, dict)]
+    else:
+        for message in body.get("messages", []):
+            content = message.get("content")
+            if isinstance(content, str):
+                texts.append(content)
+            elif isinstance(content, list):
+                texts += [c.get("text", "") for c in content if isinstance(c, dict)]
+    return "\n".join(texts)
+
+
+class MockState:
+    """
+    reply: 没有脚本（或脚本中没有匹配的条目）时的回复
+    latency / jitter: 每个请求的响应耗时为 latency ± jitter 秒（dist="uniform"）；spread 为其他分布的离散程度
+    error_rate: 以该概率返回 503 (带 Retry-After)；errors: {错误类型: 概率}，与 error_rate 叠加
+    script: (mode, 条目列表)，见 load_script
+    max_concurrency: 同时处理的请求超过该数时返回 429（0 不限制）
+    hang: timeout 错误挂起的秒数
+    """
+
+    def __init__(self, reply: str = DEFAULT_REPLY, latency: float = 0.5, jitter: float = 0.0,
+                 error_rate: float = 0.0, dist: str = "uniform", spread: float = None, errors: dict = None,
+                 script: tuple = None, max_concurrency: int = 0, hang: float = 30.0, seed: int = None):
+        if dist not in LATENCY_DISTS:
+            raise ValueError(f"未知的耗时分布: {dist}")
+        self.reply = reply
+        self.latency = latency
+        self.jitter = jitter
+        self.dist = dist
+        self.spread = jitter if spread is None else spread
+        self.errors = dict(errors or {})
+        if error_rate:
+            self.errors["503"] = self.errors.get("503", 0.0) + error_rate
+        self.error_rate = error_rate
+        self.script_mode, self.script = script or ("sequence", [])
+        self.max_concurrency = max_concurrency
+        self.hang = hang
+        self.random = random.Random(seed)
+        self.requests = 0
+        self.errors_by_kind = {}
+        self.protocols = {}
+        self.inflight = 0
+        self.peak_inflight = 0
+        self._cursor = 0
+        self._lock = threading.Lock()
+
+    def next_reply(self, protocol: str, body: dict) -> str:
+        return self.plan(protocol, body)[2]
+
+    def _script_entry(self, protocol: str, body: dict) -> dict:
+        if not self.script:
+            return None
+        text = prompt_text(protocol, body)
+        candidates = [e for e in self.script
+                      if e.get("protocol") in (None, protocol) and (not e.get("match") or e["match"] in text)]
+        if not candidates:
+            return None
+        with self._lock:
+            if self.script_mode == "random":
+                return self.random.choices(candidates, weights=[e.get("weight", 1) for e in candidates])[0]
+            entry = candidates[self._cursor % len(candidates)]
+            self._cursor += 1
+            return entry
+
+    def plan(self, protocol: str, body: dict) -> tuple:
+        """本次请求的 (耗时, 错误类型或 None, 回复文本)"""
+        entry = self._script_entry(protocol, body) or {}
+        delay = entry["latency"] if "latency" in entry else self.delay()
+        error = entry.get("error")
+        if error is None and "reply" not in entry:
+            error = self._draw_error()
+        reply = entry.get("reply", self.reply)
+        if not isinstance(reply, str):
+            reply = json.dumps(reply, ensure_ascii=False)
+        return delay, error, reply
+
+    def _draw_error(self):
+        with self._lock:
+            roll = self.random.random()
+        for kind, rate in self.errors.items():
+            if roll < rate:
+                return kind
+            roll -= rate
+        return None
+
+    def delay(self) -> float:
+        with self._lock:
+            rng = self.random
+            if self.dist == "constant":
+                value = self.latency
+            elif self.dist == "uniform":
+                value = self.latency + rng.uniform(-self.spread, self.spread)
+            elif self.dist == "normal":
+                value = rng.gauss(self.latency, self.spread)
+            elif self.dist == "lognormal":
+                value = self.latency * math.exp(rng.gauss(0.0, self.spread))
+            else:
+                value = rng.expovariate(1.0 / self.latency) if self.latency > 0 else 0.0
+        return max(value, 0.0)
+
+    def enter(self) -> bool:
+        """开始处理一个请求；超过 max_concurrency 时返回 False"""
+        with self._lock:
+            if self.max_concurrency and self.inflight >= self.max_concurrency:
+                return False
+            self.inflight += 1
+            self.peak_inflight = max(self.peak_inflight, self.inflight)
+            return True
+
+    def leave(self):
+        with self._lock:
+            self.inflight -= 1
+
+    def reset_peak(self):
+        """重新统计最大并发（压测每一档开始时调用）"""
+        with self._lock:
+            self.peak_inflight = self.inflight
+
+    def count(self, error, protocol: str = None):
+        """error: 错误类型（旧的调用方式传 True / False）"""
+        if error is True:
+            error = "503"
+        with self._lock:
+            self.requests += 1
+            if protocol:
+                self.protocols[protocol] = self.protocols.get(protocol, 0) + 1
+            if error:
+                self.errors_by_kind[error] = self.errors_by_kind.get(error, 0) + 1
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            return {"requests": self.requests, "errors": sum(self.errors_by_kind.values()),
+                    "errors_by_kind": dict(self.errors_by_kind), "protocols": dict(self.protocols),
+                    "inflight": self.inflight, "peak_inflight": self.peak_inflight}
+
+
+def gemini_response(text: str) -> dict:
+    return {
+        "candidates": [{"content": {"role": "model", "parts": [{"text": text}]}, "finishReason": "STOP"}],
+        "usageMetadata": {"promptTokenCount": 300, "candidatesTokenCount": max(len(text) // 3, 1)},
+    }
+
+
+def openai_response(model: str, text: str) -> dict:
+    return {
+        "id": f"mock-{int(time.time() * 1000)}",
+        "object": "chat.completion",
+        "model": model,
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": "stop"}],
+        "usage": {"prompt_tokens": 300, "completion_tokens": max(len(text) // 3, 1)},
+    }
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    state: MockState = None
+
+    def log_message(self, fmt, *args):
+        pass
+
+    def _send(self, status: int, payload, headers: dict = None):
+        if isinstance(payload, str):
+            data, content_type = payload.encode("utf-8"), "text/plain; charset=utf-8"
+        else:
+            data, content_type = json.dumps(payload, ensure_ascii=False).encode("utf-8"), "application/json; charset=utf-8"
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        try:
+            self.wfile.write(data)
+        except (BrokenPipeError, ConnectionResetError):
+            # 客户端已经超时放弃（或者对冲请求的另一路先返回了）
+            pass
+
+    def do_HEAD(self):
+        # AIClient.warmup() 用 HEAD 预先建立连接
+        self.send_response(200)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def do_GET(self):
+        path = self.path.split("?")[0].rstrip("/")
+        if path == "/stats":
+            self._send(200, self.state.to_dict())
+        elif path == "/v1beta/models":
+            self._send(200, {"models": [{"name": "models/mock", "supportedGenerationMethods": ["generateContent"]}]})
+        elif path == "/v1/models":
+            self._send(200, {"object": "list", "data": [{"id": "mock", "object": "model", "owned_by": "mock"}]})
+        else:
+            self._send(404, {"error": "not found"})
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        try:
+            body = json.loads(self.rfile.read(length) or b"{}")
+        except ValueError:
+            self._send(400, {"error": "invalid json"})
+            return
+        path = self.path.split("?")[0]
+        if path.endswith(":generateContent"):
+            protocol = "gemini"
+        elif path.rstrip("/").endswith("/chat/completions"):
+            protocol = "openai"
+        else:
+            self._send(404, {"error": f"unknown path {self.path}"})
+            return
+
+        state = self.state
+        if not state.enter():
+            state.count("429", protocol)
+            self._send(429, {"error": {"code": 429, "message": "mock concurrency limit"}}, {"Retry-After": "1"})
+            return
+        try:
+            delay, error, text = state.plan(protocol, body)
+            time.sleep(state.hang if error == "timeout" else delay)
+            state.count(error, protocol)
+            self._respond(protocol, body, error, text)
+        finally:
+            state.leave()
+
+    def _respond(self, protocol: str, body: dict, error: str, text: str):
+        if error == "timeout":
+            self._send(504, {"error": {"code": 504, "message": "mock timeout"}})
+        elif error in ("503", "429"):
+            self._send(int(error), {"error": {"code": int(error), "message": "mock overloaded"}},
+                       {"Retry-After": "0.5" if error == "503" else "1"})
+        elif error == "500":
+            self._send(500, {"error": {"code": 500, "message": "mock internal error"}})
+        elif error == "garbage":
+            self._send(200, "<html>502 Bad Gateway</html>")
+        elif error == "empty":
+            self._send(200, {"candidates": []} if protocol == "gemini" else {"choices": []})
+        elif protocol == "gemini":
+            self._send(200, gemini_response(text))
+        else:
+            self._send(200, openai_response(body.get("model", "mock"), text))
+
+
+def serve(state: MockState, host: str = "127.0.0.1", port: int = 8765) -> ThreadingHTTPServer:
+    """在后台线程启动服务并返回 server（port=0 时自动分配端口，见 server.server_port）"""
+    handler = type("BoundMockHandler", (MockHandler,), {"state": state})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    server.request_queue_size = 128
+    threading.Thread(target=server.serve_forever, name="mock-ai-server", daemon=True).start()
+    return server
+
+
+def add_profile_args(parser: argparse.ArgumentParser):
+    """回复、耗时和错误相关的参数（load_driver.py 也使用）"""
+    parser.add_argument('--latency', type=float, default=0.5, help='平均响应耗时 (秒)')
+    parser.add_argument('--jitter', type=float, default=0.0, help='耗时随机波动 (秒)，等同于 --dist uniform --spread')
+    parser.add_argument('--dist', choices=LATENCY_DISTS, default='uniform', help='耗时分布')
+    parser.add_argument('--spread', type=float, default=None, help='分布的离散程度，含义见文件开头')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='返回 503 的概率')
+    parser.add_argument('--errors', default='', help='错误类型和概率，例如 503:0.03,timeout:0.01')
+    parser.add_argument('--hang', type=float, default=30.0, help='timeout 错误挂起的秒数')
+    parser.add_argument('--max-concurrency', type=int, default=0, help='同时处理的请求上限，超过返回 429')
+    parser.add_argument('--script', default=None, help='回复脚本 (JSON)')
+    parser.add_argument('--reply', default=DEFAULT_REPLY, help='固定回复文本')
+    parser.add_argument('--seed', type=int, default=None)
+
+
+def state_from_args(args) -> MockState:
+    return MockState(args.reply, args.latency, args.jitter, args.error_rate, dist=args.dist, spread=args.spread,
+                     errors=parse_errors(args.errors), script=load_script(args.script) if args.script else None,
+                     max_concurrency=args.max_concurrency, hang=args.hang, seed=args.seed)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='本地模拟 AI 服务 (Gemini / OpenAI 兼容)')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    add_profile_args(parser)
+    args = parser.parse_args()
+
+    server = serve(state_from_args(args), args.host, args.port)
+    print(f"模拟 AI 服务已启动: http://{args.host}:{server.server_port}  (Ctrl+C 停止)")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
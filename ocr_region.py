@@ -1,127 +1,649 @@
 import argparse
-from re import A
-from PIL import Image, ImageOps, ImageEnhance
+from PIL import Image
 import os
-import io
+import json
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
 
-COORDS = (1056, 524, 1250, 688)  # (left, top, right, bottom)
+import numpy as np
+
+from frame import as_frame
+from regions import COORDS, MSG_COORDS
+from metrics import count, observe
+from rule_engine import get_rule_engine
+from variant_scheduler import VariantScheduler, get_variant_scheduler
+
+
+
+class OCREngine:
+    """
+    进程内共享的 RapidOCR 引擎。
+    模型（det/cls/rec 三个 ONNX 会话）只加载一次，之后所有调用复用同一个实例。
+    """
+
+    def __init__(self, intra_op_num_threads: int = -1, inter_op_num_threads: int = -1, **options):
+        # options 直接透传给 RapidOCR(**kwargs)，例如 det_limit_side_len / rec_batch_num / text_score
+        self.options = dict(options)
+        self.options["intra_op_num_threads"] = intra_op_num_threads
+        self.options["inter_op_num_threads"] = inter_op_num_threads
+        self._reader = None
+        self._failed = False
+        self._lock = threading.Lock()
+        self._warm_thread = None
+        self.load_seconds = 0.0
+        self.warmup_seconds = 0.0
+        self.warmed = False
+
+    @classmethod
+    def from_env(cls) -> "OCREngine":
+        """从环境变量构建引擎配置 (OCR_INTRA_THREADS / OCR_INTER_THREADS / OCR_OPTIONS)"""
+        options = {}
+        raw = os.getenv("OCR_OPTIONS", "").strip()
+        if raw:
+            try:
+                options = json.loads(raw)
+            except ValueError as e:
+                print(f"OCR_OPTIONS 不是合法的 JSON，已忽略: {e}")
+        return cls(
+            intra_op_num_threads=int(os.getenv("OCR_INTRA_THREADS", -1)),
+            inter_op_num_threads=int(os.getenv("OCR_INTER_THREADS", -1)),
+            **options,
+        )
+
+    @property
+    def loaded(self) -> bool:
+        return self._reader is not None
+
+    def load(self):
+        """加载模型（只执行一次），失败返回 None"""
+        if self._reader is not None or self._failed:
+            return self._reader
+        with self._lock:
+            if self._reader is None and not self._failed:
+                start = time.perf_counter()
+                try:
+                    from rapidocr_onnxruntime import RapidOCR
+                    self._reader = RapidOCR(**self.options)
+                except Exception as e:
+                    print(f"Failed to initialize RapidOCR: {e}")
+                    self._failed = True
+                    return None
+                self.load_seconds = time.perf_counter() - start
+                print(f"[OCR] 模型加载完成，用时 {self.load_seconds:.2f}s")
+        return self._reader
+
+    def warmup(self) -> bool:
+        """用一张空白图片跑一遍 det/cls/rec，让 onnxruntime 完成首次推理的初始化"""
+        reader = self.load()
+        if reader is None:
+            return False
+        if self.warmed:
+            return True
+        start = time.perf_counter()
+        try:
+            blank = Image.new("RGB", (192, 48), (255, 255, 255))
+            # 空白图检测不到文本框，完整流程只会跑到 det，cls/rec 需要单独调用
+            reader(blank)
+            line = np.asarray(blank)
+            reader.text_cls([line])
+            reader.text_rec([line])
+        except Exception as e:
+            print(f"[OCR] 预热失败: {e}")
+            return False
+        self.warmup_seconds = time.perf_counter() - start
+        self.warmed = True
+        print(f"[OCR] 预热完成，用时 {self.warmup_seconds:.2f}s")
+        return True
+
+    def warmup_async(self) -> threading.Thread:
+        """在后台线程中加载并预热（例如等待用户手动登录时）"""
+        if self._warm_thread is None:
+            self._warm_thread = threading.Thread(target=self.warmup, name="ocr-warmup", daemon=True)
+            self._warm_thread.start()
+        return self._warm_thread
+
+    def __call__(self, img, **kwargs):
+        reader = self.load()
+        if reader is None:
+            return None
+        return reader(img, **kwargs)
+
+
+_engine = None
+_engine_lock = threading.Lock()
+
+
+def get_ocr_engine() -> OCREngine:
+    """返回进程内唯一的 OCR 引擎（首次调用时按环境变量创建，不会立即加载模型）"""
+    global _engine
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                _engine = OCREngine.from_env()
+    return _engine
+
+
+def set_ocr_engine(engine: OCREngine) -> None:
+    """替换全局 OCR 引擎（例如 CLI 指定了线程数）"""
+    global _engine
+    with _engine_lock:
+        _engine = engine
 
 
 def get_ocr_reader():
+    return get_ocr_engine().load()
+
+
+# 按照测试结果的成功率排序，优先使用效果最好的变体
+VARIANT_ORDER = (
+    "AutoContrast",     # 测试证明对 "自动" 识别效果最好
+    "Equalized",        # 测试证明也能识别 "自动"
+    "Upscaled2xAuto",   # 针对小文字
+    "Upscaled2xEq",
+    "BrightContrast",
+    "InvContrast",      # for semi-transparent dark overlays
+    "Original",
+    "Upscaled2x",
+    "HighContrast",
+    "Inverted",
+)
+
+# 各变体相对原始 ROI 的缩放倍数，用于把检测框换算回 ROI 坐标
+VARIANT_SCALE = {"Upscaled2xAuto": 2, "Upscaled2xEq": 2, "Upscaled2x": 2}
+
+# ImageOps/ImageEnhance 转灰度时使用的 ITU-R 601-2 权重，按 BGR 通道顺序排列
+_GRAY_WEIGHTS_BGR = np.array([0.114, 0.587, 0.299])
+_IDENTITY_LUT = np.arange(256, dtype=np.float64)
+
+
+def _histograms(arr: np.ndarray) -> np.ndarray:
+    """一次遍历得到每个通道的 256 级直方图，形状 (3, 256)"""
+    offsets = np.array([0, 256, 512], dtype=np.uint16)
+    return np.bincount((arr + offsets).ravel(), minlength=768).reshape(3, 256)
+
+
+def _apply_luts(arr: np.ndarray, luts: np.ndarray) -> np.ndarray:
+    """对每个通道套用各自的查找表，luts 形状 (3, 256)"""
+    luts = np.clip(luts, 0, 255).astype(np.uint8)
+    return luts[np.arange(3), arr]
+
+
+def _autocontrast_luts(hist: np.ndarray, cutoff: float = 5) -> np.ndarray:
+    """等价于 ImageOps.autocontrast(img, cutoff)：按通道裁掉两端 cutoff% 后线性拉伸"""
+    luts = []
+    for h in hist:
+        cut = int(h.sum()) * cutoff // 100
+        above_low = np.nonzero(np.cumsum(h) > cut)[0]
+        above_high = np.nonzero(np.cumsum(h[::-1]) > cut)[0]
+        if not len(above_low) or not len(above_high):
+            luts.append(_IDENTITY_LUT)
+            continue
+        lo, hi = above_low[0], 255 - above_high[0]
+        if hi <= lo:
+            luts.append(_IDENTITY_LUT)
+            continue
+        scale = 255.0 / (hi - lo)
+        luts.append(np.trunc(_IDENTITY_LUT * scale - lo * scale))
+    return np.array(luts)
+
+
+def _equalize_luts(hist: np.ndarray) -> np.ndarray:
+    """等价于 ImageOps.equalize(img)：按通道做直方图均衡"""
+    luts = []
+    for h in hist:
+        used = h[h > 0]
+        if len(used) <= 1:
+            luts.append(_IDENTITY_LUT)
+            continue
+        step = (int(used.sum()) - int(used[-1])) // 255
+        if not step:
+            luts.append(_IDENTITY_LUT)
+            continue
+        before = np.concatenate(([0], np.cumsum(h)[:-1]))
+        luts.append((step // 2 + before) // step)
+    return np.array(luts, dtype=np.float64)
+
+
+def _contrast_luts(hist: np.ndarray, luts: np.ndarray, factor: float) -> np.ndarray:
+    """
+    在已有查找表之后叠加 ImageEnhance.Contrast(factor)。
+    灰度均值直接由直方图和查找表算出，无需再遍历一次图像。
+    """
+    luts = np.clip(luts, 0, 255)
+    channel_means = (hist * luts).sum(axis=1) / max(int(hist[0].sum()), 1)
+    mean = int(float(_GRAY_WEIGHTS_BGR @ channel_means) + 0.5)
+    return np.rint(mean + factor * (luts - mean))
+
+
+class OCRVariants:
+    """
+    为一个 ROI 惰性生成 OCR 预处理变体。
+    变体都是 numpy 数组 (BGR, HxWx3)，可直接传给 RapidOCR；
+    只有前面的变体识别失败时才会计算后面的变体，且中间结果（直方图、2x 放大图）只算一次。
+    """
+
+    def __init__(self, img):
+        if isinstance(img, Image.Image):
+            img = np.asarray(img.convert("RGB"))
+        # RGB -> BGR 只是一个视图，不复制数据
+        self.base = img[..., ::-1]
+        self._cache = {"Original": self.base}
+        self._hist = {}
+        # 并行模式下多个线程会同时取变体，共享的中间结果（直方图、放大图）只算一次
+        self._lock = threading.RLock()
+
+    def _histogram(self, key: str, arr: np.ndarray) -> np.ndarray:
+        if key not in self._hist:
+            self._hist[key] = _histograms(arr)
+        return self._hist[key]
+
+    def _upscaled(self) -> np.ndarray:
+        if "Upscaled2x" not in self._cache:
+            # LANCZOS 对每个通道独立计算，通道顺序不影响结果
+            h, w = self.base.shape[:2]
+            pil = Image.fromarray(np.ascontiguousarray(self.base))
+            self._cache["Upscaled2x"] = np.asarray(pil.resize((w * 2, h * 2), Image.Resampling.LANCZOS))
+        return self._cache["Upscaled2x"]
+
+    def _build(self, name: str) -> np.ndarray:
+        base = self.base
+        if name == "Upscaled2x":
+            return self._upscaled()
+        if name == "Upscaled2xAuto":
+            up = self._upscaled()
+            return _apply_luts(up, _autocontrast_luts(self._histogram("up", up)))
+        if name == "Upscaled2xEq":
+            up = self._upscaled()
+            return _apply_luts(up, _equalize_luts(self._histogram("up", up)))
+
+        hist = self._histogram("base", base)
+        identity = np.tile(_IDENTITY_LUT, (3, 1))
+        if name == "AutoContrast":
+            luts = _autocontrast_luts(hist)
+        elif name == "Equalized":
+            luts = _equalize_luts(hist)
+        elif name == "BrightContrast":
+            # Brightness(1.5) 后 Contrast(2.0)，合成为一张查找表
+            luts = _contrast_luts(hist, np.trunc(identity * 1.5), 2.0)
+        elif name == "InvContrast":
+            luts = _contrast_luts(hist, 255 - identity, 3.0)
+        elif name == "HighContrast":
+            luts = _contrast_luts(hist, identity, 2.5)
+        elif name == "Inverted":
+            luts = 255 - identity
+        else:
+            raise KeyError(name)
+        return _apply_luts(base, luts)
+
+    def get(self, name: str) -> np.ndarray:
+        if name not in self._cache:
+            with self._lock:
+                if name not in self._cache:
+                    self._cache[name] = self._build(name)
+        return self._cache[name]
+
+    def __iter__(self):
+        return self.iter(VARIANT_ORDER)
+
+    def iter(self, order):
+        for name in order:
+            try:
+                yield name, self.get(name)
+            except Exception as e:
+                print(f"生成变体 {name} 失败: {e}")
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def parallel_variants() -> int:
+    """OCR_PARALLEL: 每一轮同时提交的变体数 (top-K)，0 或 1 表示逐个顺序尝试"""
+    return max(int(os.getenv("OCR_PARALLEL", 0)), 0)
+
+
+def get_ocr_pool(name: str = "variants") -> ThreadPoolExecutor:
+    """
+    共享线程池。onnxruntime 推理时会释放 GIL，多个变体可以真正并行。
+    "variants" 池执行单个变体的识别，"regions" 池执行整个区域的 smart_ocr，
+    两者分开，避免区域任务占满线程后等待变体任务造成死锁。
+    """
+    with _pools_lock:
+        pool = _pools.get(name)
+        if pool is None:
+            if name == "regions":
+                workers = 2
+            else:
+                workers = int(os.getenv("OCR_POOL_WORKERS", 0)) or max(parallel_variants() * 2, 2)
+            pool = _pools[name] = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=f"ocr-{name}")
+        return pool
+
+
+def _recognize_variant(reader, variants: "OCRVariants", v_name: str, label: str,
+                       scheduler: VariantScheduler) -> tuple:
+    """识别单个变体，返回 (文本, RapidOCR 原始结果)"""
+    v_start = time.perf_counter()
     try:
-        from rapidocr_onnxruntime import RapidOCR
-        return RapidOCR()
-    except Exception as e:
-        print(f"Failed to initialize RapidOCR: {e}")
-        return None
+        res = reader(variants.get(v_name))
+        text = parse_result(res)
+    except Exception:
+        res, text = None, ""
+    elapsed = time.perf_counter() - v_start
+    scheduler.record(label, v_name, bool(text.strip()), elapsed * 1000)
+    observe("ocr_variant", elapsed, region=label, variant=v_name)
+    count("ocr_variants", region=label)
+    return text, res
 
 
-def smart_ocr(img: Image.Image, label: str = "Image") -> str:
-    reader = get_ocr_reader()
+def _fill_details(details: dict, v_name: str, res):
+    """把命中变体的检测框（换算回 ROI 坐标）和置信度写入 details"""
+    if details is None:
+        return
+    details["variant"] = v_name
+    details["boxes"] = []
+    details["texts"] = []
+    details["scores"] = []
+    items = res[0] if isinstance(res, tuple) else res
+    if not isinstance(items, list):
+        return
+    scale = VARIANT_SCALE.get(v_name, 1)
+    for item in items:
+        if isinstance(item, (list, tuple)) and len(item) >= 3 and isinstance(item[1], str):
+            xs = [pt[0] for pt in item[0]]
+            ys = [pt[1] for pt in item[0]]
+            details["boxes"].append((int(min(xs) / scale), int(min(ys) / scale),
+                                     int(max(xs) / scale + 0.5), int(max(ys) / scale + 0.5)))
+            details["texts"].append(item[1])
+            details["scores"].append(float(item[2]))
+
+
+def _smart_ocr_parallel(reader, variants: "OCRVariants", order: list, label: str,
+                        scheduler: VariantScheduler, top_k: int) -> tuple:
+    """
+    每轮把 top_k 个变体同时提交到线程池，按优先级取第一个非空结果；
+    命中后取消尚未开始的变体，已经在跑的结果直接忽略。
+    """
+    pool = get_ocr_pool()
+    start = time.perf_counter()
+    tried = 0
+    while tried < len(order):
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        if not scheduler.within_budget(tried, elapsed_ms):
+            print(f"[{label}] 已达到尝试预算 ({tried} 个变体, {elapsed_ms:.0f}ms)，放弃本帧")
+            break
+        wave = order[tried:tried + top_k]
+        if scheduler.max_variants:
+            wave = wave[:scheduler.max_variants - tried]
+        tried += len(wave)
+        futures = [(v_name, pool.submit(_recognize_variant, reader, variants, v_name, label, scheduler))
+                   for v_name in wave]
+        for i, (v_name, future) in enumerate(futures):
+            text, res = future.result()
+            if text.strip():
+                for _, rest in futures[i + 1:]:
+                    rest.cancel()
+                return v_name, text, res
+    return None, "", None
+
+
+def smart_ocr(img, label: str = "Image", engine: OCREngine = None,
+              scheduler: VariantScheduler = None, parallel: int = None, details: dict = None) -> str:
+    """
+    对一个 ROI 依次尝试各个预处理变体，返回第一个非空的识别结果。
+    img 可以是 PIL 图片，也可以是 RGB 的 numpy 数组（例如整帧数组的切片视图）。
+    变体顺序和尝试预算由 scheduler 根据该区域 (label) 的历史命中率决定；
+    parallel > 1 时每轮并行尝试 parallel 个变体（默认取 OCR_PARALLEL）。
+    传入 details 字典时，会写入命中的变体名、文本框 (ROI 坐标)、各框的文本和置信度。
+    """
+    engine = engine or get_ocr_engine()
+    reader = engine.load()
     if not reader:
         return ""
+    scheduler = scheduler or get_variant_scheduler(VARIANT_ORDER)
+    parallel = parallel_variants() if parallel is None else parallel
+    variants = OCRVariants(img)
+    order = scheduler.order(label)
 
-    # Prepare image variants for OCR
-    # 按照测试结果的成功率排序，优先使用效果最好的变体
-    variants = []
-    
-    # 1. AutoContrast - 测试证明对 "自动" 识别效果最好
-    try:
-        auto_contrast = ImageOps.autocontrast(img, cutoff=5)
-        variants.append(("AutoContrast", auto_contrast))
-    except Exception:
-        pass
-    
-    # 2. Equalized histogram - 测试证明也能识别 "自动"
-    try:
-        equalized = ImageOps.equalize(img)
-        variants.append(("Equalized", equalized))
-    except Exception:
-        pass
-    
-    # 3. Upscaled + AutoContrast - 针对小文字
-    try:
-        upscaled = img.resize((img.width * 2, img.height * 2), Image.Resampling.LANCZOS)
-        upscaled_auto = ImageOps.autocontrast(upscaled, cutoff=5)
-        variants.append(("Upscaled2xAuto", upscaled_auto))
-    except Exception:
-        pass
-    
-    # 4. Upscaled + Equalized
-    try:
-        upscaled = img.resize((img.width * 2, img.height * 2), Image.Resampling.LANCZOS)
-        upscaled_eq = ImageOps.equalize(upscaled)
-        variants.append(("Upscaled2xEq", upscaled_eq))
-    except Exception:
-        pass
-    
-    # 5. Brightness boosted + Contrast
-    try:
-        bright_img = ImageEnhance.Brightness(img).enhance(1.5)
-        bright_contrast = ImageEnhance.Contrast(bright_img).enhance(2.0)
-        variants.append(("BrightContrast", bright_contrast))
-    except Exception:
-        pass
-    
-    # 6. Inverted + High Contrast - for semi-transparent dark overlays
-    try:
-        inverted = ImageOps.invert(img)
-        inv_contrast = ImageEnhance.Contrast(inverted).enhance(3.0)
-        variants.append(("InvContrast", inv_contrast))
-    except Exception:
-        pass
-    
-    # 7. Original
-    variants.append(("Original", img))
-    
-    # 8. Upscaled Original (2x)
-    try:
-        upscaled = img.resize((img.width * 2, img.height * 2), Image.Resampling.LANCZOS)
-        variants.append(("Upscaled2x", upscaled))
-    except Exception:
-        pass
-    
-    # 9. High Contrast
-    try:
-        enhancer = ImageEnhance.Contrast(img)
-        high_contrast = enhancer.enhance(2.5)
-        variants.append(("HighContrast", high_contrast))
-    except Exception:
-        pass
-    
-    # 10. Inverted (Negative)
-    try:
-        inverted = ImageOps.invert(img)
-        variants.append(("Inverted", inverted))
-    except Exception:
-        pass
-
-    api_calls = [
-        lambda r, p: r(p),  # Most common API
-    ]
-
-    for v_name, v_img in variants:
-        # Convert variant to bytes
-        v_buffer = io.BytesIO()
-        # Ensure we save as PNG to preserve quality
-        v_img.save(v_buffer, format='PNG')
-        v_bytes = v_buffer.getvalue()
-        
-        for call in api_calls:
-            try:
-                res = call(reader, v_bytes)
-                text = parse_result(res)
-                if text.strip():
-                    print(f"[{label}] ({v_name}) OCR识别结果: {text}")
-                    return text
-            except Exception:
-                continue
+    if parallel > 1:
+        v_name, text, res = _smart_ocr_parallel(reader, variants, order, label, scheduler, parallel)
+        if text:
+            _fill_details(details, v_name, res)
+            print(f"[{label}] ({v_name}) OCR识别结果: {text}")
+            return text
+        print(f"[{label}] 未能识别出任何文本")
+        return ""
+
+    start = time.perf_counter()
+    tried = 0
+    for v_name in order:
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        if not scheduler.within_budget(tried, elapsed_ms):
+            print(f"[{label}] 已达到尝试预算 ({tried} 个变体, {elapsed_ms:.0f}ms)，放弃本帧")
+            break
+        tried += 1
+        text, res = _recognize_variant(reader, variants, v_name, label, scheduler)
+        if text.strip():
+            _fill_details(details, v_name, res)
+            print(f"[{label}] ({v_name}) OCR识别结果: {text}")
+            return text
     
     print(f"[{label}] 未能识别出任何文本")
     return ""
 
 
+class FixedROIRecognizer:
+    """
+    固定位置 ROI 的快速识别：跳过文本检测，只在已知的行框上做一次批量识别。
+
+    行框来自 boxes 参数，或者在回退到完整 smart_ocr 并命中后自动学习。学到的行框连同当时 ROI 的签名
+    一起保存（按钮的每种状态各一组，最多 max_layouts 组），只有 ROI 与某组的签名相近时才使用该组行框；
+    画面换了样子就重新检测，避免旧行框只切到新文字的一部分。每组行框连续使用 recheck_every 次后也重新检测一次。
+    快速结果的每一行都必须完整等于一个已知文本（known_texts，以及完整检测时读到的高置信度文本），
+    置信度也要不低于 min_score，否则回退到完整的 smart_ocr。
+    同一个实例被主循环、流水线的 OCR 线程池和点击前核对同时使用：行框组和已知文本的读写都在锁内完成，
+    识别本身不持锁。
+    """
+
+    def __init__(self, label: str, known_texts=(), min_score: float = 0.8, boxes=None, pad: int = 2,
+                 max_layouts: int = 8, recheck_every: int = 50, mean_diff: float = 3.0, max_diff: float = 40.0):
+        self.label = label
+        self.known_texts = set(known_texts)
+        self.min_score = min_score
+        # 预先指定的行框 (AUTO_LINE_BOXES) 不绑定签名，任何画面都可以使用
+        self.fixed = [tuple(b) for b in boxes] if boxes else []
+        self.layouts = []  # [[签名, 行框, 变体, 已使用次数]]，最近命中的在前
+        self.pad = pad
+        self.max_layouts = max_layouts
+        self.recheck_every = recheck_every
+        # 签名比较比帧缓存宽松：只需要分辨按钮的不同状态，不能因为按钮的光效闪烁就重新检测
+        self.mean_diff = mean_diff
+        self.max_diff = max_diff
+        self.hits = 0
+        self.fallbacks = 0
+        self._lock = threading.Lock()
+
+    def _signature(self, img) -> np.ndarray:
+        from frame_cache import region_signature
+
+        return region_signature(np.asarray(img))
+
+    def _layout(self, signature: np.ndarray) -> list:
+        """签名相近的已学习行框组，没有时返回 None；调用方持有 _lock"""
+        for layout in self.layouts:
+            diff = np.abs(layout[0] - signature)
+            if float(diff.mean()) <= self.mean_diff and float(diff.max()) <= self.max_diff:
+                return layout
+        return None
+
+    def learn(self, img, details: dict, signature: np.ndarray = None):
+        """从 smart_ocr 的 details 中记住该画面的行框、命中的变体和读到的文本"""
+        if not details.get("boxes"):
+            return
+        signature = self._signature(img) if signature is None else signature
+        with self._lock:
+            stale = self._layout(signature)
+            self.layouts = [layout for layout in self.layouts if layout is not stale]
+            self.layouts.insert(0, [signature, details["boxes"], details["variant"], 0])
+            del self.layouts[self.max_layouts:]
+            for text, score in zip(details.get("texts", ()), details.get("scores", ())):
+                if text.strip() and score >= self.min_score:
+                    self.known_texts.add(text.strip())
+
+    def lines(self, img, boxes: list, variant: str = "Original") -> list:
+        """按行框从 (变体处理后的) ROI 中切出行图片"""
+        if not boxes:
+            return []
+        arr = OCRVariants(img).get(variant)
+        scale = VARIANT_SCALE.get(variant, 1)
+        h, w = arr.shape[:2]
+        lines = []
+        for left, top, right, bottom in boxes:
+            line = arr[max((top - self.pad) * scale, 0):min((bottom + self.pad) * scale, h),
+                       max((left - self.pad) * scale, 0):min((right + self.pad) * scale, w)]
+            if line.size:
+                lines.append(line)
+        return lines
+
+    def recognize_batch(self, imgs, engine: OCREngine, plans: list = None) -> list:
+        """
+        多张 ROI 的行图片合并成一次 text_rec 调用，返回每张的 (各行文本, 最低置信度)。
+        plans 为每张 ROI 的 (行框, 变体)，缺省时都使用预先指定的行框。
+        """
+        empty = [([], 0.0)] * len(imgs)
+        reader = engine.load()
+        if plans is None:
+            plans = [(self.fixed, "Original")] * len(imgs)
+        if not reader or not any(boxes for boxes, _ in plans):
+            return empty
+        per_img = [self.lines(img, boxes, variant) for img, (boxes, variant) in zip(imgs, plans)]
+        flat = [line for lines in per_img for line in lines]
+        if not flat:
+            return empty
+        # text_rec 内部按宽高比排序分批，但结果按输入顺序返回
+        rec_res, _ = reader.text_rec(flat)
+        results = []
+        i = 0
+        for lines in per_img:
+            part = [r for r in rec_res[i:i + len(lines)] if r[0]]
+            i += len(lines)
+            if part:
+                results.append(([r[0] for r in part], min(float(r[1]) for r in part)))
+            else:
+                results.append(([], 0.0))
+        return results
+
+    def recognize(self, img, engine: OCREngine) -> tuple:
+        """只按预先指定的行框做识别，返回 (文本, 最低置信度)"""
+        texts, score = self.recognize_batch([img], engine)[0]
+        return ' | '.join(texts), score
+
+    def _plan(self, signature: np.ndarray) -> tuple:
+        """本次使用的 (行框, 变体)；需要重新检测时返回 None。调用方持有 _lock"""
+        layout = self._layout(signature)
+        if layout is None:
+            return (self.fixed, "Original") if self.fixed else None
+        layout[3] += 1
+        if self.recheck_every and layout[3] % self.recheck_every == 0:
+            return None
+        # 最近命中的排在前面，下次先比较
+        self.layouts = [layout] + [other for other in self.layouts if other is not layout]
+        return layout[1], layout[2]
+
+    def _trusted(self, texts: list, score: float) -> bool:
+        if not texts or score < self.min_score:
+            return False
+        with self._lock:
+            return not self.known_texts or all(t.strip() in self.known_texts for t in texts)
+
+    def call_batch(self, imgs, engine: OCREngine = None) -> list:
+        """批量识别多张 ROI；没有可用行框或结果不可信时逐张回退到 smart_ocr"""
+        engine = engine or get_ocr_engine()
+        signatures = [self._signature(img) for img in imgs]
+        with self._lock:
+            plans = [self._plan(sig) for sig in signatures]
+        fast = [i for i, plan in enumerate(plans) if plan is not None]
+        results = [([], 0.0)] * len(imgs)
+        if fast:
+            try:
+                for i, result in zip(fast, self.recognize_batch([imgs[i] for i in fast], engine,
+                                                                [plans[i] for i in fast])):
+                    results[i] = result
+            except Exception as e:
+                print(f"[{self.label}] 快速识别失败: {e}")
+        texts = []
+        for img, signature, (lines, score) in zip(imgs, signatures, results):
+            if self._trusted(lines, score):
+                with self._lock:
+                    self.hits += 1
+                text = ' | '.join(lines)
+                print(f"[{self.label}] (快速识别) OCR识别结果: {text} ({score:.2f})")
+                texts.append(text)
+                continue
+            with self._lock:
+                self.fallbacks += 1
+            details = {}
+            texts.append(smart_ocr(img, self.label, engine, details=details))
+            self.learn(img, details, signature)
+        return texts
+
+    def __call__(self, img, engine: OCREngine = None) -> str:
+        return self.call_batch([img], engine)[0]
+
+
+# "自动按钮" 区域里会出现的几种完整文字；其他文字（例如"长按"开头的整行提示）在完整检测时学习
+AUTO_KNOWN_TEXTS = ("自动", "长按", "免费")
+
+_auto_recognizer = None
+_auto_recognizer_lock = threading.Lock()
+
+
+def get_auto_recognizer() -> FixedROIRecognizer:
+    """
+    自动按钮区域的快速识别器。
+    OCR_FAST_MIN_SCORE 为接受快速结果的最低置信度，
+    AUTO_LINE_BOXES 可预先指定行框 (JSON, ROI 坐标 [[left, top, right, bottom], ...])。
+    """
+    global _auto_recognizer
+    if _auto_recognizer is None:
+        with _auto_recognizer_lock:
+            if _auto_recognizer is None:
+                boxes = None
+                raw = os.getenv("AUTO_LINE_BOXES", "").strip()
+                if raw:
+                    try:
+                        boxes = json.loads(raw)
+                    except ValueError as e:
+                        print(f"AUTO_LINE_BOXES 不是合法的 JSON，已忽略: {e}")
+                _auto_recognizer = FixedROIRecognizer(
+                    "自动按钮", AUTO_KNOWN_TEXTS,
+                    min_score=float(os.getenv("OCR_FAST_MIN_SCORE", 0.8)),
+                    boxes=boxes,
+                )
+    return _auto_recognizer
+
+
+def recognize_auto_button(img, engine: OCREngine = None) -> str:
+    """识别自动按钮区域；OCR_FAST_PATH=0 时总是走完整的 smart_ocr"""
+    return recognize_auto_buttons([img], engine)[0]
+
+
+def recognize_auto_buttons(imgs, engine: OCREngine = None) -> list:
+    """批量识别多帧（或多个会话）的自动按钮区域，快速路径合并成一次识别调用"""
+    if os.getenv("OCR_FAST_PATH", "1") == "0":
+        return [smart_ocr(img, "自动按钮", engine) for img in imgs]
+    return get_auto_recognizer().call_batch(imgs, engine)
+
+
+def auto_button_text(img) -> str:
+    """只识别自动按钮区域（点击前核对用），OCR_SERVICE=1 时交给 OCR 服务"""
+    if os.getenv("OCR_SERVICE", "0") == "1":
+        from ocr_service import get_ocr_service
+        service = get_ocr_service()
+        return service.auto_button(img).result(service.timeout)
+    return recognize_auto_button(img, get_ocr_engine())
+
+
 def crop_region(image_path: str, out_path: str, coords=COORDS):
     with Image.open(image_path) as im:
         # Ensure image is in RGBA/RGB
@@ -177,86 +699,98 @@ def parse_result(res):
     return ' | '.join(t for t in texts if t)
 
 
-def ocr(image_bytes: bytes) -> tuple[bool, str]:
+def ocr(image) -> tuple[bool, str]:
     """
     检查截图区域是否存在"自动"两个字
     同时识别 400:0 到 900:400 范围内的文本并打印
 
     Args:
-        image_bytes: 截图的字节数据
+        image: Frame，或截图的字节数据
 
     Returns:
         bool: 如果检测到"自动"返回True，否则返回False
     """
-    try:
-        from rapidocr_onnxruntime import RapidOCR
-    except Exception as e:
-        print(f"Failed to import rapidocr_onnxruntime: {e}")
-        return False
+    service = None
+    if os.getenv("OCR_SERVICE", "0") == "1":
+        from ocr_service import get_ocr_service
+        service = get_ocr_service()
+    engine = get_ocr_engine()
+    if service is None and engine.load() is None:
+        return False, ""
 
     try:
-        with Image.open(io.BytesIO(image_bytes)) as img:
-            img = img.convert('RGB')
+        # 整帧只解码一次，两个区域都是该数组上的切片视图
+        frame = as_frame(image)
 
-            # 1. 识别消息区域 (400, 0, 900, 400)
-            msginfo = ""
-            try:
-                msg_cropped = img.crop((400, 0, 900, 400))
-                msginfo = smart_ocr(msg_cropped, "消息区域")
-            except Exception as e:
-                 print(f"Error processing message region: {e}")
+        msg_cropped = frame.crop(MSG_COORDS)
+        auto_cropped = frame.crop(COORDS)
+        if service is not None:
+            # 交给 OCR 服务的工作进程，两个区域同时识别
+            msg_future = service.smart_ocr(msg_cropped, "消息区域")
+            auto_future = service.auto_button(auto_cropped)
+        elif parallel_variants() > 1:
+            # 并行模式下两个区域同时识别
+            pool = get_ocr_pool("regions")
+            msg_future = pool.submit(smart_ocr, msg_cropped, "消息区域", engine)
+            auto_future = pool.submit(recognize_auto_button, auto_cropped, engine)
+        else:
+            msg_future = auto_future = None
+        timeout = service.timeout if service is not None else None
 
-            # 2. 识别自动按钮区域
-            try:
-                auto_cropped = img.crop(COORDS)
-                text = smart_ocr(auto_cropped, "自动按钮")
-            except Exception as e:
-                print(f"Error processing auto button region: {e}")
-                text = ""
-
-            # Check for special events that require AI handling even if Auto is on
-            special_keywords = ['愿望', '擂台', '攻击']
-            has_special_event = any(k in msginfo for k in special_keywords)
-            # print(f"[OCR] msginfo: {msginfo}, has_special_event: {has_special_event}")
-            if text == "" and msginfo == "":
-                print("无有效数据，跳过AI分析")
-                return True, msginfo
-            if '自' in text and "动"in text and not has_special_event and "长按" not in text and "以" not in text:
-                print("检测到'自动'二字，跳过AI分析，等待下一轮...")
-                return True, msginfo
-            elif "掠夺了你的金库" in msginfo or "试图攻击你的城市" in msginfo:
-                print("检测到'提示'，跳过AI分析，等待下一轮...")
-                return True,""
-            elif '自' in text and "动"in text and "拜访" in msginfo:
-                print("检测到'拜访城市'，跳过AI分析，等待下一轮...")
-                return True,""
-            else:
-                # timestamp = int(time.time())
-                # save_dir = "screenshots"
-                # if not os.path.exists(save_dir):
-                #     os.makedirs(save_dir)
-                # save_path = f"{save_dir}/{timestamp}-{msginfo[:2]}.png"
-                
-                # with open(save_path, "wb") as f:
-                #     f.write(image_bytes)
-                # print(f"Screenshot saved to {save_path}")
-                return False, msginfo
+        # 1. 识别消息区域 (400, 0, 900, 400)
+        msginfo = ""
+        try:
+            msginfo = msg_future.result(timeout) if msg_future else smart_ocr(msg_cropped, "消息区域", engine)
+        except Exception as e:
+             print(f"Error processing message region: {e}")
+
+        # 2. 识别自动按钮区域
+        try:
+            text = auto_future.result(timeout) if auto_future else recognize_auto_button(auto_cropped, engine)
+        except Exception as e:
+            print(f"Error processing auto button region: {e}")
+            text = ""
+
+        return ocr_verdict(text, msginfo)
 
     except Exception as e:
         print(f"Error during OCR processing: {e}")
         return False, ""
 
 
+def ocr_verdict(text: str, msginfo: str) -> tuple[bool, str]:
+    """根据自动按钮文字和消息区域文字判断是否跳过 AI 分析（规则表 rules.json 中 stage 为 ocr 的规则）"""
+    return get_rule_engine().verdict(text, msginfo)
+
+
+def warmup_ocr_async():
+    """后台预热：启用 OCR 服务时启动工作进程，否则预热进程内引擎"""
+    if os.getenv("OCR_SERVICE", "0") == "1":
+        from ocr_service import get_ocr_service
+        return get_ocr_service().warmup_async()
+    return get_ocr_engine().warmup_async()
+
+
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument('image', help='Path to source image (screenshot)')
     parser.add_argument('--out', help='Cropped output path', default='crop_region.png')
+    parser.add_argument('--intra-threads', type=int, default=None, help='onnxruntime intra_op_num_threads')
+    parser.add_argument('--inter-threads', type=int, default=None, help='onnxruntime inter_op_num_threads')
     args = parser.parse_args()
 
     if not os.path.exists(args.image):
         print(f"Image not found: {args.image}")
         return
 
+    engine = OCREngine.from_env()
+    if args.intra_threads is not None:
+        engine.options["intra_op_num_threads"] = args.intra_threads
+    if args.inter_threads is not None:
+        engine.options["inter_op_num_threads"] = args.inter_threads
+    set_ocr_engine(engine)
+    engine.warmup()
+
     # Use default COORDS for main execution or maybe allow override?
     # For now, let's assume the user wants to test the COORDS region or just general OCR?
     # The original script cropped COORDS.
@@ -265,7 +799,7 @@ def main():
     print(f"Cropped region saved to: {args.out}")
 
     print("--- Recognizing Default Region (Auto Button) ---")
-    text = smart_ocr(cropped_img, "Main-Crop")
+    text = smart_ocr(cropped_img, "Main-Crop", engine)
     print("Recognized text:")
     print(text)
     
@@ -276,8 +810,8 @@ def main():
         with Image.open(args.image) as full_img:
             full_img = full_img.convert('RGB')
             print("\n--- Recognizing Message Region (400:0 - 900:400) ---")
-            msg_crop = full_img.crop((400, 0, 900, 400))
-            smart_ocr(msg_crop, "Main-Message-Region")
+            msg_crop = full_img.crop(MSG_COORDS)
+            smart_ocr(msg_crop, "Main-Message-Region", engine)
     except Exception as e:
         print(f"Could not process full image for message region: {e}")
 
@@ -0,0 +1,421 @@
+"""
+本地 OCR 服务：多个工作进程共享给所有会话使用。
+
+OCR 是 CPU 密集型，onnxruntime 在单个进程里很难吃满多核。OCR_SERVICE=1 时 ocr() 不再在调用线程里识别，而是：
+
+- 启动 OCR_SERVICE_WORKERS 个工作进程 (python ocr_service.py --worker)，每个进程加载一份模型；
+  自动化进程本身不再加载模型，会话再多也只有这几份。
+- ROI 像素写入预先分配的共享内存槽 (multiprocessing.shared_memory)，通过本地 socket / 命名管道
+  (multiprocessing.connection) 只传递槽名和形状，不复制、不序列化图片。
+- 每个工作进程对应一个派发线程，从公共队列取任务；工作进程忙时积压的任务（来自多帧或多个会话）
+  会合并成一个批次发送，批次里的自动按钮 ROI 合并成一次 text_rec 调用。
+- submit 返回 concurrent.futures.Future。
+- 工作进程中各变体的命中和耗时随结果交回，由本进程的变体调度器汇总、保存到 OCR_STATS_PATH。
+
+工作进程不是用 multiprocessing 派生的，避免在每个工作进程里重新执行 main.py 顶层（Gemini 客户端、playwright）。
+"""
+import atexit
+import os
+import queue
+import secrets
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import Future
+from multiprocessing import resource_tracker
+from multiprocessing.connection import Client, Listener
+from multiprocessing.shared_memory import SharedMemory
+
+import numpy as np
+
+from ocr_region import (
+    OCREngine, VARIANT_ORDER, recognize_auto_buttons, set_ocr_engine, smart_ocr,
+)
+from variant_scheduler import VariantScheduler, get_variant_scheduler, set_variant_scheduler
+
+JOB_KINDS = ("smart", "auto")
+
+
+class _Job:
+    __slots__ = ("kind", "label", "slot", "shape", "array", "future", "submitted")
+
+    def __init__(self, kind, label, slot, shape, array, future):
+        self.kind = kind
+        self.label = label
+        self.slot = slot          # 共享内存槽下标，None 表示图片随消息发送
+        self.shape = shape
+        self.array = array
+        self.future = future
+        self.submitted = time.perf_counter()
+
+
+class OCRService:
+    """
+    workers: 工作进程数，默认 CPU 核数
+    slots: 共享内存槽数量，默认每个工作进程 4 个；槽用完或 ROI 超过 slot_bytes 时图片随消息发送
+    batch_size / batch_wait_ms: 每批最多任务数，以及凑批时最多等待的毫秒数
+    timeout: ocr() 等待结果的秒数
+    """
+
+    def __init__(self, workers: int = 0, slots: int = 0, slot_bytes: int = 4 << 20, batch_size: int = 8,
+                 batch_wait_ms: float = 2.0, timeout: float = 30.0, max_restarts: int = 3):
+        self.workers = workers or os.cpu_count() or 1
+        self.slot_count = slots or self.workers * 4
+        self.slot_bytes = slot_bytes
+        self.batch_size = max(batch_size, 1)
+        self.batch_wait = batch_wait_ms / 1000
+        self.timeout = timeout
+        self.max_restarts = max_restarts
+        self._authkey = secrets.token_bytes(16)
+        self._jobs = queue.Queue()
+        self._slots = []
+        self._free_slots = queue.Queue()
+        self._threads = []
+        self._procs = {}
+        self._lock = threading.Lock()
+        self._started = False
+        self._closing = False
+        self._warm_thread = None
+        self.restarts = 0
+        self.counters = {"jobs": 0, "batches": 0, "inline": 0, "errors": 0, "latency_ms": 0.0}
+
+    @classmethod
+    def from_env(cls) -> "OCRService":
+        """OCR_SERVICE_WORKERS / OCR_SERVICE_SLOTS / OCR_SERVICE_SLOT_MB / OCR_SERVICE_BATCH /
+        OCR_SERVICE_BATCH_WAIT_MS / OCR_SERVICE_TIMEOUT"""
+        return cls(
+            workers=int(os.getenv("OCR_SERVICE_WORKERS", 0)),
+            slots=int(os.getenv("OCR_SERVICE_SLOTS", 0)),
+            slot_bytes=int(float(os.getenv("OCR_SERVICE_SLOT_MB", 4)) * (1 << 20)),
+            batch_size=int(os.getenv("OCR_SERVICE_BATCH", 8)),
+            batch_wait_ms=float(os.getenv("OCR_SERVICE_BATCH_WAIT_MS", 2)),
+            timeout=float(os.getenv("OCR_SERVICE_TIMEOUT", 30)),
+        )
+
+    # --- 生命周期 ---
+
+    def start(self) -> "OCRService":
+        with self._lock:
+            if self._started:
+                return self
+            self._started = True
+            for _ in range(self.slot_count):
+                shm = SharedMemory(create=True, size=self.slot_bytes)
+                self._free_slots.put(len(self._slots))
+                self._slots.append(shm)
+            for index in range(self.workers):
+                thread = threading.Thread(target=self._dispatch_loop, args=(index,),
+                                          name=f"ocr-service-{index}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+            atexit.register(self.close)
+        print(f"[OCR服务] 启动 {self.workers} 个工作进程，{self.slot_count} 个共享内存槽")
+        return self
+
+    def warmup_async(self) -> threading.Thread:
+        """启动工作进程（模型在工作进程里加载并预热）"""
+        if self._warm_thread is None:
+            self._warm_thread = threading.Thread(target=self.start, name="ocr-service-start", daemon=True)
+            self._warm_thread.start()
+        return self._warm_thread
+
+    def close(self):
+        with self._lock:
+            if not self._started or self._closing:
+                return
+            self._closing = True
+        for _ in self._threads:
+            self._jobs.put(None)
+        for thread in self._threads:
+            thread.join(timeout=5)
+        for proc in list(self._procs.values()):
+            if proc.poll() is None:
+                proc.terminate()
+        while True:
+            try:
+                job = self._jobs.get_nowait()
+            except queue.Empty:
+                break
+            if job is not None and not job.future.done():
+                job.future.set_exception(RuntimeError("OCR 服务已关闭"))
+        for shm in self._slots:
+            shm.close()
+            shm.unlink()
+        self._slots = []
+
+    def _spawn(self, index: int):
+        """启动一个工作进程并连接，返回 (进程, 连接)"""
+        env = dict(os.environ)
+        env["OCR_SERVICE_AUTHKEY"] = self._authkey.hex()
+        env["PYTHONIOENCODING"] = "utf-8"
+        if int(env.get("OCR_INTRA_THREADS", -1)) <= 0:
+            # 多个工作进程各自占满所有核只会互相争抢
+            env["OCR_INTRA_THREADS"] = str(max((os.cpu_count() or 1) // self.workers, 1))
+        proc = subprocess.Popen(
+            [sys.executable, os.path.abspath(__file__), "--worker"],
+            stdout=subprocess.PIPE, env=env, cwd=os.path.dirname(os.path.abspath(__file__)),
+        )
+        self._procs[index] = proc
+        address = None
+        for raw in proc.stdout:
+            line = raw.decode("utf-8", errors="replace").rstrip()
+            if line.startswith("READY "):
+                address = line[len("READY "):]
+                break
+            print(f"[OCR-{index}] {line}")
+        if address is None:
+            raise RuntimeError(f"OCR 工作进程 {index} 启动失败 (exit {proc.wait()})")
+        conn = Client(address, authkey=self._authkey)
+        # 之后工作进程的输出照常转发到本进程
+        threading.Thread(target=self._forward_output, args=(index, proc), daemon=True).start()
+        return proc, conn
+
+    @staticmethod
+    def _forward_output(index: int, proc):
+        for raw in proc.stdout:
+            print(f"[OCR-{index}] {raw.decode('utf-8', errors='replace').rstrip()}")
+
+    # --- 提交 ---
+
+    def submit(self, kind: str, img, label: str = "Image") -> Future:
+        """提交一个 ROI (RGB 数组或 PIL 图片)，返回识别文本的 Future"""
+        if kind not in JOB_KINDS:
+            raise ValueError(f"未知的任务类型: {kind}")
+        if not self._started:
+            self.start()
+        arr = np.asarray(img)
+        if arr.dtype != np.uint8 or arr.ndim != 3:
+            arr = np.asarray(img.convert("RGB")) if hasattr(img, "convert") else arr.astype(np.uint8)
+        future = Future()
+        slot = None
+        if arr.nbytes <= self.slot_bytes:
+            try:
+                slot = self._free_slots.get_nowait()
+            except queue.Empty:
+                slot = None
+        if slot is not None:
+            np.ndarray(arr.shape, dtype=np.uint8, buffer=self._slots[slot].buf)[...] = arr
+            job = _Job(kind, label, slot, arr.shape, None, future)
+        else:
+            job = _Job(kind, label, None, arr.shape, np.ascontiguousarray(arr), future)
+        self._jobs.put(job)
+        return future
+
+    def smart_ocr(self, img, label: str = "Image") -> Future:
+        return self.submit("smart", img, label)
+
+    def auto_button(self, img) -> Future:
+        return self.submit("auto", img, "自动按钮")
+
+    # --- 派发 ---
+
+    def _next_batch(self) -> list:
+        job = self._jobs.get()
+        if job is None:
+            return None
+        batch = [job]
+        deadline = time.perf_counter() + self.batch_wait
+        while len(batch) < self.batch_size:
+            try:
+                remaining = deadline - time.perf_counter()
+                job = self._jobs.get(timeout=remaining) if remaining > 0 else self._jobs.get_nowait()
+            except queue.Empty:
+                break
+            if job is None:
+                # 关闭信号留给其他派发线程
+                self._jobs.put(None)
+                break
+            batch.append(job)
+        return batch
+
+    def _release(self, job: _Job):
+        if job.slot is not None:
+            self._free_slots.put(job.slot)
+            job.slot = None
+
+    def _dispatch_loop(self, index: int):
+        conn = None
+        while not self._closing:
+            if conn is None:
+                try:
+                    _, conn = self._spawn(index)
+                except Exception as e:
+                    print(f"[OCR服务] {e}")
+                    if not self._restart_allowed():
+                        self._fail_pending(e)
+                        return
+                    continue
+            batch = self._next_batch()
+            if batch is None:
+                break
+            live = []
+            for job in batch:
+                if job.future.set_running_or_notify_cancel():
+                    live.append(job)
+                else:
+                    self._release(job)
+            batch = live
+            if not batch:
+                continue
+            message = [
+                (job.kind, job.label, self._slots[job.slot].name if job.slot is not None else None,
+                 job.shape, job.array)
+                for job in batch
+            ]
+            try:
+                conn.send(message)
+                results, outcomes = conn.recv()
+            except (EOFError, OSError) as e:
+                # 工作进程崩溃：本批任务失败，重新启动一个
+                for job in batch:
+                    self._release(job)
+                    job.future.set_exception(RuntimeError(f"OCR 工作进程 {index} 异常退出: {e}"))
+                conn = None
+                if not self._restart_allowed():
+                    return
+                continue
+            self._record(batch)
+            scheduler = get_variant_scheduler(VARIANT_ORDER)
+            for region, variant, hit, ms in outcomes:
+                scheduler.record(region, variant, hit, ms)
+            for job, (text, error) in zip(batch, results):
+                self._release(job)
+                if error is None:
+                    job.future.set_result(text)
+                else:
+                    with self._lock:
+                        self.counters["errors"] += 1
+                    job.future.set_exception(RuntimeError(error))
+        if conn is not None:
+            conn.close()
+
+    def _restart_allowed(self) -> bool:
+        with self._lock:
+            if self._closing or self.restarts >= self.max_restarts:
+                return False
+            self.restarts += 1
+            return True
+
+    def _fail_pending(self, error: Exception):
+        if any(t.is_alive() and t is not threading.current_thread() for t in self._threads):
+            return
+        while True:
+            try:
+                job = self._jobs.get_nowait()
+            except queue.Empty:
+                return
+            if job is not None:
+                self._release(job)
+                job.future.set_exception(RuntimeError(f"OCR 服务不可用: {error}"))
+
+    def _record(self, batch: list):
+        now = time.perf_counter()
+        with self._lock:
+            self.counters["batches"] += 1
+            for job in batch:
+                self.counters["jobs"] += 1
+                if job.slot is None and job.array is not None:
+                    self.counters["inline"] += 1
+                self.counters["latency_ms"] += (now - job.submitted) * 1000
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self.counters)
+        jobs = stats["jobs"]
+        stats["avg_batch"] = jobs / stats["batches"] if stats["batches"] else 0.0
+        stats["latency_ms"] = stats["latency_ms"] / jobs if jobs else 0.0
+        stats["restarts"] = self.restarts
+        stats["queued"] = self._jobs.qsize()
+        return stats
+
+
+_service = None
+_service_lock = threading.Lock()
+
+
+def get_ocr_service() -> OCRService:
+    """进程内唯一的 OCR 服务客户端（首次使用时启动工作进程）"""
+    global _service
+    if _service is None:
+        with _service_lock:
+            if _service is None:
+                _service = OCRService.from_env()
+    return _service
+
+
+# --- 工作进程 ---
+
+def _attach(name: str, cache: dict) -> SharedMemory:
+    shm = cache.get(name)
+    if shm is None:
+        shm = cache[name] = SharedMemory(name=name)
+        # 共享内存归客户端所有；不让本进程的 resource_tracker 在退出时删除它
+        try:
+            resource_tracker.unregister(shm._name, "shared_memory")
+        except Exception:
+            pass
+    return shm
+
+
+def _run_batch(message: list, attached: dict) -> list:
+    images = []
+    for kind, label, shm_name, shape, array in message:
+        if shm_name is not None:
+            array = np.ndarray(shape, dtype=np.uint8, buffer=_attach(shm_name, attached).buf)
+        images.append(array)
+
+    results = [None] * len(message)
+    # 自动按钮 ROI 合并成一次识别
+    auto = [i for i, item in enumerate(message) if item[0] == "auto"]
+    if auto:
+        try:
+            for i, text in zip(auto, recognize_auto_buttons([images[i] for i in auto])):
+                results[i] = (text, None)
+        except Exception as e:
+            for i in auto:
+                results[i] = ("", f"{type(e).__name__}: {e}")
+    for i, (kind, label, *_rest) in enumerate(message):
+        if kind == "smart":
+            try:
+                results[i] = (smart_ocr(images[i], label), None)
+            except Exception as e:
+                results[i] = ("", f"{type(e).__name__}: {e}")
+    return results
+
+
+def worker_main():
+    authkey = bytes.fromhex(os.environ["OCR_SERVICE_AUTHKEY"])
+    engine = OCREngine.from_env()
+    set_ocr_engine(engine)
+    # 工作进程不写统计文件（避免多个进程同时写同一个文件）：每批的变体结果随识别结果交回，
+    # 由客户端进程的调度器汇总并持久化
+    scheduler = VariantScheduler.from_env(VARIANT_ORDER, forward=True)
+    scheduler.path = None
+    set_variant_scheduler(scheduler)
+    if not engine.warmup():
+        sys.exit(1)
+    attached = {}
+    with Listener(authkey=authkey) as listener:
+        print(f"READY {listener.address}", flush=True)
+        conn = listener.accept()
+        while True:
+            try:
+                message = conn.recv()
+            except EOFError:
+                break
+            results = _run_batch(message, attached)
+            conn.send((results, scheduler.drain()))
+            sys.stdout.flush()
+    for shm in attached.values():
+        try:
+            shm.close()
+        except BufferError:
+            pass
+
+
+if __name__ == "__main__":
+    if "--worker" in sys.argv[1:]:
+        worker_main()
+    else:
+        print("用法: 设置 OCR_SERVICE=1 后由 ocr() 自动启动；python ocr_service.py --worker 仅供内部使用")
@@ -0,0 +1,235 @@
+"""
+多账号编排：一个进程驱动多个浏览器会话。
+
+每个账号单独跑一个 main.py 时，各自加载一份 OCR 模型、Gemini 客户端和 Chromium。
+这里所有会话共用：
+- 同一个 OCR 引擎和一个 OCR 线程池（每个会话同时最多一个分析任务，线程池按提交顺序执行，各会话轮流）
+- 同一个 AI 并发信号量（按排队先后轮流）和同一个 AI 客户端（连接池、AI_RATE_PER_MIN 限速，见 ai_client.py）
+- type=context 的会话共用一个 Chromium 进程，每个账号一个 BrowserContext，内存占用最小
+
+会话配置 (SESSIONS_FILE，默认 sessions.json)：
+[
+  {"name": "acc1", "type": "persistent", "user_data_dir": "./browser_data_1"},
+  {"name": "acc2", "type": "cdp", "endpoint": "ws://localhost:9223"},
+  {"name": "acc3", "type": "context", "storage_state": "./state_acc3.json"}
+]
+
+用法: python orchestrator.py [sessions.json] [--save-state]
+"""
+import argparse
+import asyncio
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from playwright.async_api import async_playwright
+
+import main as bot
+from ai_client import get_ai_client
+from async_engine import Pipeline
+from decision_cache import get_decision_cache
+from ocr_region import warmup_ocr_async
+from metrics import get_metrics
+from payload_encoder import get_payload_encoder
+from scene_model import get_scene_model
+
+SESSION_TYPES = ("persistent", "cdp", "context", "edge")
+
+
+class Session:
+    """一个账号：浏览器上下文 + 页面 + 流水线"""
+
+    def __init__(self, name: str, type: str = "persistent", user_data_dir: str = None, endpoint: str = None,
+                 storage_state: str = None, enabled: bool = True, **_):
+        if type not in SESSION_TYPES:
+            raise ValueError(f"会话 {name}: 未知的类型 {type}")
+        self.name = name
+        self.type = type
+        self.user_data_dir = user_data_dir or f"./browser_data_{name}"
+        self.endpoint = endpoint
+        self.storage_state = storage_state
+        self.enabled = enabled
+        self.context = None
+        self.page = None
+        self.pipeline = None
+        self.error = None
+        self._owns_context = True
+
+    async def open(self, p, shared_browser):
+        if self.type == "persistent":
+            self.context = await p.chromium.launch_persistent_context(self.user_data_dir, headless=False)
+        elif self.type == "edge":
+            self.context = await p.chromium.launch_persistent_context(
+                self.user_data_dir, headless=False, channel="msedge")
+        elif self.type == "cdp":
+            browser = await p.chromium.connect_over_cdp(self.endpoint)
+            if browser.contexts:
+                self.context = browser.contexts[0]
+                # 远程浏览器不是我们启动的，退出时不关闭
+                self._owns_context = False
+            else:
+                self.context = await browser.new_context()
+        else:
+            state = self.storage_state if self.storage_state and os.path.exists(self.storage_state) else None
+            # 固定为基准分辨率：OCR 区域坐标 (regions.py) 是按 BASE_WIDTH x BASE_HEIGHT 写死的，不随窗口缩放
+            self.context = await (await shared_browser()).new_context(
+                storage_state=state, viewport={"width": bot.BASE_WIDTH, "height": bot.BASE_HEIGHT})
+        self.page = self.context.pages[0] if self.context.pages else await self.context.new_page()
+
+    async def save_state(self):
+        if self.type == "context" and self.storage_state and self.context is not None:
+            await self.context.storage_state(path=self.storage_state)
+            print(f"[{self.name}] 登录状态已保存到 {self.storage_state}")
+
+    async def close(self):
+        if self.context is not None and self._owns_context:
+            try:
+                await self.context.close()
+            except Exception as e:
+                print(f"[{self.name}] 关闭失败: {e}")
+
+
+def load_sessions(path: str) -> list:
+    with open(path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    sessions = [Session(**entry) for entry in data if entry.get("enabled", True)]
+    names = [s.name for s in sessions]
+    if len(set(names)) != len(names):
+        raise ValueError(f"{path}: 会话名重复")
+    return sessions
+
+
+class Orchestrator:
+    """
+    ocr_workers: 共享 OCR 线程池大小，默认 min(会话数, CPU 核数)
+    ai_concurrency: 所有会话合计同时在途的 AI 请求数
+    """
+
+    def __init__(self, sessions: list, ocr_workers: int = 0, ai_concurrency: int = 2,
+                 report_every: float = 60):
+        if not sessions:
+            raise ValueError("没有可用的会话")
+        self.sessions = sessions
+        self.ocr_workers = ocr_workers or max(1, min(len(sessions), os.cpu_count() or 1))
+        self.ai_concurrency = ai_concurrency
+        self.report_every = report_every
+        self.executor = None
+        self._browser = None
+        self._browser_lock = None
+        self._p = None
+
+    @classmethod
+    def from_env(cls, sessions: list) -> "Orchestrator":
+        """ORCH_OCR_WORKERS / ORCH_AI_CONCURRENCY / ORCH_REPORT_EVERY"""
+        return cls(
+            sessions,
+            ocr_workers=int(os.getenv("ORCH_OCR_WORKERS", 0)),
+            ai_concurrency=int(os.getenv("ORCH_AI_CONCURRENCY", 2)),
+            report_every=float(os.getenv("ORCH_REPORT_EVERY", 60)),
+        )
+
+    async def shared_browser(self):
+        """type=context 的会话共用的 Chromium，第一次用到时启动"""
+        async with self._browser_lock:
+            if self._browser is None:
+                print("启动共享 Chromium 进程")
+                self._browser = await self._p.chromium.launch(headless=False)
+        return self._browser
+
+    async def open_all(self, p):
+        self._p = p
+        self._browser_lock = asyncio.Lock()
+        for session in self.sessions:
+            print(f"[{session.name}] 打开会话 ({session.type})")
+            await session.open(p, self.shared_browser)
+            await session.page.goto(bot.TARGET_URL)
+
+    async def run_session(self, session: Session, ai_slots: asyncio.Semaphore):
+        session.pipeline = Pipeline.from_env(
+            session.page, name=session.name, executor=self.executor, ai_slots=ai_slots)
+        try:
+            await session.pipeline.run(report=False)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            # 单个会话出错（页面崩溃、被关闭）不影响其他会话
+            session.error = e
+            print(f"[{session.name}] 会话停止: {e}")
+
+    async def report_loop(self):
+        last = {}
+        last_time = time.monotonic()
+        while True:
+            await asyncio.sleep(self.report_every)
+            now = time.monotonic()
+            minutes = (now - last_time) / 60
+            last_time = now
+            print("\n[编排] ---- 每分钟吞吐 ----")
+            for session in self.sessions:
+                if session.pipeline is None:
+                    continue
+                stats = dict(session.pipeline.stats)
+                prev = last.get(session.name, {})
+                rates = {k: (v - prev.get(k, 0)) / minutes for k, v in stats.items()}
+                last[session.name] = stats
+                state = "已停止" if session.error else ("暂停" if bot.AutomationState.paused else "运行")
+                print(f"[{session.name}] {state} 帧 {rates['frames']:.1f} 分析 {rates['analyzed']:.1f} "
+                      f"AI {rates['ai_requests']:.1f} 操作 {rates['actions']:.1f} 过期 {rates['stale']:.1f} "
+                      f"(累计 {stats})")
+            cache = get_decision_cache()
+            if cache is not None:
+                print(f"[编排] AI缓存: {cache.stats()}")
+            print(f"[编排] AI客户端: {get_ai_client().stats()}")
+            print(f"[编排] 图片编码: {get_payload_encoder().stats()}")
+            if get_scene_model() is not None:
+                print(f"[编排] 场景模型: {get_scene_model().stats()}")
+
+    async def run(self, save_state: bool = False):
+        async with async_playwright() as p:
+            try:
+                await self.open_all(p)
+                warmup_ocr_async()
+                get_metrics()
+
+                print("\n" + "="*50)
+                print(f"请在 {len(self.sessions)} 个浏览器窗口中分别手动登录游戏")
+                print("全部登录完成后，按回车键开始自动化...")
+                print("="*50 + "\n")
+                await asyncio.to_thread(input)
+                if save_state:
+                    for session in self.sessions:
+                        await session.save_state()
+
+                threading.Thread(target=bot.keyboard_listener, daemon=True).start()
+                print(f"开始 {len(self.sessions)} 个会话的自动化 (OCR 线程 {self.ocr_workers}, "
+                      f"AI 并发 {self.ai_concurrency})。按 Ctrl+C 停止，按 'P' 键暂停/恢复全部会话。")
+                self.executor = ThreadPoolExecutor(max_workers=self.ocr_workers, thread_name_prefix="session-ocr")
+                ai_slots = asyncio.Semaphore(self.ai_concurrency)
+                reporter = asyncio.create_task(self.report_loop())
+                try:
+                    await asyncio.gather(*(self.run_session(s, ai_slots) for s in self.sessions))
+                finally:
+                    reporter.cancel()
+            finally:
+                for session in self.sessions:
+                    await session.close()
+                if self._browser is not None:
+                    await self._browser.close()
+                if self.executor is not None:
+                    self.executor.shutdown(wait=False, cancel_futures=True)
+                print("浏览器已关闭。")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='大富翁游戏自动化 (多账号)')
+    parser.add_argument('sessions', nargs='?', default=os.getenv("SESSIONS_FILE", "sessions.json"),
+                        help='会话配置文件 (默认: sessions.json)')
+    parser.add_argument('--save-state', action='store_true',
+                        help='登录后保存 type=context 会话的登录状态 (storage_state)')
+    args = parser.parse_args()
+    try:
+        asyncio.run(Orchestrator.from_env(load_sessions(args.sessions)).run(save_state=args.save_state))
+    except KeyboardInterrupt:
+        print("\n自动化被用户停止。")
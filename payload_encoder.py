@@ -0,0 +1,236 @@
+"""
+发给 AI 的图片编码。
+
+原来每次固定缩放 50% (LANCZOS)、JPEG 质量 50，再用"小于 10KB 就等待"判断空白画面。
+PayloadEncoder 把这些变成可配置的一步：
+- 尺寸预算：长边不超过 max_side（决定图片 token 数），编码后超过 max_bytes 时先降质量、再缩小
+- 缩放算法可选：lanczos / bicubic / bilinear / box / nearest / reduce（整数倍降采样，最快）
+- 可选 WebP、灰度
+- ROI：OCR 文本命中 rois 配置中的关键字时，只保留对应区域、其余涂黑。图片尺寸和坐标系不变，
+  AI 给出的坐标无需换算，涂黑部分几乎不占字节
+- 统计发送的字节数、编码耗时和上传耗时（见 AIReply.upload）
+"""
+import io
+import json
+import os
+import threading
+import time
+
+import numpy as np
+from PIL import Image
+
+from frame import Frame
+from metrics import count, observe
+
+RESAMPLE_FILTERS = {
+    "nearest": Image.Resampling.NEAREST,
+    "box": Image.Resampling.BOX,
+    "bilinear": Image.Resampling.BILINEAR,
+    "bicubic": Image.Resampling.BICUBIC,
+    "lanczos": Image.Resampling.LANCZOS,
+    "reduce": "reduce",
+}
+
+FORMATS = {"jpeg": ("JPEG", "image/jpeg"), "webp": ("WEBP", "image/webp")}
+
+
+class Payload:
+    """编码结果：数据、MIME 类型、图片尺寸、使用的质量、是否只保留了 ROI、编码耗时（秒）"""
+
+    __slots__ = ("data", "mime_type", "size", "quality", "roi", "encode_time")
+
+    def __init__(self, data: bytes, mime_type: str, size: tuple, quality: int, roi: str = None,
+                 encode_time: float = 0.0):
+        self.data = data
+        self.mime_type = mime_type
+        self.size = size
+        self.quality = quality
+        self.roi = roi
+        self.encode_time = encode_time
+
+    def __len__(self):
+        return len(self.data)
+
+
+class PayloadEncoder:
+    """
+    scale: 缩放比例；max_side: 长边上限（像素，0 不限制），两者取较小的结果
+    max_bytes: 编码后的字节上限（0 不限制）；超出时质量每次降 10 直到 min_quality，再每次缩小到 0.8 倍
+    fmt: jpeg / webp；resample: 见 RESAMPLE_FILTERS；grayscale: 转成灰度再编码
+    rois: {关键字: [(left, top, right, bottom), ...]}，基准分辨率坐标
+    blank_std: 缩略图灰度标准差低于该值视为空白画面（加载中 / 黑屏），不发送
+    """
+
+    def __init__(self, scale: float = 0.5, quality: int = 50, max_side: int = 0, max_bytes: int = 0,
+                 min_quality: int = 25, fmt: str = "jpeg", resample: str = "lanczos", grayscale: bool = False,
+                 rois: dict = None, base_size: tuple = (1280, 720), blank_std: float = 6.0):
+        if fmt not in FORMATS:
+            raise ValueError(f"未知的图片格式: {fmt}")
+        if resample not in RESAMPLE_FILTERS:
+            raise ValueError(f"未知的缩放算法: {resample}")
+        self.scale = scale
+        self.quality = quality
+        self.max_side = max_side
+        self.max_bytes = max_bytes
+        self.min_quality = min(min_quality, quality)
+        self.fmt = fmt
+        self.resample = resample
+        self.grayscale = grayscale
+        self.rois = {key: [tuple(r) for r in regions] for key, regions in (rois or {}).items()}
+        self.base_size = base_size
+        self.blank_std = blank_std
+        self._lock = threading.Lock()
+        self.counters = {"payloads": 0, "bytes": 0, "encode_time": 0.0, "uploads": 0, "upload_time": 0.0,
+                         "roi": 0, "blank": 0, "shrunk": 0}
+
+    @classmethod
+    def from_env(cls) -> "PayloadEncoder":
+        """
+        PAYLOAD_SCALE / PAYLOAD_QUALITY / PAYLOAD_MAX_SIDE / PAYLOAD_MAX_BYTES / PAYLOAD_MIN_QUALITY /
+        PAYLOAD_FORMAT / PAYLOAD_RESAMPLE / PAYLOAD_GRAYSCALE / PAYLOAD_ROIS (JSON 文件) / PAYLOAD_BLANK_STD
+        """
+        return cls(
+            scale=float(os.getenv("PAYLOAD_SCALE", 0.5)),
+            quality=int(os.getenv("PAYLOAD_QUALITY", 50)),
+            max_side=int(os.getenv("PAYLOAD_MAX_SIDE", 0)),
+            max_bytes=int(os.getenv("PAYLOAD_MAX_BYTES", 0)),
+            min_quality=int(os.getenv("PAYLOAD_MIN_QUALITY", 25)),
+            fmt=os.getenv("PAYLOAD_FORMAT", "jpeg").lower(),
+            resample=os.getenv("PAYLOAD_RESAMPLE", "lanczos").lower(),
+            grayscale=os.getenv("PAYLOAD_GRAYSCALE", "0") == "1",
+            rois=load_rois(os.getenv("PAYLOAD_ROIS", "payload_rois.json")),
+            base_size=(int(os.getenv("BASE_WIDTH", 1280)), int(os.getenv("BASE_HEIGHT", 720))),
+            blank_std=float(os.getenv("PAYLOAD_BLANK_STD", 6)),
+        )
+
+    def blank(self, frame: Frame) -> bool:
+        """画面几乎是纯色（加载中 / 黑屏），不值得请求 AI"""
+        thumb = frame.resized((64, 36), Image.Resampling.BOX)
+        blank = float(np.asarray(thumb.convert("L")).std()) < self.blank_std
+        if blank:
+            self._count("blank")
+        return blank
+
+    def roi_for(self, hint: str):
+        """hint（OCR 文本）中出现的第一个关键字及其区域，没有时返回 (None, None)"""
+        for key, regions in self.rois.items():
+            if key in (hint or ""):
+                return key, regions
+        return None, None
+
+    def _target_size(self, width: int, height: int, scale: float) -> tuple:
+        if self.max_side:
+            scale = min(scale, self.max_side / max(width, height))
+        return max(int(width * scale), 1), max(int(height * scale), 1)
+
+    def _resize(self, frame: Frame, size: tuple) -> Image.Image:
+        if size == frame.size:
+            return frame.image
+        if self.resample == "reduce":
+            factor = max(frame.width // size[0], 1)
+            img = frame.memo(("reduce", factor), lambda: frame.image.reduce(factor))
+            if img.size == size:
+                return img
+            return img.resize(size, Image.Resampling.BILINEAR)
+        return frame.resized(size, RESAMPLE_FILTERS[self.resample])
+
+    def _mask(self, img: Image.Image, regions: list) -> Image.Image:
+        """只保留 regions（基准分辨率坐标），其余涂黑"""
+        src = np.asarray(img)
+        out = np.zeros_like(src)
+        sx, sy = img.width / self.base_size[0], img.height / self.base_size[1]
+        for left, top, right, bottom in regions:
+            l, t = int(left * sx), int(top * sy)
+            r, b = int(np.ceil(right * sx)), int(np.ceil(bottom * sy))
+            out[t:b, l:r] = src[t:b, l:r]
+        return Image.fromarray(out)
+
+    def _save(self, img: Image.Image, quality: int) -> bytes:
+        buffer = io.BytesIO()
+        img.save(buffer, format=FORMATS[self.fmt][0], quality=quality)
+        return buffer.getvalue()
+
+    def encode(self, frame: Frame, hint: str = "") -> Payload:
+        start = time.perf_counter()
+        roi, regions = self.roi_for(hint)
+        scale, quality = self.scale, self.quality
+        shrunk = False
+        while True:
+            size = self._target_size(frame.width, frame.height, scale)
+            img = self._resize(frame, size)
+            if regions:
+                img = self._mask(img, regions)
+            if self.grayscale:
+                img = img.convert("L")
+            data = self._save(img, quality)
+            if not self.max_bytes or len(data) <= self.max_bytes:
+                break
+            # 超出字节预算：先降质量，质量到底后再缩小
+            shrunk = True
+            if quality > self.min_quality:
+                quality = max(quality - 10, self.min_quality)
+            elif min(size) > 64:
+                scale *= 0.8
+            else:
+                break
+        payload = Payload(data, FORMATS[self.fmt][1], size, quality, roi, time.perf_counter() - start)
+        observe("encode", payload.encode_time, format=self.fmt)
+        count("payload_bytes", len(data))
+        with self._lock:
+            self.counters["payloads"] += 1
+            self.counters["bytes"] += len(data)
+            self.counters["encode_time"] += payload.encode_time
+            self.counters["roi"] += roi is not None
+            self.counters["shrunk"] += shrunk
+        return payload
+
+    def record_upload(self, seconds: float):
+        """一次请求体上传用时（秒），由 AIReply.upload 给出；本地 backend 为 None"""
+        if seconds is None:
+            return
+        with self._lock:
+            self.counters["uploads"] += 1
+            self.counters["upload_time"] += seconds
+        observe("upload", seconds)
+
+    def _count(self, name: str):
+        with self._lock:
+            self.counters[name] += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            c = dict(self.counters)
+        n, u = c["payloads"] or 1, c["uploads"] or 1
+        return {
+            "payloads": c["payloads"],
+            "avg_kb": round(c["bytes"] / n / 1024, 1),
+            "total_mb": round(c["bytes"] / 1024 / 1024, 2),
+            "avg_encode_ms": round(c["encode_time"] / n * 1000, 1),
+            "avg_upload_ms": round(c["upload_time"] / u * 1000, 1),
+            "roi": c["roi"],
+            "shrunk": c["shrunk"],
+            "blank": c["blank"],
+        }
+
+
+def load_rois(path: str) -> dict:
+    """{关键字: [[left, top, right, bottom], ...]}，文件不存在时返回空配置"""
+    if not path or not os.path.exists(path):
+        return {}
+    with open(path, "r", encoding="utf-8") as f:
+        rois = json.load(f)
+    print(f"[编码] 从 {path} 载入 ROI: {', '.join(rois)}")
+    return rois
+
+
+_encoder = None
+_encoder_lock = threading.Lock()
+
+
+def get_payload_encoder() -> PayloadEncoder:
+    global _encoder
+    if _encoder is None:
+        with _encoder_lock:
+            if _encoder is None:
+                _encoder = PayloadEncoder.from_env()
+    return _encoder
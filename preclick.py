@@ -0,0 +1,83 @@
+"""
+点击前核对：确认画面没有在决策之后进入自动模式。
+
+原来每次点击前都会整帧截图并重新运行完整的 ocr()（消息区域 + 自动按钮，最多二十次变体推理）。
+实际上只需要看自动按钮区域：只截取这个区域，与做决策那一帧的签名比较；
+没有变化且决策时已经识别过（OCR 结果仍然有效），直接放行；
+区域确实变化了，才对这一个区域重新识别，消息区域沿用决策时的文字；
+决策时没有识别过（没有消息区域文字）时退回完整 OCR。
+"""
+import os
+import threading
+import time
+
+from frame_cache import FrameCache, region_signature
+from metrics import observe
+from ocr_region import COORDS, auto_button_text, ocr, ocr_verdict
+
+AUTO_REGION = "自动按钮"
+
+
+class PreClickVerifier:
+    """
+    capture: Capture，用 capture.region() 截取自动按钮区域
+    frame_cache: 主循环的 FrameCache，current 为做决策的那一帧，"ocr" 为该帧的 OCR 结果
+    enabled=False 时退回原来的整帧截图 + 完整 OCR
+    """
+
+    def __init__(self, capture, frame_cache: FrameCache, coords=COORDS, enabled: bool = True):
+        self.capture = capture
+        self.frame_cache = frame_cache
+        self.coords = coords
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self.counters = {"checks": 0, "unchanged": 0, "recognized": 0, "blocked": 0, "time": 0.0}
+
+    @classmethod
+    def from_env(cls, capture, frame_cache: FrameCache) -> "PreClickVerifier":
+        """PRECLICK_VERIFY=0 时关闭"""
+        return cls(capture, frame_cache, enabled=os.getenv("PRECLICK_VERIFY", "1") != "0")
+
+    def is_auto(self, viewport: tuple) -> bool:
+        """当前画面是否处于自动模式（是则不应点击）"""
+        start = time.perf_counter()
+        outcome, blocked = self._check(viewport)
+        elapsed = time.perf_counter() - start
+        observe("preclick", elapsed, outcome=outcome or "full")
+        with self._lock:
+            self.counters["checks"] += 1
+            self.counters["time"] += elapsed
+            self.counters["blocked"] += bool(blocked)
+            if outcome:
+                self.counters[outcome] += 1
+        return blocked
+
+    def _check(self, viewport: tuple) -> tuple:
+        """返回 (unchanged / recognized / None, 是否自动模式)"""
+        known = self.frame_cache.peek("ocr", (AUTO_REGION,)) if self.enabled else None
+        if known is None:
+            # 关闭核对优化，或没有决策那一帧的消息区域文字（FRAME_CACHE=0、检测器给出的决策、OCR 结果已过期）：
+            # 只看自动按钮会把空的识别结果误判为"无有效数据"，退回整帧截图 + 完整 OCR
+            is_auto, _ = ocr(self.capture.grab(viewport))
+            return None, is_auto
+        baseline = self.frame_cache.current.get(AUTO_REGION)
+        try:
+            region = self.capture.region(self.coords)
+        except Exception as e:
+            print(f"[核对] 截取自动按钮区域失败，直接点击: {e}")
+            return None, False
+        if baseline is not None and not self.frame_cache.changed(baseline, region_signature(region)):
+            # 决策那一帧识别过，区域也没变：沿用当时的结论
+            return "unchanged", known[0]
+        try:
+            is_auto, _ = ocr_verdict(auto_button_text(region), known[1])
+        except Exception as e:
+            print(f"[核对] 识别自动按钮失败，直接点击: {e}")
+            is_auto = False
+        return "recognized", is_auto
+
+    def stats(self) -> dict:
+        with self._lock:
+            c = dict(self.counters)
+        c["avg_ms"] = round(c.pop("time") / c["checks"] * 1000, 1) if c["checks"] else 0.0
+        return c
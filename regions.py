@@ -0,0 +1,9 @@
+"""
+画面中固定区域的基准坐标 (BASE_WIDTH x BASE_HEIGHT)，以及帧缓存里整帧签名的名字。
+
+只放常量、不导入第三方库：main.py 在登录提示出现之前就要用到它们，不应为此加载 numpy / PIL。
+"""
+
+COORDS = (1056, 524, 1250, 688)  # 自动按钮 (left, top, right, bottom)
+MSG_COORDS = (400, 0, 900, 400)  # 消息区域
+FULL_FRAME = "全屏"
@@ -0,0 +1,410 @@
+"""
+离线回放基准测试。
+
+录制：REPLAY_RECORD=1 时，主循环每做出一个新决策，就把整帧截图和这个决策写入 REPLAY_DIR（默认 replay/）：
+    replay/frames/<sha1>.png   截图原始数据，按内容命名，相同画面只存一份
+    replay/corpus.jsonl        每行一条 {"frame", "viewport", "action", "ocr": [is_auto, msginfo], "source", "time"}
+clip 模式下，每次记录都要额外截取一次整帧，所以录制时建议 CAPTURE_MODE=full。
+已有的截图也可以加入语料，它们没有标注，只参与速度统计：python replay.py add screenshots/*.png
+
+回放：python replay.py bench [--corpus replay] [--ai oracle|wait] [--ai-latency 0] [--repeat 1]
+每帧的决策顺序和主循环相同：先 decide_local（检测器 -> OCR -> 规则），再 decide_action_with_ai。
+AI 换成本地替身，不发网络请求：oracle 回复录制时的动作，wait 总是回复等待。报告包括：
+- 帧/秒，以及 metrics 中各阶段（detect / ocr / ocr_variant / rules / encode / ai / parse ...）的 p50 / p95 / p99
+- 决策路径的分布：检测器 / 自动 / 规则 / AI
+- 与录制的标注比较：OCR 的自动判断和消息文字是否一致；动作是否一致（scene_model.same_action），任务名是否一致
+--save 把结果保存成 JSON。--baseline 与之前保存的结果比较，帧率或准确率下降超过阈值时以退出码 1 结束，
+适合在部署前跑一遍。
+"""
+import argparse
+import contextlib
+import difflib
+import glob
+import hashlib
+import io
+import json
+import os
+import threading
+import time
+
+from PIL import Image
+
+from ai_backends import LocalBackend
+from frame import Frame, as_frame
+from scene_model import same_action
+
+EXTENSIONS = ((b"\x89PNG", ".png"), (b"\xff\xd8", ".jpg"), (b"RIFF", ".webp"))
+ROUTES = ("detector", "auto", "rules", "ai")
+
+
+def _extension(data: bytes) -> str:
+    for magic, ext in EXTENSIONS:
+        if data.startswith(magic):
+            return ext
+    return ".bin"
+
+
+def _frame_bytes(frame: Frame) -> bytes:
+    """整帧的编码数据；只截取了区域的帧在这里由 loader 取整帧，由数组 / 图片构造的帧编码成 PNG"""
+    if not frame.loaded:
+        frame.image
+    if frame.data is not None:
+        return frame.data
+    buffer = io.BytesIO()
+    frame.image.save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def _count_lines(path: str) -> int:
+    if not os.path.exists(path):
+        return 0
+    with open(path, "r", encoding="utf-8") as f:
+        return sum(1 for line in f if line.strip())
+
+
+class ReplayRecorder:
+    """把 (整帧截图, 决策, OCR 结果) 追加到 directory；语料达到 max_frames 条后不再记录（0 不限制）"""
+
+    def __init__(self, directory: str = "replay", max_frames: int = 2000):
+        self.directory = directory
+        self.max_frames = max_frames
+        self.frames_dir = os.path.join(directory, "frames")
+        os.makedirs(self.frames_dir, exist_ok=True)
+        self.path = os.path.join(directory, "corpus.jsonl")
+        self._lock = threading.Lock()
+        self.count = _count_lines(self.path)
+
+    @classmethod
+    def from_env(cls) -> "ReplayRecorder":
+        """REPLAY_DIR / REPLAY_MAX_FRAMES"""
+        return cls(os.getenv("REPLAY_DIR", "replay"), int(os.getenv("REPLAY_MAX_FRAMES", 2000)))
+
+    @property
+    def full(self) -> bool:
+        return bool(self.max_frames) and self.count >= self.max_frames
+
+    def record(self, frame: Frame, action: dict, ocr: tuple = None, source: str = None):
+        """action 为 None 表示当时 AI 请求失败；ocr 为该帧的 (is_auto, msginfo)，没有运行 OCR 时为 None"""
+        if self.full:
+            return
+        try:
+            frame = as_frame(frame)
+            self._append(_frame_bytes(frame), frame.viewport,
+                         {"action": action, "ocr": list(ocr) if ocr is not None else None, "source": source})
+        except Exception as e:
+            print(f"[回放] 记录失败: {e}")
+
+    def add_image(self, path: str):
+        """加入一张已有的截图（没有标注）"""
+        with open(path, "rb") as f:
+            data = f.read()
+        with Image.open(io.BytesIO(data)) as img:
+            size = img.size
+        self._append(data, size, {"source": "import"})
+
+    def _append(self, data: bytes, viewport: tuple, fields: dict):
+        name = hashlib.sha1(data).hexdigest()[:20] + _extension(data)
+        record = {"frame": name, "viewport": list(viewport), **fields, "time": round(time.time(), 3)}
+        with self._lock:
+            path = os.path.join(self.frames_dir, name)
+            if not os.path.exists(path):
+                with open(path, "wb") as f:
+                    f.write(data)
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+            self.count += 1
+            if self.full:
+                print(f"[回放] 已记录 {self.count} 帧，达到 REPLAY_MAX_FRAMES，停止记录")
+
+
+def load_corpus(directory: str) -> list:
+    """corpus.jsonl 中的记录（附带截图路径 path），缺失的截图跳过"""
+    records = []
+    with open(os.path.join(directory, "corpus.jsonl"), "r", encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            record["path"] = os.path.join(directory, "frames", record["frame"])
+            if not os.path.exists(record["path"]):
+                continue
+            action = record.get("action")
+            if action and "clicks" in action:
+                action["clicks"] = [tuple(c) for c in action["clicks"]]
+            records.append(record)
+    return records
+
+
+_recorder = None
+_recorder_lock = threading.Lock()
+
+
+def get_replay_recorder() -> ReplayRecorder:
+    """REPLAY_RECORD=1 时返回录制器，否则返回 None"""
+    global _recorder
+    if os.getenv("REPLAY_RECORD", "0") != "1":
+        return None
+    if _recorder is None:
+        with _recorder_lock:
+            if _recorder is None:
+                _recorder = ReplayRecorder.from_env()
+                print(f"[回放] 录制到 {_recorder.directory} (已有 {_recorder.count} 帧)")
+    return _recorder
+
+
+# --- 回放 ---
+
+class ReplayBackend(LocalBackend):
+    """回放用的 AI 替身：回复 reply（基准测试按当前帧设置），latency 秒模拟请求耗时"""
+
+    kind = "replay"
+
+    def __init__(self, name: str = "replay", latency: float = 0.0, **kwargs):
+        super().__init__(name, fallback_only=False, **kwargs)
+        self.latency = latency
+
+    def respond(self, prompt: str, image_b64: str, mime_type: str, options: dict) -> str:
+        if self.latency:
+            time.sleep(self.latency)
+        return self.reply
+
+
+def _normalize(text: str) -> str:
+    return "".join((text or "").split())
+
+
+class Scorer:
+    """按录制的标注统计 OCR 和决策的一致性"""
+
+    def __init__(self, show: int = 10):
+        self.show = show
+        self.routes = {route: [0, 0] for route in ROUTES}
+        self.counters = {"frames": 0, "labeled": 0, "decision_ok": 0, "task_ok": 0,
+                         "ocr_checked": 0, "ocr_auto_ok": 0, "ocr_text_ok": 0, "ocr_similarity": 0.0}
+        self.mismatches = []
+
+    def add(self, record: dict, action: dict, route: str, ocr_result: tuple):
+        c = self.counters
+        c["frames"] += 1
+        label = record.get("action")
+        expected_ocr = record.get("ocr")
+        if expected_ocr is not None and ocr_result is not None:
+            c["ocr_checked"] += 1
+            c["ocr_auto_ok"] += bool(ocr_result[0]) == bool(expected_ocr[0])
+            c["ocr_text_ok"] += _normalize(ocr_result[1]) == _normalize(expected_ocr[1])
+            c["ocr_similarity"] += difflib.SequenceMatcher(
+                None, _normalize(ocr_result[1]), _normalize(expected_ocr[1])).ratio()
+        self.routes[route][0] += 1
+        # 没有标注（导入的截图）或录制时 AI 请求失败的帧不计入准确率
+        if not label:
+            return
+        c["labeled"] += 1
+        ok = action is not None and same_action(action, label)
+        c["decision_ok"] += ok
+        c["task_ok"] += action is not None and action.get("task") == label.get("task")
+        self.routes[route][1] += ok
+        if not ok and len(self.mismatches) < self.show:
+            self.mismatches.append((record["frame"], route, label, action))
+
+    def accuracy(self) -> dict:
+        c = self.counters
+        labeled, checked = c["labeled"], c["ocr_checked"]
+        return {
+            "decision": round(c["decision_ok"] / labeled, 4) if labeled else None,
+            "task": round(c["task_ok"] / labeled, 4) if labeled else None,
+            "ocr_auto": round(c["ocr_auto_ok"] / checked, 4) if checked else None,
+            "ocr_text": round(c["ocr_text_ok"] / checked, 4) if checked else None,
+            "ocr_similarity": round(c["ocr_similarity"] / checked, 4) if checked else None,
+        }
+
+
+def _prepare_env(cache: bool):
+    """在导入 main 之前设置：打开进程内指标（不开端点），关闭录制和样本记录；默认关闭决策缓存"""
+    os.environ["METRICS"] = "1"
+    os.environ["METRICS_PORT"] = "0"
+    os.environ["REPLAY_RECORD"] = "0"
+    os.environ["SCENE_LOG"] = "0"
+    if not cache:
+        os.environ["AI_CACHE"] = "0"
+
+
+def replay_frame(bot, frame: Frame, backend: ReplayBackend, reply: str) -> tuple:
+    """按主循环的顺序对一帧做决策，返回 (动作, 路径, OCR 结果)"""
+    from frame_cache import FrameCache
+
+    vw, vh = frame.viewport
+    # 每帧用新的帧缓存：测的是每帧从头决策的耗时，不复用上一帧的 OCR 结果
+    frame_cache = FrameCache(bot.OCR_REGIONS)
+    frame_cache.observe(frame)
+    action, msginfo = bot.decide_local(frame, vw, vh, frame_cache)
+    ocr_result = frame_cache.peek("ocr", bot.OCR_REGIONS)
+    if action is not None:
+        if ocr_result is None:
+            return action, "detector", None
+        return action, "auto" if ocr_result[0] else "rules", ocr_result
+    backend.reply = reply
+    return bot.decide_action_with_ai(frame, vw, vh, msginfo), "ai", ocr_result
+
+
+def run_benchmark(corpus: str, ai: str = "oracle", ai_latency: float = 0.0, repeat: int = 1, limit: int = 0,
+                  cache: bool = False, verbose: bool = False, show: int = 10) -> tuple:
+    """回放语料，返回 (结果字典, Scorer)"""
+    _prepare_env(cache)
+    import main as bot
+    from ai_client import AIClient, set_ai_client
+    from metrics import span, summary
+    from ocr_region import warmup_ocr_async
+
+    records = load_corpus(corpus)
+    if limit:
+        records = records[:limit]
+    if not records:
+        raise SystemExit(f"{corpus} 中没有可回放的帧，先用 REPLAY_RECORD=1 录制")
+
+    backend = ReplayBackend(latency=ai_latency)
+    set_ai_client(AIClient([backend], max_retries=0))
+    print(f"回放 {len(records)} 帧 x {repeat} 轮，AI 替身: {ai}"
+          f"{f' (延迟 {ai_latency * 1000:.0f}ms)' if ai_latency else ''}")
+    # 模型加载和预热不计入
+    warmup_ocr_async().join()
+
+    scorer = Scorer(show)
+    wait_reply = json.dumps({"task": "等待", "action": "wait"}, ensure_ascii=False)
+    elapsed = 0.0
+    output = contextlib.nullcontext() if verbose else contextlib.redirect_stdout(io.StringIO())
+    with output:
+        for _ in range(repeat):
+            for record in records:
+                with open(record["path"], "rb") as f:
+                    data = f.read()
+                label = record.get("action")
+                reply = json.dumps(label, ensure_ascii=False) if ai == "oracle" and label else wait_reply
+                start = time.perf_counter()
+                with span("replay_frame"):
+                    frame = Frame(data, viewport=tuple(record["viewport"]))
+                    action, route, ocr_result = replay_frame(bot, frame, backend, reply)
+                elapsed += time.perf_counter() - start
+                scorer.add(record, action, route, ocr_result)
+
+    stats = summary()
+    frames = scorer.counters["frames"]
+    result = {
+        "corpus": corpus,
+        "frames": frames,
+        "seconds": round(elapsed, 3),
+        "fps": round(frames / elapsed, 2) if elapsed else 0.0,
+        "routes": {route: n for route, (n, _) in scorer.routes.items()},
+        "accuracy": scorer.accuracy(),
+        "stages": {name: value for name, value in stats.items() if isinstance(value, dict)},
+        "counters": {name: value for name, value in stats.items() if not isinstance(value, dict)},
+    }
+    return result, scorer
+
+
+def print_report(result: dict, scorer: Scorer):
+    print(f"\n帧数 {result['frames']}，用时 {result['seconds']:.2f}s，{result['fps']:.2f} 帧/秒")
+    print("决策路径: " + " / ".join(f"{route} {n}" for route, n in result["routes"].items()))
+    accuracy = result["accuracy"]
+    if accuracy["ocr_auto"] is not None:
+        print(f"OCR ({scorer.counters['ocr_checked']} 帧): 自动判断一致 {accuracy['ocr_auto']:.1%}，"
+              f"文字完全一致 {accuracy['ocr_text']:.1%}，平均相似度 {accuracy['ocr_similarity']:.3f}")
+    if accuracy["decision"] is not None:
+        per_route = " / ".join(f"{route} {ok}/{n}" for route, (n, ok) in scorer.routes.items() if n)
+        print(f"决策 ({scorer.counters['labeled']} 帧有标注): 动作一致 {accuracy['decision']:.1%}，"
+              f"任务一致 {accuracy['task']:.1%} ({per_route})")
+    print(f"\n{'阶段':<32}{'次数':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for name, stage in sorted(result["stages"].items()):
+        print(f"{name:<32}{stage['count']:>8}{stage['p50']:>10.1f}{stage['p95']:>10.1f}{stage['p99']:>10.1f}")
+    if result["counters"]:
+        print("计数: " + ", ".join(f"{name} {value}" for name, value in sorted(result["counters"].items())))
+    if scorer.mismatches:
+        print(f"\n不一致的帧（前 {len(scorer.mismatches)} 个）:")
+        for name, route, label, action in scorer.mismatches:
+            print(f"  {name} [{route}] 录制 {label} / 回放 {action}")
+
+
+def compare(result: dict, baseline: dict, max_slowdown: float = 0.2, max_drop: float = 0.02) -> list:
+    """与基线比较，返回退化项的说明；阶段 p95 只比较两边都至少有 10 个样本的阶段，变化小于 1ms 的忽略"""
+    problems = []
+    if baseline.get("fps") and result["fps"] < baseline["fps"] * (1 - max_slowdown):
+        problems.append(f"帧率 {result['fps']:.2f} < 基线 {baseline['fps']:.2f}")
+    for name, old in baseline.get("stages", {}).items():
+        new = result["stages"].get(name)
+        if new is None or min(new["count"], old["count"]) < 10:
+            continue
+        if new["p95"] > old["p95"] * (1 + max_slowdown) and new["p95"] - old["p95"] >= 1.0:
+            problems.append(f"{name} p95 {new['p95']:.1f}ms > 基线 {old['p95']:.1f}ms")
+    for key, old in baseline.get("accuracy", {}).items():
+        new = result["accuracy"].get(key)
+        if old is not None and new is not None and new < old - max_drop:
+            problems.append(f"准确率 {key} {new:.3f} < 基线 {old:.3f}")
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description="离线回放基准测试")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+
+    p_bench = sub.add_parser("bench", help="回放语料，报告速度和准确率")
+    p_bench.add_argument("--corpus", default=os.getenv("REPLAY_DIR", "replay"))
+    p_bench.add_argument("--ai", choices=["oracle", "wait"], default="oracle",
+                         help="AI 替身: oracle 回复录制的动作，wait 总是等待")
+    p_bench.add_argument("--ai-latency", type=float, default=0.0, help="模拟的 AI 请求耗时（秒）")
+    p_bench.add_argument("--repeat", type=int, default=1)
+    p_bench.add_argument("--limit", type=int, default=0, help="只回放前 N 帧")
+    p_bench.add_argument("--cache", action="store_true", help="保留决策缓存 (AI_CACHE)，默认关闭")
+    p_bench.add_argument("--verbose", action="store_true", help="显示回放过程中的输出")
+    p_bench.add_argument("--show", type=int, default=10, help="列出的不一致帧数")
+    p_bench.add_argument("--save", default=None, help="把结果保存为 JSON")
+    p_bench.add_argument("--baseline", default=None, help="与之前 --save 的结果比较，退化时退出码为 1")
+    p_bench.add_argument("--max-slowdown", type=float, default=0.2, help="允许的帧率 / p95 退化比例")
+    p_bench.add_argument("--max-drop", type=float, default=0.02, help="允许的准确率下降")
+
+    p_add = sub.add_parser("add", help="把已有截图加入语料（没有标注）")
+    p_add.add_argument("images", nargs="+")
+    p_add.add_argument("--corpus", default=os.getenv("REPLAY_DIR", "replay"))
+
+    p_stats = sub.add_parser("stats", help="查看语料")
+    p_stats.add_argument("--corpus", default=os.getenv("REPLAY_DIR", "replay"))
+    args = parser.parse_args()
+
+    if args.cmd == "add":
+        recorder = ReplayRecorder(args.corpus, max_frames=0)
+        paths = [p for pattern in args.images for p in sorted(glob.glob(pattern))]
+        for path in paths:
+            recorder.add_image(path)
+        print(f"已加入 {len(paths)} 张截图，语料共 {recorder.count} 帧")
+        return
+
+    if args.cmd == "stats":
+        records = load_corpus(args.corpus)
+        tasks = {}
+        for record in records:
+            action = record.get("action")
+            key = "(无标注)" if "action" not in record else (action or {}).get("task", "(AI 失败)")
+            tasks[key] = tasks.get(key, 0) + 1
+        print(f"{len(records)} 帧，{len({r['frame'] for r in records})} 张不同的截图")
+        for task, n in sorted(tasks.items(), key=lambda kv: -kv[1]):
+            print(f"{n:6d}  {task}")
+        return
+
+    result, scorer = run_benchmark(args.corpus, args.ai, args.ai_latency, args.repeat, args.limit,
+                                   args.cache, args.verbose, args.show)
+    print_report(result, scorer)
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+        print(f"\n结果已保存到 {args.save}")
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            problems = compare(result, json.load(f), args.max_slowdown, args.max_drop)
+        if problems:
+            print("\n与基线相比出现退化:")
+            for problem in problems:
+                print(f"  {problem}")
+            raise SystemExit(1)
+        print("\n与基线相比没有退化")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,259 @@
+"""
+OCR 文本规则引擎，代替原来 decide_fixed_action 和 ocr() 里写死的关键字判断。
+
+规则表 RULES_PATH（默认 rules.json）:
+    {"rules": [
+        {"name": "愿望", "stage": "action", "priority": 40,
+         "msg": {"any": ["愿望"]},
+         "action": {"type": "click", "x": 455, "y": 450, "task": "愿望-固定"}},
+        ...
+    ]}
+
+- stage: ocr —— 决定是否跳过 AI（原 ocr_verdict，例如画面处于自动模式）；action —— 直接给出动作（原 decide_fixed_action）
+- 条件: msg（消息区域文字）/ auto（自动按钮文字）各自可以有
+    any: 出现其中任一个，all: 全部出现，none: 都不出现，empty: true 表示文字为空
+  规则里给出的条件全部满足才算命中；同一 stage 中按 priority 从高到低取第一个命中的规则（相同时按文件顺序）
+- action.type: click (x, y) / sequence (clicks) / hold (x, y) / random (choices，随机选一个) / wait；
+  ocr 阶段的规则为 skip：跳过 AI，clear_msg: true 时同时清空 msginfo
+
+所有规则的关键字编译进一个 Aho-Corasick 自动机，每段文字只扫描一遍。
+文件修改后（按 mtime，最多每 check_interval 秒检查一次）自动重新载入，格式错误时保留旧规则。
+"""
+import json
+import os
+import random
+import threading
+import time
+from collections import deque
+
+from metrics import span
+
+STAGES = ("ocr", "action")
+ACTION_TYPES = ("click", "sequence", "hold", "random", "wait", "skip")
+
+
+class KeywordMatcher:
+    """Aho-Corasick 多模式匹配：一次扫描找出文本中出现的所有关键字"""
+
+    def __init__(self, keywords):
+        self.keywords = sorted(set(k for k in keywords if k))
+        self._goto = [{}]
+        self._fail = [0]
+        self._out = [set()]
+        for keyword in self.keywords:
+            state = 0
+            for ch in keyword:
+                nxt = self._goto[state].get(ch)
+                if nxt is None:
+                    nxt = len(self._goto)
+                    self._goto[state][ch] = nxt
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._out.append(set())
+                state = nxt
+            self._out[state].add(keyword)
+        # 广度优先计算失败指针，并把失败状态的输出并入当前状态
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for ch, nxt in self._goto[state].items():
+                queue.append(nxt)
+                fail = self._fail[state]
+                while fail and ch not in self._goto[fail]:
+                    fail = self._fail[fail]
+                target = self._goto[fail].get(ch, 0)
+                self._fail[nxt] = target if target != nxt else 0
+                self._out[nxt] |= self._out[self._fail[nxt]]
+
+    def scan(self, text: str) -> set:
+        found = set()
+        state = 0
+        goto, fail, out = self._goto, self._fail, self._out
+        for ch in text or "":
+            while state and ch not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(ch, 0)
+            if out[state]:
+                found |= out[state]
+        return found
+
+
+class Condition:
+    """某个区域文字的条件"""
+
+    __slots__ = ("any", "all", "none", "empty")
+
+    def __init__(self, any=(), all=(), none=(), empty: bool = None):
+        self.any = tuple(any)
+        self.all = tuple(all)
+        self.none = tuple(none)
+        self.empty = empty
+
+    def keywords(self) -> tuple:
+        return self.any + self.all + self.none
+
+    def match(self, text: str, found: set) -> bool:
+        if self.empty is not None and (not text) != self.empty:
+            return False
+        if self.any and not any(k in found for k in self.any):
+            return False
+        if any(k not in found for k in self.all):
+            return False
+        return not any(k in found for k in self.none)
+
+
+class Rule:
+    def __init__(self, name: str, action: dict, stage: str = "action", priority: int = 0, msg: dict = None,
+                 auto: dict = None, clear_msg: bool = False, enabled: bool = True, order: int = 0):
+        if stage not in STAGES:
+            raise ValueError(f"规则 {name}: 未知的 stage: {stage}")
+        if action.get("type") not in ACTION_TYPES:
+            raise ValueError(f"规则 {name}: 未知的动作类型: {action.get('type')}")
+        if (action["type"] == "skip") != (stage == "ocr"):
+            raise ValueError(f"规则 {name}: ocr 阶段的规则只能是 skip，skip 也只能用于 ocr 阶段")
+        if msg is None and auto is None:
+            raise ValueError(f"规则 {name}: 至少需要 msg 或 auto 条件")
+        self.name = name
+        self.stage = stage
+        self.priority = priority
+        self.action = action
+        self.conditions = {region: Condition(**cond) for region, cond in (("msg", msg), ("auto", auto))
+                           if cond is not None}
+        self.clear_msg = clear_msg
+        self.enabled = enabled
+        self.order = order
+
+    def keywords(self) -> list:
+        return [k for cond in self.conditions.values() for k in cond.keywords()]
+
+    def match(self, texts: dict, found: dict) -> bool:
+        return all(cond.match(texts[region], found[region]) for region, cond in self.conditions.items())
+
+    def build_action(self) -> dict:
+        """按动作模板生成主循环使用的动作字典"""
+        spec = self.action
+        kind = spec["type"]
+        task = spec.get("task", self.name)
+        if kind == "click":
+            return {"x": spec["x"], "y": spec["y"], "task": task}
+        if kind == "hold":
+            return {"x": spec["x"], "y": spec["y"], "hold": True, "task": task}
+        if kind == "sequence":
+            return {"task": task, "clicks": [tuple(c) for c in spec["clicks"]]}
+        if kind == "random":
+            choice = random.choice(spec["choices"])
+            print(f"[规则] {self.name}: 随机选择 {choice.get('name', '')}")
+            return {"x": choice["x"], "y": choice["y"], "task": task}
+        return {"action": "wait", "task": task}
+
+
+class RuleEngine:
+    """path: 规则表 JSON；check_interval: 检查文件是否修改的最短间隔（秒）"""
+
+    def __init__(self, path: str = "rules.json", check_interval: float = 1.0):
+        self.path = path
+        self.check_interval = check_interval
+        self._mtime = None
+        self._checked = 0.0
+        self._lock = threading.Lock()
+        # (按 stage 分组并排好序的规则, 关键字匹配器)，整体替换，读取时无需加锁
+        self._compiled = ({stage: [] for stage in STAGES}, KeywordMatcher(()))
+        self.hits = {}
+        self.reloads = 0
+        self.maybe_reload(force=True)
+
+    @classmethod
+    def from_env(cls) -> "RuleEngine":
+        """RULES_PATH / RULES_CHECK_INTERVAL"""
+        return cls(os.getenv("RULES_PATH", "rules.json"), float(os.getenv("RULES_CHECK_INTERVAL", 1)))
+
+    @staticmethod
+    def compile(rules: list) -> tuple:
+        stages = {stage: [] for stage in STAGES}
+        for rule in rules:
+            if rule.enabled:
+                stages[rule.stage].append(rule)
+        for stage_rules in stages.values():
+            stage_rules.sort(key=lambda r: (-r.priority, r.order))
+        matcher = KeywordMatcher(k for rule in rules for k in rule.keywords())
+        return stages, matcher
+
+    def load(self, path: str = None) -> list:
+        with open(path or self.path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        entries = data["rules"] if isinstance(data, dict) else data
+        return [Rule(order=i, **entry) for i, entry in enumerate(entries)]
+
+    def maybe_reload(self, force: bool = False):
+        now = time.monotonic()
+        if not force and now - self._checked < self.check_interval:
+            return
+        with self._lock:
+            self._checked = now
+            try:
+                mtime = os.path.getmtime(self.path)
+            except OSError:
+                if force:
+                    print(f"[规则] 找不到规则表 {self.path}，不使用固定规则")
+                return
+            if mtime == self._mtime:
+                return
+            try:
+                rules = self.load()
+                self._compiled = self.compile(rules)
+            except (OSError, ValueError, KeyError, TypeError) as e:
+                # 编辑到一半的文件：保留旧规则，下次修改后再试
+                print(f"[规则] 载入 {self.path} 失败，继续使用旧规则: {e}")
+                self._mtime = mtime
+                return
+            self._mtime = mtime
+            self.reloads += 1
+            print(f"[规则] 已载入 {self.path}: {len(rules)} 条规则")
+
+    def match(self, stage: str, msg: str = "", auto: str = "") -> Rule:
+        """该 stage 中第一条命中的规则，没有时返回 None"""
+        self.maybe_reload()
+        rules, matcher = self._compiled
+        if not rules[stage]:
+            return None
+        with span("rules", stage=stage):
+            texts = {"msg": msg or "", "auto": auto or ""}
+            found = {region: matcher.scan(text) for region, text in texts.items()}
+            for rule in rules[stage]:
+                if rule.match(texts, found):
+                    self.hits[rule.name] = self.hits.get(rule.name, 0) + 1
+                    return rule
+        return None
+
+    def verdict(self, text: str, msginfo: str) -> tuple:
+        """ocr 阶段：返回 (是否跳过 AI, msginfo)，与原 ocr_verdict 相同"""
+        rule = self.match("ocr", msginfo, text)
+        if rule is None:
+            return False, msginfo
+        print(f"[规则] {rule.name}，跳过AI分析，等待下一轮...")
+        return True, "" if rule.clear_msg else msginfo
+
+    def decide(self, msginfo: str, auto_text: str = "") -> dict:
+        """action 阶段：命中时返回动作字典，否则返回 None"""
+        rule = self.match("action", (msginfo or "").strip(), auto_text)
+        if rule is None:
+            return None
+        action = rule.build_action()
+        print(f"[规则] 命中 {rule.name} -> {action.get('task')}")
+        return action
+
+    def stats(self) -> dict:
+        return {"reloads": self.reloads, "hits": dict(self.hits)}
+
+
+_engine = None
+_engine_lock = threading.Lock()
+
+
+def get_rule_engine() -> RuleEngine:
+    global _engine
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                _engine = RuleEngine.from_env()
+    return _engine
@@ -0,0 +1,417 @@
+"""
+本地场景分类器：用记录下来的 AI 决策训练，在请求 AI 之前先在 CPU 上判断。
+
+AI 的回复大多落在提示词里那几种任务上（骰子、确认、猜拳、轰炸、愿望、掠夺、动画、等待），
+而且同一个按钮的坐标几乎不变。把 (任务, 动作类型, 相近的坐标) 聚成一个类别，
+用缩略图 + OCR 文本特征训练一个 softmax 分类器，置信度足够高时直接采用，否则照常请求 AI。
+
+1. 记录：SCENE_LOG=1 时，AI 每给出一个（非兜底的）决策，就把缩略图、OCR 文本和动作写入 SCENE_LOG_DIR
+2. 训练：python scene_model.py train → scene_model.npz；加 --onnx 同时导出 scene_model.onnx（需要 pip install onnx）
+3. 使用：SCENE_MODEL 指向 .onnx（用 onnxruntime 推理）或 .npz（numpy 推理）；
+   置信度 >= SCENE_MIN_CONFIDENCE 时直接返回模型的动作，SCENE_AUDIT 比例的命中仍请求 AI 用于核对
+"""
+import argparse
+import json
+import os
+import random
+import threading
+import time
+import zlib
+
+import numpy as np
+from PIL import Image
+
+from frame import Frame, as_frame
+from metrics import observe
+
+THUMB_SIZE = (32, 18)
+TEXT_BUCKETS = 128
+OTHER = "__other__"
+# AI 对同一个按钮给出的坐标会有几个像素的偏差，相距 RADIUS 以内视为同一个动作
+RADIUS = 20
+
+
+def text_features(text: str) -> np.ndarray:
+    """OCR 文本的单字 + 双字哈希到 TEXT_BUCKETS 个桶（出现记 1）"""
+    vec = np.zeros(TEXT_BUCKETS, dtype=np.float32)
+    text = "".join((text or "").split())
+    for gram in list(text) + [text[i:i + 2] for i in range(len(text) - 1)]:
+        vec[zlib.crc32(gram.encode("utf-8")) % TEXT_BUCKETS] = 1.0
+    return vec
+
+
+def features(frame: Frame, text: str = "") -> np.ndarray:
+    """缩略图 (THUMB_SIZE, RGB 0~1) 拼接 OCR 文本特征"""
+    thumb = as_frame(frame).resized(THUMB_SIZE, Image.Resampling.BOX)
+    pixels = np.asarray(thumb, dtype=np.float32).ravel() / 255.0
+    return np.concatenate([pixels, text_features(text)])
+
+
+def action_kind(action: dict) -> str:
+    """任务 + 动作类型（连点还包括点数）"""
+    task = action.get("task", "unknown")
+    if action.get("action") == "wait":
+        return f"{task}|wait"
+    if "clicks" in action:
+        return f"{task}|clicks{len(action['clicks'])}"
+    return f"{task}|{'hold' if action.get('hold') else 'click'}"
+
+
+def action_points(action: dict) -> list:
+    if "clicks" in action:
+        return [tuple(c) for c in action["clicks"]]
+    if "x" in action:
+        return [(action["x"], action["y"])]
+    return []
+
+
+def same_action(a: dict, b: dict, radius: float = RADIUS) -> bool:
+    """同一任务、同一动作类型，且每个点相距不超过 radius 像素"""
+    if action_kind(a) != action_kind(b):
+        return False
+    return all(abs(ax - bx) <= radius and abs(ay - by) <= radius
+               for (ax, ay), (bx, by) in zip(action_points(a), action_points(b)))
+
+
+def action_key(action: dict) -> str:
+    """类别名：动作类型 + 坐标"""
+    points = ";".join(f"{x},{y}" for x, y in action_points(action))
+    return f"{action_kind(action)}@{points}" if points else action_kind(action)
+
+
+def cluster_actions(actions: list, radius: float = RADIUS) -> list:
+    """把相同的动作（same_action）贪心地聚在一起，返回 [[动作, ...], ...]"""
+    clusters = []
+    for action in actions:
+        for members in clusters:
+            if same_action(members[0], action, radius):
+                members.append(action)
+                break
+        else:
+            clusters.append([action])
+    return clusters
+
+
+def prototype(actions: list) -> dict:
+    """同一类别的多个动作合成一个：坐标取中位数"""
+    first = dict(actions[0])
+    first.pop("confidence", None)
+    if "clicks" in first:
+        first["clicks"] = [tuple(int(v) for v in np.median(np.array([a["clicks"][i] for a in actions]), axis=0))
+                           for i in range(len(first["clicks"]))]
+    elif "x" in first:
+        first["x"] = int(np.median([a["x"] for a in actions]))
+        first["y"] = int(np.median([a["y"] for a in actions]))
+    return first
+
+
+class SceneLogger:
+    """把 (缩略图, OCR 文本, AI 动作) 追加到 directory/samples.jsonl，缩略图存为 directory/frames/*.jpg"""
+
+    def __init__(self, directory: str = "scene_log", size: tuple = (320, 180), quality: int = 85):
+        self.directory = directory
+        self.size = size
+        self.quality = quality
+        self.frames_dir = os.path.join(directory, "frames")
+        os.makedirs(self.frames_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        self.count = 0
+
+    def log(self, frame: Frame, text: str, action: dict):
+        if not action:
+            return
+        try:
+            name = f"{time.time():.3f}-{random.randrange(1 << 16):04x}.jpg"
+            as_frame(frame).resized(self.size, Image.Resampling.BOX).save(
+                os.path.join(self.frames_dir, name), format="JPEG", quality=self.quality)
+            record = {"frame": name, "text": text or "", "action": action, "time": time.time()}
+            with self._lock:
+                with open(os.path.join(self.directory, "samples.jsonl"), "a", encoding="utf-8") as f:
+                    f.write(json.dumps(record, ensure_ascii=False) + "\n")
+                self.count += 1
+        except Exception as e:
+            print(f"[场景] 记录样本失败: {e}")
+
+
+def load_samples(directory: str) -> list:
+    """[(特征, 动作字典)]，缺失的缩略图跳过"""
+    samples = []
+    path = os.path.join(directory, "samples.jsonl")
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            image_path = os.path.join(directory, "frames", record["frame"])
+            if not os.path.exists(image_path):
+                continue
+            action = record["action"]
+            if "clicks" in action:
+                action["clicks"] = [tuple(c) for c in action["clicks"]]
+            with Image.open(image_path) as img:
+                samples.append((features(Frame(image=img.convert("RGB")), record["text"]), action))
+    return samples
+
+
+def train_softmax(x: np.ndarray, y: np.ndarray, classes: int, epochs: int = 300, lr: float = 0.05,
+                  l2: float = 1e-4, seed: int = 0) -> tuple:
+    """全批量 Adam 训练多类逻辑回归，x 已标准化；返回 (W, b)"""
+    rng = np.random.default_rng(seed)
+    w = rng.normal(0, 0.01, (x.shape[1], classes)).astype(np.float32)
+    b = np.zeros(classes, dtype=np.float32)
+    onehot = np.eye(classes, dtype=np.float32)[y]
+    m = [np.zeros_like(w), np.zeros_like(b)]
+    v = [np.zeros_like(w), np.zeros_like(b)]
+    for step in range(1, epochs + 1):
+        p = softmax(x @ w + b)
+        grad = (p - onehot) / len(x)
+        grads = [x.T @ grad + l2 * w, grad.sum(axis=0)]
+        for i, (param, g) in enumerate(zip((w, b), grads)):
+            m[i] = 0.9 * m[i] + 0.1 * g
+            v[i] = 0.999 * v[i] + 0.001 * g * g
+            param -= lr * (m[i] / (1 - 0.9 ** step)) / (np.sqrt(v[i] / (1 - 0.999 ** step)) + 1e-8)
+    return w, b
+
+
+def softmax(z: np.ndarray) -> np.ndarray:
+    z = z - z.max(axis=1, keepdims=True)
+    e = np.exp(z)
+    return e / e.sum(axis=1, keepdims=True)
+
+
+class SceneModel:
+    """
+    mean / std: 特征标准化参数；w / b: 线性层；classes: 类别名（OTHER 表示"交给 AI"）；
+    actions: {类别: 动作字典}；session: onnxruntime 推理会话（为 None 时用 numpy 计算）
+    """
+
+    def __init__(self, mean, std, w, b, classes: list, actions: dict, min_confidence: float = 0.9,
+                 audit: float = 0.0, session=None):
+        self.mean = mean
+        self.std = std
+        self.w = w
+        self.b = b
+        self.classes = classes
+        self.actions = actions
+        self.min_confidence = min_confidence
+        self.audit = audit
+        self.session = session
+        self._lock = threading.Lock()
+        self.counters = {"calls": 0, "hits": 0, "audits": 0, "agreements": 0}
+
+    # --- 训练 / 保存 ---
+
+    @classmethod
+    def fit(cls, samples: list, min_samples: int = 5, **kwargs) -> "SceneModel":
+        clusters = cluster_actions([a for _, a in samples])
+        kept = [c for c in clusters if len(c) >= min_samples]
+        actions = {}
+        labels = {}
+        for members in kept:
+            proto = prototype(members)
+            actions[action_key(proto)] = proto
+            for a in members:
+                labels[id(a)] = action_key(proto)
+        classes = sorted(actions) + [OTHER]
+        index = {k: i for i, k in enumerate(classes)}
+        x = np.stack([f for f, _ in samples])
+        y = np.array([index[labels.get(id(a), OTHER)] for _, a in samples])
+        mean = x.mean(axis=0)
+        std = x.std(axis=0) + 1e-3
+        w, b = train_softmax((x - mean) / std, y, len(classes))
+        return cls(mean.astype(np.float32), std.astype(np.float32), w, b, classes, actions, **kwargs)
+
+    def save(self, path: str):
+        np.savez(path, mean=self.mean, std=self.std, w=self.w, b=self.b,
+                 meta=json.dumps({"classes": self.classes, "actions": self.actions}, ensure_ascii=False))
+
+    def export_onnx(self, path: str):
+        """导出 Softmax(((x - mean) / std) @ W + b)，类别和动作写入模型元数据"""
+        try:
+            import onnx
+            from onnx import TensorProto, helper, numpy_helper
+        except ImportError:
+            raise RuntimeError("导出 ONNX 需要 onnx 包: pip install onnx")
+        init = [numpy_helper.from_array(np.asarray(v, dtype=np.float32), name)
+                for name, v in (("mean", self.mean), ("std", self.std), ("w", self.w), ("b", self.b))]
+        nodes = [
+            helper.make_node("Sub", ["x", "mean"], ["centered"]),
+            helper.make_node("Div", ["centered", "std"], ["scaled"]),
+            helper.make_node("MatMul", ["scaled", "w"], ["logits0"]),
+            helper.make_node("Add", ["logits0", "b"], ["logits"]),
+            helper.make_node("Softmax", ["logits"], ["prob"], axis=1),
+        ]
+        graph = helper.make_graph(
+            nodes, "scene_model",
+            [helper.make_tensor_value_info("x", TensorProto.FLOAT, [None, len(self.mean)])],
+            [helper.make_tensor_value_info("prob", TensorProto.FLOAT, [None, len(self.classes)])],
+            init,
+        )
+        model = helper.make_model(graph, opset_imports=[helper.make_opsetid("", 13)])
+        model.ir_version = 8
+        helper.set_model_props(model, {"classes": json.dumps(self.classes, ensure_ascii=False),
+                                       "actions": json.dumps(self.actions, ensure_ascii=False)})
+        onnx.checker.check_model(model)
+        onnx.save(model, path)
+
+    @classmethod
+    def load(cls, path: str, **kwargs) -> "SceneModel":
+        if path.endswith(".onnx"):
+            import onnxruntime
+            options = onnxruntime.SessionOptions()
+            options.intra_op_num_threads = 1
+            session = onnxruntime.InferenceSession(path, options, providers=["CPUExecutionProvider"])
+            meta = session.get_modelmeta().custom_metadata_map
+            classes, actions = json.loads(meta["classes"]), json.loads(meta["actions"])
+            model = cls(None, None, None, None, classes, actions, session=session, **kwargs)
+        else:
+            data = np.load(path)
+            meta = json.loads(str(data["meta"]))
+            model = cls(data["mean"], data["std"], data["w"], data["b"], meta["classes"], meta["actions"], **kwargs)
+        for action in model.actions.values():
+            if "clicks" in action:
+                action["clicks"] = [tuple(c) for c in action["clicks"]]
+        return model
+
+    # --- 推理 ---
+
+    def probabilities(self, x: np.ndarray) -> np.ndarray:
+        x = np.atleast_2d(x).astype(np.float32)
+        if self.session is not None:
+            return self.session.run(["prob"], {"x": x})[0]
+        return softmax(((x - self.mean) / self.std) @ self.w + self.b)
+
+    def predict(self, frame: Frame, text: str = "") -> tuple:
+        """(类别, 置信度)"""
+        prob = self.probabilities(features(frame, text))[0]
+        best = int(prob.argmax())
+        return self.classes[best], float(prob[best])
+
+    def decide(self, frame: Frame, text: str = "") -> dict:
+        """置信度足够时返回动作字典（带 confidence），否则返回 None"""
+        start = time.perf_counter()
+        key, confidence = self.predict(frame, text)
+        observe("scene_model", time.perf_counter() - start)
+        with self._lock:
+            self.counters["calls"] += 1
+        if key == OTHER or confidence < self.min_confidence:
+            return None
+        with self._lock:
+            self.counters["hits"] += 1
+        action = dict(self.actions[key])
+        action["confidence"] = round(confidence, 3)
+        print(f"[场景] 模型判断 {key} (置信度 {confidence:.2f}, {(time.perf_counter() - start) * 1000:.1f}ms)")
+        return action
+
+    def should_audit(self) -> bool:
+        """这次命中是否仍请求 AI 核对"""
+        return self.audit > 0 and random.random() < self.audit
+
+    def record_audit(self, predicted: dict, actual: dict):
+        with self._lock:
+            self.counters["audits"] += 1
+            if actual and same_action(predicted, actual):
+                self.counters["agreements"] += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            c = dict(self.counters)
+        c["hit_rate"] = round(c["hits"] / c["calls"], 3) if c["calls"] else 0.0
+        c["agreement"] = round(c["agreements"] / c["audits"], 3) if c["audits"] else None
+        return c
+
+
+_logger = None
+_model = None
+_model_loaded = False
+_lock = threading.Lock()
+
+
+def get_scene_logger() -> SceneLogger:
+    """SCENE_LOG=1 时返回样本记录器（SCENE_LOG_DIR），否则返回 None"""
+    global _logger
+    if os.getenv("SCENE_LOG", "0") != "1":
+        return None
+    if _logger is None:
+        with _lock:
+            if _logger is None:
+                _logger = SceneLogger(os.getenv("SCENE_LOG_DIR", "scene_log"))
+    return _logger
+
+
+def get_scene_model() -> SceneModel:
+    """SCENE_MODEL 指定的模型（文件不存在时返回 None），SCENE_MIN_CONFIDENCE / SCENE_AUDIT"""
+    global _model, _model_loaded
+    if not _model_loaded:
+        with _lock:
+            if not _model_loaded:
+                path = os.getenv("SCENE_MODEL", "")
+                if path and os.path.exists(path):
+                    try:
+                        _model = SceneModel.load(
+                            path,
+                            min_confidence=float(os.getenv("SCENE_MIN_CONFIDENCE", 0.9)),
+                            audit=float(os.getenv("SCENE_AUDIT", 0.05)),
+                        )
+                        print(f"[场景] 已加载 {path}: {len(_model.classes) - 1} 个类别")
+                    except Exception as e:
+                        print(f"[场景] 加载模型失败: {e}")
+                _model_loaded = True
+    return _model
+
+
+def evaluate(model: SceneModel, samples: list, thresholds=(0.5, 0.7, 0.8, 0.9, 0.95)):
+    """按置信度阈值打印覆盖率（不请求 AI 的比例）和这部分的准确率"""
+    prob = model.probabilities(np.stack([f for f, _ in samples]))
+    best = prob.argmax(axis=1)
+    confidence = prob[np.arange(len(best)), best]
+    accepted_other = np.array([model.classes[i] == OTHER for i in best])
+    correct = np.array([not other and same_action(model.actions[model.classes[i]], a)
+                        for i, other, (_, a) in zip(best, accepted_other, samples)])
+    print(f"  整体准确率 {correct.mean():.3f} ({len(samples)} 个样本)")
+    for t in thresholds:
+        used = (confidence >= t) & ~accepted_other
+        coverage = used.mean()
+        accuracy = correct[used].mean() if used.any() else float("nan")
+        print(f"  阈值 {t:.2f}: 覆盖 {coverage:.1%}，准确率 {accuracy:.3f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="本地场景分类器")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+
+    p_train = sub.add_parser("train", help="用记录的 AI 决策训练模型")
+    p_train.add_argument("--log", default=os.getenv("SCENE_LOG_DIR", "scene_log"))
+    p_train.add_argument("--out", default="scene_model.npz")
+    p_train.add_argument("--onnx", default=None, help="同时导出 ONNX 模型到该路径")
+    p_train.add_argument("--min-samples", type=int, default=5, help="样本数少于该值的类别归入 OTHER")
+    p_train.add_argument("--holdout", type=float, default=0.2, help="用于评估的样本比例")
+
+    p_stats = sub.add_parser("stats", help="查看记录的样本分布")
+    p_stats.add_argument("--log", default=os.getenv("SCENE_LOG_DIR", "scene_log"))
+    args = parser.parse_args()
+
+    samples = load_samples(args.log)
+    if args.cmd == "stats":
+        clusters = cluster_actions([a for _, a in samples])
+        for members in sorted(clusters, key=len, reverse=True):
+            print(f"{len(members):6d}  {action_key(prototype(members))}")
+        return
+
+    if len(samples) < 10:
+        raise SystemExit(f"样本太少 ({len(samples)})，先用 SCENE_LOG=1 运行一段时间")
+    random.Random(0).shuffle(samples)
+    split = int(len(samples) * (1 - args.holdout))
+    if args.holdout > 0 and split < len(samples):
+        print(f"评估 (训练 {split} / 验证 {len(samples) - split}):")
+        evaluate(SceneModel.fit(samples[:split], args.min_samples), samples[split:])
+    model = SceneModel.fit(samples, args.min_samples)
+    model.save(args.out)
+    print(f"已保存 {args.out}: {len(model.classes) - 1} 个类别 + {OTHER}")
+    if args.onnx:
+        model.export_onnx(args.onnx)
+        print(f"已导出 {args.onnx}")
+
+
+if __name__ == "__main__":
+    main()
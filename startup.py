@@ -0,0 +1,187 @@
+"""
+启动阶段计时与登录期间的后台预热。
+
+原来 OCR 模型在按下回车后的第一帧才真正跑第一次推理；AI 连接（经代理的 TLS 握手）、
+场景模型、规则表、决策缓存、编码器也都在第一次用到时才初始化，所以第一轮比之后慢得多。
+STARTUP_WARMUP=1（默认）时，在等待用户手动登录的这段时间里：
+- 后台线程：预热 OCR 引擎（或启动 OCR 服务工作进程）、建立 AI 连接、初始化决策流水线用到的懒加载对象
+- 主线程：截一帧并跑一遍检测器和区域签名，预热采集路径（Playwright 同步 API 只能在主线程调用）
+  用户回车由另一个线程等待
+main.py 和本模块在顶层只导入标准库：httpx、numpy / PIL、sqlite、onnxruntime 等都在这些预热函数里第一次导入，
+导入耗时也藏在登录期间。
+按下回车后，主循环开始前会等待还没完成的预热（最多 STARTUP_WARMUP_WAIT 秒）。
+第一轮结束后打印各阶段耗时，之后再和稳定状态下的耗时比较。
+"""
+import statistics
+import threading
+import time
+from contextlib import contextmanager
+
+
+class StartupTimer:
+    """
+    origin: 计时起点（main.py 开始导入模块的时刻）
+    steady_loops: 第一轮之后再统计多少轮，用来和第一轮比较
+    """
+
+    def __init__(self, origin: float = None, steady_loops: int = 10):
+        self.origin = origin if origin is not None else time.perf_counter()
+        self.steady_loops = steady_loops
+        self.phases = []
+        self.tasks = {}
+        self.threads = []
+        self.loops = []
+        self.login_end = None
+        self._lock = threading.Lock()
+
+    def mark(self, name: str, seconds: float):
+        self.phases.append((name, seconds))
+
+    @contextmanager
+    def phase(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.mark(name, time.perf_counter() - start)
+
+    def background(self, name: str, func, *args) -> threading.Thread:
+        """在后台线程运行 func，记录 (开始, 结束, 错误)"""
+
+        def run():
+            start = time.perf_counter()
+            error = None
+            try:
+                func(*args)
+            except Exception as e:
+                error = e
+                print(f"[启动] 预热 {name} 失败: {e}")
+            with self._lock:
+                self.tasks[name] = (start, time.perf_counter(), error)
+
+        thread = threading.Thread(target=run, name=f"warmup-{name}", daemon=True)
+        with self._lock:
+            self.tasks[name] = (time.perf_counter(), None, None)
+        self.threads.append(thread)
+        thread.start()
+        return thread
+
+    def wait_login(self, capture_warmup=None):
+        """
+        等待用户按回车；等待期间在主线程运行 capture_warmup。
+        回车由另一个线程读取，主线程分段 join，Ctrl+C 仍然可以中断。
+        """
+        def read_enter():
+            try:
+                input()
+            except EOFError:
+                # 没有可用的标准输入（例如被重定向）：直接开始
+                pass
+
+        start = time.perf_counter()
+        login = threading.Thread(target=read_enter, name="login-wait", daemon=True)
+        login.start()
+        if capture_warmup is not None:
+            with self.phase("截图预热"):
+                try:
+                    capture_warmup()
+                except Exception as e:
+                    print(f"[启动] 预热截图失败: {e}")
+        while login.is_alive():
+            login.join(0.2)
+        self.login_end = time.perf_counter()
+        self.mark("登录（等待用户）", self.login_end - start)
+
+    def wait_tasks(self, timeout: float):
+        """等待还没完成的后台预热，最多 timeout 秒"""
+        start = time.perf_counter()
+        deadline = start + timeout
+        for thread in self.threads:
+            thread.join(max(deadline - time.perf_counter(), 0))
+        waited = time.perf_counter() - start
+        if waited >= 0.01:
+            self.mark("登录后等待预热", waited)
+
+    def record_loop(self, seconds: float):
+        """主循环每轮截图 + 决策的耗时；第一轮后打印启动报告，再过 steady_loops 轮打印对比"""
+        if len(self.loops) > self.steady_loops:
+            return
+        self.loops.append(seconds)
+        if len(self.loops) == 1:
+            self.report()
+        elif len(self.loops) == self.steady_loops + 1:
+            steady = statistics.median(self.loops[1:])
+            print(f"[启动] 第一轮 {self.loops[0] * 1000:.0f}ms，之后 {self.steady_loops} 轮中位数 {steady * 1000:.0f}ms")
+
+    def report(self):
+        print("[启动] " + " | ".join(f"{name} {seconds:.2f}s" for name, seconds in self.phases))
+        with self._lock:
+            tasks = dict(self.tasks)
+        parts = []
+        for name, (start, end, error) in tasks.items():
+            if end is None:
+                parts.append(f"{name} 未完成")
+                continue
+            hidden = self.login_end is not None and end <= self.login_end
+            status = "失败" if error else ("登录期间完成" if hidden else "登录后完成")
+            parts.append(f"{name} {end - start:.2f}s ({status})")
+        if parts:
+            print("[启动] 后台预热: " + ", ".join(parts))
+        if self.loops:
+            print(f"[启动] 从启动到第一轮决策完成 {time.perf_counter() - self.origin:.1f}s，第一轮 {self.loops[0] * 1000:.0f}ms")
+
+
+# 以下函数在预热线程（warm_capture 在主线程）里运行，各模块也在这里第一次导入，导入耗时不再落在登录提示之前
+
+def warm_ocr():
+    """加载并预热 OCR 模型（或启动 OCR 服务工作进程）"""
+    from ocr_region import warmup_ocr_async
+
+    warmup_ocr_async().join()
+
+
+def warm_ai():
+    """创建 AI 客户端并预先建立到各远程 backend 的连接（经代理的 TLS 握手）"""
+    from ai_client import get_ai_client
+
+    get_ai_client().warmup()
+
+
+def warm_pipeline(viewport: tuple):
+    """第一帧会用到的懒加载对象：规则表、决策缓存、场景模型（含第一次推理）、检测器、图片编码器、指标、录制"""
+    import numpy as np
+
+    from decision_cache import get_decision_cache
+    from detector import get_detector
+    from frame import Frame
+    from metrics import get_metrics
+    from payload_encoder import get_payload_encoder
+    from replay import get_replay_recorder
+    from rule_engine import get_rule_engine
+    from scene_model import get_scene_model
+
+    # 不是纯色的假画面：只用来触发各处的第一次初始化，不计入任何统计
+    width, height = viewport
+    gradient = np.linspace(0, 255, width, dtype=np.uint8)
+    frame = Frame(array=np.repeat(np.stack([gradient] * 3, axis=-1)[None], height, axis=0), viewport=viewport)
+    get_rule_engine()
+    get_decision_cache()
+    get_detector()
+    get_payload_encoder()
+    get_metrics()
+    get_replay_recorder()
+    frame.jpeg()
+    model = get_scene_model()
+    if model is not None:
+        model.predict(frame)
+
+
+def warm_capture(capture, viewport: tuple, regions: dict):
+    """截一帧，跑一遍检测器和各区域签名（必须在主线程调用）"""
+    from detector import detect
+    from frame_cache import region_signature
+
+    frame = capture.grab(viewport)
+    for coords in regions.values():
+        region_signature(frame.crop(coords))
+    detect(frame)
@@ -0,0 +1,75 @@
+"""parse_action 与 main.parse_ai_response：代码块包裹、格式错误、多点点击"""
+import pytest
+
+from ai_action import ActionError, parse_action
+from main import parse_ai_response
+
+
+@pytest.mark.parametrize("text, expected", [
+    ('{"task": "确定", "action": "click", "points": [{"x": 640, "y": 400}]}',
+     {"x": 640, "y": 400, "hold": False, "task": "确定"}),
+    ('{"task": "骰子", "action": "hold", "points": [{"x": 1171, "y": 621}]}',
+     {"x": 1171, "y": 621, "hold": True, "task": "骰子"}),
+    ('{"task": "等待", "action": "wait", "points": []}', {"action": "wait", "task": "等待"}),
+    ('{"task": "选牌", "action": "clicks", "points": [{"x": 1, "y": 2}, {"x": 3, "y": 4}]}',
+     {"clicks": [(1, 2), (3, 4)], "task": "选牌"}),
+    # 旧格式
+    ('{"task": "骰子", "x": 10, "y": 20, "hold": true}', {"x": 10, "y": 20, "hold": True, "task": "骰子"}),
+    ('{"task": "选牌", "clicks": [{"x": 1, "y": 2}, [3, 4]]}', {"clicks": [(1, 2), (3, 4)], "task": "选牌"}),
+    ('{"action": "wait"}', {"action": "wait", "task": "unknown"}),
+])
+def test_parse_action(text, expected):
+    assert parse_action(text, 1280, 720).to_coords() == expected
+
+
+@pytest.mark.parametrize("fence", ["```json\n{}\n```", "```\n{}\n```", "  ```json\n{}```  "])
+def test_fenced_json(fence):
+    text = fence.replace("{}", '{"task": "确定", "action": "click", "points": [{"x": 5, "y": 6}]}')
+    assert parse_action(text, 1280, 720).to_coords() == {"x": 5, "y": 6, "hold": False, "task": "确定"}
+
+
+def test_click_with_several_points_becomes_clicks():
+    action = parse_action('{"task": "t", "action": "click", "points": [{"x": 1, "y": 1}, {"x": 2, "y": 2}]}')
+    assert action.action == "clicks"
+    assert action.points == [(1, 1), (2, 2)]
+
+
+@pytest.mark.parametrize("text", [
+    "",
+    "好的，我来点击确定按钮",
+    '{"task": "确定", "x": 640',
+    '[{"x": 1, "y": 2}]',
+    '{"task": "确定"}',
+    '{"task": "t", "action": "jump", "points": [{"x": 1, "y": 2}]}',
+    '{"task": "t", "action": "click", "points": []}',
+    '{"task": "t", "action": "click", "points": {"x": 1, "y": 2}}',
+    '{"task": "t", "action": "click", "points": [{"x": "1", "y": 2}]}',
+    '{"task": "t", "action": "click", "points": [{"x": true, "y": 2}]}',
+    '{"task": "t", "action": "click", "points": [{"x": 1281, "y": 2}]}',
+    '{"task": "t", "action": "click", "points": [{"x": -1, "y": 2}]}',
+    '{"task": "t", "clicks": "1,2"}',
+])
+def test_malformed_reply_rejected(text):
+    with pytest.raises(ActionError):
+        parse_action(text, 1280, 720)
+
+
+def test_strict_mode_returns_none_on_malformed():
+    assert parse_ai_response('{"task": "确定", "x": 640', strict=True) is None
+
+
+def test_fallback_extracts_from_prose():
+    # 不严格输出 JSON 的模型：退回正则提取
+    text = '先点确定。{"task": "确定", "x": 640, "y": 400} 然后等待结果'
+    assert parse_ai_response(text) == {"x": 640, "y": 400, "hold": False, "task": "确定"}
+    text = '这是连点：{"task": "选牌", "clicks": [{"x": 1, "y": 2}, {"x": 3, "y": 4}]} 完成'
+    assert parse_ai_response(text) == {"clicks": [(1, 2), (3, 4)], "task": "选牌"}
+
+
+def test_fenced_multi_click_reply():
+    text = '```json\n{"task": "选牌", "action": "clicks", "points": [{"x": 100, "y": 200}, {"x": 300, "y": 400}]}\n```'
+    assert parse_ai_response(text, strict=True) == {"clicks": [(100, 200), (300, 400)], "task": "选牌"}
+
+
+def test_unparseable_reply_returns_none():
+    assert parse_ai_response("I cannot help with that.") is None
@@ -0,0 +1,136 @@
+"""TokenBucket 补充令牌、AIClient 的对冲请求、截止时间和错误分类"""
+import time
+
+import httpx
+import pytest
+
+import ai_client
+from ai_backends import OpenAIBackend
+from ai_client import AIClient, AIError, TokenBucket
+
+
+class FakeTime:
+    """替换 ai_client.time：monotonic 由测试推进，sleep 直接推进时钟"""
+
+    def __init__(self):
+        self.now = 100.0
+
+    def monotonic(self) -> float:
+        return self.now
+
+    def sleep(self, seconds: float):
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeTime()
+    monkeypatch.setattr(ai_client, "time", fake)
+    return fake
+
+
+def test_bucket_starts_full_and_refills_at_rate(clock):
+    bucket = TokenBucket(rate=2.0, burst=3)
+    assert [bucket.try_acquire() for _ in range(3)] == [0.0, 0.0, 0.0]
+    assert bucket.try_acquire() == pytest.approx(0.5)
+    clock.now += 0.5
+    assert bucket.try_acquire() == 0.0
+    # 空闲再久也只攒到 burst 个
+    clock.now += 60
+    assert [bucket.try_acquire() for _ in range(4)][-1] == pytest.approx(0.5)
+
+
+def test_bucket_acquire_waits_and_times_out(clock):
+    bucket = TokenBucket(rate=1.0)
+    assert bucket.acquire()
+    start = clock.now
+    assert bucket.acquire(timeout=2)
+    assert clock.now - start == pytest.approx(1.0)
+    assert not bucket.acquire(timeout=0.5)
+
+
+def test_bucket_from_env(monkeypatch):
+    monkeypatch.delenv("AI_RATE_PER_MIN", raising=False)
+    assert TokenBucket.from_env() is None
+    monkeypatch.setenv("AI_RATE_PER_MIN", "30")
+    monkeypatch.setenv("AI_RATE_BURST", "2")
+    bucket = TokenBucket.from_env()
+    assert (bucket.rate, bucket.burst) == (0.5, 2)
+
+
+def _reply(text: str = '{"task": "确定", "x": 1, "y": 2}') -> httpx.Response:
+    return httpx.Response(200, json={"choices": [{"message": {"content": text}}]})
+
+
+def _client(handler, names=("a", "b"), failure_threshold: int = 3, **kwargs) -> AIClient:
+    backends = [OpenAIBackend(name, "m", base_url=f"http://{name}.test/v1", failure_threshold=failure_threshold)
+                for name in names]
+    client = AIClient(backends, explore=0, backoff_base=0.01, **kwargs)
+    client._http = httpx.Client(transport=httpx.MockTransport(handler))
+    return client
+
+
+def _warm(client: AIClient, seconds: float = 0.02, samples: int = 20):
+    for backend in client.backends:
+        for _ in range(samples):
+            backend.stats.latency.add(seconds)
+
+
+def test_hedge_fires_after_p95_and_backup_wins():
+    def handler(request):
+        if request.url.host == "a.test":
+            time.sleep(0.6)
+        return _reply(request.url.host)
+
+    client = _client(handler, hedge=True, hedge_min_delay=0.05)
+    _warm(client)
+    client.backends[1].stats.latency.add(1.0)  # 让 a 排在第一
+    start = time.monotonic()
+    reply = client.generate("prompt")
+    assert reply.text == "b.test"
+    assert time.monotonic() - start < 0.5
+    assert client.counters["hedges"] == 1
+    assert client.counters["hedge_wins"] == 1
+
+
+def test_no_hedge_when_primary_is_fast():
+    client = _client(lambda request: _reply(request.url.host), hedge=True, hedge_min_delay=0.2)
+    _warm(client)
+    assert client.generate("prompt").text in ("a.test", "b.test")
+    assert client.counters["hedges"] == 0
+
+
+def test_deadline_bounds_retries():
+    def handler(request):
+        raise httpx.ConnectError("refused", request=request)
+
+    client = _client(handler, deadline=0.5, max_retries=100, backoff_cap=0.05)
+    start = time.monotonic()
+    with pytest.raises(AIError):
+        client.generate("prompt")
+    assert time.monotonic() - start < 0.6
+    assert client.counters["retries"] > 0
+    assert client.counters["failures"] == 1
+
+
+def test_transport_error_fails_over():
+    def handler(request):
+        if request.url.host == "a.test":
+            raise httpx.UnsupportedProtocol("bad proxy", request=request)
+        return _reply()
+
+    client = _client(handler)
+    client.backends[1].stats.latency.add(1.0)
+    assert client.generate("prompt").backend.name == "b"
+    assert client.counters["failovers"] == 1
+
+
+@pytest.mark.parametrize("status, attempts", [(400, 2), (408, 8), (429, 8), (503, 8)])
+def test_only_timeouts_throttling_and_server_errors_are_retried(status, attempts):
+    # 关掉熔断，只看重试本身
+    client = _client(lambda request: httpx.Response(status, text="error"), failure_threshold=100,
+                     max_retries=3, backoff_cap=0.01)
+    with pytest.raises(AIError):
+        client.generate("prompt")
+    # 两个 backend：4xx 每个只请求一次，可重试的错误每轮都请求
+    assert client.counters["attempts"] == attempts
@@ -0,0 +1,96 @@
+"""DecisionCache 的 TTL、LRU 淘汰、近似匹配和 sqlite 持久化"""
+import numpy as np
+
+import decision_cache
+from decision_cache import DecisionCache
+from frame import Frame
+
+COLORS = bytes(16 * 9 * 3 + 8 * 8 * 3)
+
+
+class Clock:
+    def __init__(self, now: float = 1000.0):
+        self.now = now
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def _key(h: int, text: str = "", colors: bytes = COLORS) -> tuple:
+    return h, text, colors
+
+
+def test_expired_entry_is_dropped(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(decision_cache.time, "time", clock)
+    cache = DecisionCache(ttl=60)
+    cache.put(_key(1), {"task": "确定", "x": 1, "y": 2})
+    clock.now += 59
+    assert cache.get(_key(1)) == {"task": "确定", "x": 1, "y": 2}
+    clock.now += 2
+    assert cache.get(_key(1)) is None
+    assert cache.stats()["size"] == 0
+
+
+def test_least_recently_used_is_evicted():
+    cache = DecisionCache(max_size=2, max_distance=0)
+    cache.put(_key(1), {"task": "a"})
+    cache.put(_key(2), {"task": "b"})
+    assert cache.get(_key(1)) == {"task": "a"}  # 1 变为最近使用
+    cache.put(_key(4), {"task": "c"})
+    assert cache.get(_key(2)) is None
+    assert cache.get(_key(1)) == {"task": "a"}
+    assert cache.get(_key(4)) == {"task": "c"}
+
+
+def test_get_returns_copy():
+    cache = DecisionCache()
+    cache.put(_key(1), {"task": "a"})
+    cache.get(_key(1))["task"] = "changed"
+    assert cache.get(_key(1)) == {"task": "a"}
+
+
+def test_closest_entry_within_thresholds():
+    cache = DecisionCache(max_distance=4)
+    cache.put(_key(0b0000), {"task": "far"})
+    cache.put(_key(0b1100), {"task": "near"})
+    assert cache.get(_key(0b1110)) == {"task": "near"}
+    assert cache.get(_key(0b11111110)) is None  # 汉明距离超过 max_distance
+    assert cache.get(_key(0b1110, text="其他文字")) is None
+
+
+def test_colour_signature_separates_same_dhash():
+    orange = np.zeros((720, 1280, 3), np.uint8)
+    orange[524:688, 1056:1250] = (240, 140, 40)
+    green = orange.copy()
+    green[524:688, 1056:1250] = (90, 190, 70)
+    cache = DecisionCache()
+    key_orange = cache.key(Frame(array=orange), "")
+    key_green = cache.key(Frame(array=green), "")
+    cache.put(key_orange, {"task": "骰子", "hold": True})
+    assert cache.get(key_orange) == {"task": "骰子", "hold": True}
+    assert cache.get(key_green) is None
+
+
+def test_database_keeps_latest_entries(tmp_path, monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(decision_cache.time, "time", clock)
+    path = str(tmp_path / "cache.db")
+    cache = DecisionCache(max_size=2, max_distance=0, db_path=path)
+    for h in (1, 2, 3):
+        clock.now += 1
+        cache.put(_key(h), {"task": str(h), "clicks": [[h, h]]})
+    assert cache._db.execute("SELECT COUNT(*) FROM decisions_v2").fetchone()[0] == 2
+
+    reopened = DecisionCache(max_size=2, max_distance=0, db_path=path)
+    assert reopened.get(_key(1)) is None
+    assert reopened.get(_key(3)) == {"task": "3", "clicks": [(3, 3)]}
+
+
+def test_database_drops_expired_rows_on_open(tmp_path, monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(decision_cache.time, "time", clock)
+    path = str(tmp_path / "cache.db")
+    DecisionCache(ttl=60, db_path=path).put(_key(1), {"task": "a"})
+    clock.now += 120
+    assert DecisionCache(ttl=60, db_path=path).stats()["size"] == 0
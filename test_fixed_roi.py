@@ -0,0 +1,68 @@
+"""FixedROIRecognizer 在多个线程同时识别、学习时保持一致"""
+import threading
+
+import numpy as np
+
+from ocr_region import FixedROIRecognizer
+
+
+class Reader:
+    """只实现快速路径用到的 text_rec：每行都读成 "自动" """
+
+    def text_rec(self, lines):
+        return [("自动", 0.99) for _ in lines], 0.0
+
+
+class Engine:
+    def load(self):
+        return Reader()
+
+
+def _roi(value: int) -> np.ndarray:
+    img = np.full((164, 194, 3), value, np.uint8)
+    img[60:100, 40:150] = 255 - value
+    return img
+
+
+def _details(n: int) -> dict:
+    return {"boxes": [(40, 60, 150, 100)], "variant": "Original", "texts": [f"文字{n}"], "scores": [0.95]}
+
+
+def test_concurrent_learn_and_recognize():
+    recognizer = FixedROIRecognizer("自动按钮", ("自动",), max_layouts=4, recheck_every=0)
+    engine = Engine()
+    rois = [_roi(v) for v in range(0, 250, 10)]
+    recognizer.learn(rois[0], _details(0))
+    errors = []
+
+    def learner(offset: int):
+        try:
+            for i in range(200):
+                recognizer.learn(rois[(i + offset) % len(rois)], _details(i))
+        except Exception as e:
+            errors.append(e)
+
+    def reader():
+        try:
+            for _ in range(200):
+                with recognizer._lock:
+                    plan = recognizer._plan(recognizer._signature(rois[0]))
+                assert plan is None or plan[1] == "Original"
+                recognizer._trusted(["自动"], 0.99)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=learner, args=(n,)) for n in range(4)]
+    threads += [threading.Thread(target=reader) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert not errors
+    assert len(recognizer.layouts) <= recognizer.max_layouts
+    assert len({id(layout) for layout in recognizer.layouts}) == len(recognizer.layouts)
+    assert {f"文字{i}" for i in range(200)} <= recognizer.known_texts
+
+    recognizer.learn(rois[0], _details(0))
+    assert recognizer.call_batch([rois[0]] * 3, engine) == ["自动"] * 3
+    assert recognizer.hits == 3
@@ -0,0 +1,86 @@
+"""FrameCache.changed 的阈值，以及按区域签名复用缓存结果"""
+import numpy as np
+import pytest
+
+import frame_cache
+from frame import Frame
+from frame_cache import FrameCache
+from regions import COORDS, FULL_FRAME, MSG_COORDS
+
+REGIONS = {"消息区域": MSG_COORDS, "自动按钮": COORDS}
+
+
+def _cache(**kwargs) -> FrameCache:
+    return FrameCache(REGIONS, mean_diff=1.5, max_diff=12, **kwargs)
+
+
+def _screen(value: int = 100) -> np.ndarray:
+    return np.full((720, 1280, 3), value, np.uint8)
+
+
+@pytest.mark.parametrize("delta, changed", [(0, False), (1.5, False), (1.6, True), (-2, True)])
+def test_uniform_shift_uses_mean_threshold(delta, changed):
+    old = np.full((32, 32), 100, np.float32)
+    assert _cache().changed(old, old + delta) is changed
+
+
+@pytest.mark.parametrize("delta, changed", [(12, False), (12.5, True), (-40, True)])
+def test_single_cell_uses_max_threshold(delta, changed):
+    # 只有一格变化：平均差很小，靠最大差判断（小按钮变灰、数字跳动）
+    old = np.full((32, 32), 100, np.float32)
+    new = old.copy()
+    new[5, 5] += delta
+    assert _cache().changed(old, new) is changed
+
+
+def test_jpeg_noise_is_not_a_change():
+    rng = np.random.default_rng(0)
+    old = np.full((32, 32), 100, np.float32)
+    assert not _cache().changed(old, old + rng.uniform(-3, 3, old.shape).astype(np.float32))
+
+
+def test_reuse_until_watched_region_changes():
+    cache = _cache()
+    cache.observe(Frame(array=_screen()))
+    cache.put("ocr", "文字")
+    cache.observe(Frame(array=_screen()))
+    assert cache.get("ocr") == "文字"
+
+    changed = _screen()
+    left, top, right, bottom = COORDS
+    changed[top:bottom, left:right] = 200
+    cache.observe(Frame(array=changed))
+    assert cache.get("ocr", ("消息区域",)) == "文字"
+    assert cache.get("ocr") is None
+    assert cache.get("ocr", ("自动按钮",)) is None
+    assert cache.stats()["ocr"] == (2, 2, 0.5)
+
+
+def test_small_change_outside_regions_only_affects_full_frame():
+    cache = _cache()
+    cache.observe(Frame(array=_screen()))
+    cache.put("decision", {"task": "确定"})
+    changed = _screen()
+    changed[600:700, 100:300] = 255  # 不在任何 OCR 区域里
+    cache.observe(Frame(array=changed))
+    assert cache.get("decision", tuple(REGIONS)) == {"task": "确定"}
+    assert cache.get("decision", (*REGIONS, FULL_FRAME)) is None
+
+
+def test_max_reuse_and_ttl(monkeypatch):
+    now = [0.0]
+    monkeypatch.setattr(frame_cache.time, "monotonic", lambda: now[0])
+    cache = _cache(max_reuse=2, ttl=30)
+    cache.observe(Frame(array=_screen()))
+    cache.put("ocr", "文字")
+    assert [cache.get("ocr") for _ in range(3)] == ["文字", "文字", None]
+    cache.put("ocr", "文字")
+    now[0] = 31
+    assert cache.get("ocr") is None
+
+
+def test_disabled_cache_never_hits():
+    cache = _cache(enabled=False)
+    cache.observe(Frame(array=_screen()))
+    cache.put("ocr", "文字")
+    assert cache.get("ocr") is None
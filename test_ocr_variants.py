@@ -0,0 +1,58 @@
+"""OCRVariants 查找表实现与原 PIL 流水线 (ImageOps / ImageEnhance) 的等价性"""
+import numpy as np
+import pytest
+from PIL import Image, ImageEnhance, ImageOps
+
+from ocr_region import VARIANT_ORDER, OCRVariants
+
+PIL_VARIANTS = {
+    "AutoContrast": lambda img: ImageOps.autocontrast(img, cutoff=5),
+    "Equalized": lambda img: ImageOps.equalize(img),
+    "Upscaled2xAuto": lambda img: ImageOps.autocontrast(_upscale(img), cutoff=5),
+    "Upscaled2xEq": lambda img: ImageOps.equalize(_upscale(img)),
+    "BrightContrast": lambda img: ImageEnhance.Contrast(ImageEnhance.Brightness(img).enhance(1.5)).enhance(2.0),
+    "InvContrast": lambda img: ImageEnhance.Contrast(ImageOps.invert(img)).enhance(3.0),
+    "Original": lambda img: img,
+    "Upscaled2x": lambda img: _upscale(img),
+    "HighContrast": lambda img: ImageEnhance.Contrast(img).enhance(2.5),
+    "Inverted": lambda img: ImageOps.invert(img),
+}
+
+
+def _upscale(img: Image.Image) -> Image.Image:
+    return img.resize((img.width * 2, img.height * 2), Image.Resampling.LANCZOS)
+
+
+def _roi(kind: str) -> Image.Image:
+    rng = np.random.default_rng(0)
+    h, w = 164, 194  # 自动按钮区域的大小
+    if kind == "noise":
+        arr = rng.integers(0, 256, (h, w, 3))
+    elif kind == "dark":
+        # 半透明深色遮罩下的文字：整体偏暗、动态范围窄
+        arr = rng.integers(20, 70, (h, w, 3))
+        arr[60:100, 40:150] += 60
+    elif kind == "gradient":
+        arr = np.broadcast_to(np.linspace(0, 255, w)[None, :, None], (h, w, 3)).copy()
+        arr[..., 1] = arr[..., 1][::-1]
+    else:
+        arr = np.full((h, w, 3), 128)
+    return Image.fromarray(arr.astype(np.uint8), "RGB")
+
+
+@pytest.mark.parametrize("kind", ["noise", "dark", "gradient", "flat"])
+@pytest.mark.parametrize("name", VARIANT_ORDER)
+def test_variant_matches_pil(name, kind):
+    img = _roi(kind)
+    expected = np.asarray(PIL_VARIANTS[name](img).convert("RGB"), dtype=np.int16)
+    # OCRVariants 输出 BGR
+    actual = OCRVariants(img).get(name)[..., ::-1].astype(np.int16)
+    assert actual.shape == expected.shape
+    assert np.abs(actual - expected).max() <= 1
+
+
+def test_variants_share_intermediates():
+    variants = OCRVariants(_roi("noise"))
+    assert variants.get("Upscaled2xAuto").shape[:2] == (164 * 2, 194 * 2)
+    assert variants.get("Upscaled2x") is variants.get("Upscaled2x")
+    assert set(variants._hist) == {"up"}
@@ -0,0 +1,108 @@
+"""KeywordMatcher 与朴素子串查找一致；rules.json 与原来写死的 ocr() / decide_fixed_action 判断一致"""
+import itertools
+import json
+import os
+import random
+
+import pytest
+
+from rule_engine import KeywordMatcher, RuleEngine
+
+RULES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "rules.json")
+
+
+def legacy_verdict(text: str, msginfo: str) -> tuple:
+    """原 ocr_region.ocr() 中识别之后的 if 链"""
+    special_keywords = ['愿望', '擂台', '攻击']
+    has_special_event = any(k in msginfo for k in special_keywords)
+    if text == "" and msginfo == "":
+        return True, msginfo
+    if '自' in text and "动" in text and not has_special_event and "长按" not in text and "以" not in text:
+        return True, msginfo
+    elif "掠夺了你的金库" in msginfo or "试图攻击你的城市" in msginfo:
+        return True, ""
+    elif '自' in text and "动" in text and "拜访" in msginfo:
+        return True, ""
+    return False, msginfo
+
+
+def legacy_fixed_action(msginfo: str) -> dict:
+    """原 main.decide_fixed_action"""
+    if not msginfo:
+        return None
+    msginfo = msginfo.strip()
+    if "愿望" in msginfo:
+        return {"x": 455, "y": 450, "task": "愿望-固定"}
+    if "攻击" in msginfo:
+        return {"task": "攻击-固定", "clicks": [(308, 227), (427, 127), (319, 463)]}
+    if "掠夺" in msginfo:
+        return {"task": "掠夺-固定", "clicks": [(227, 420), (327, 420), (447, 405), (587, 434), (697, 420)]}
+    if "猜拳" in msginfo or '擂台' in msginfo:
+        options = [
+            {"name": "剪刀", "x": 555, "y": 650},
+            {"name": "石头", "x": 635, "y": 650},
+            {"name": "布", "x": 715, "y": 650}
+        ]
+        choice = random.choice(options)
+        return {"x": choice['x'], "y": choice['y'], "task": "猜拳-随机"}
+    return None
+
+
+AUTO_TEXTS = ["", "自动", "长按自动", "自动以后", "动自", "自", "手动", "自 动"]
+MSG_FRAGMENTS = ["", "愿望", "擂台", "攻击", "掠夺", "猜拳", "拜访", "掠夺了你的金库", "试图攻击你的城市",
+                 "其他事件", " "]
+MSG_TEXTS = sorted({a + b for a, b in itertools.product(MSG_FRAGMENTS, repeat=2)})
+
+
+@pytest.fixture(scope="module")
+def engine():
+    return RuleEngine(RULES, check_interval=3600)
+
+
+@pytest.mark.parametrize("text", AUTO_TEXTS)
+def test_verdict_matches_legacy(engine, text):
+    for msginfo in MSG_TEXTS:
+        assert engine.verdict(text, msginfo) == legacy_verdict(text, msginfo), (text, msginfo)
+
+
+def test_decide_matches_legacy(engine):
+    for msginfo in MSG_TEXTS + ["  愿望  ", "\n攻击"]:
+        random.seed(msginfo)
+        expected = legacy_fixed_action(msginfo)
+        random.seed(msginfo)
+        assert engine.decide(msginfo) == expected, msginfo
+
+
+def test_priority_and_file_order(tmp_path):
+    path = tmp_path / "rules.json"
+    path.write_text(json.dumps({"rules": [
+        {"name": "低", "priority": 1, "msg": {"any": ["a"]}, "action": {"type": "click", "x": 1, "y": 1}},
+        {"name": "高", "priority": 5, "msg": {"any": ["a"]}, "action": {"type": "click", "x": 2, "y": 2}},
+        {"name": "高-后", "priority": 5, "msg": {"any": ["a"]}, "action": {"type": "click", "x": 3, "y": 3}},
+    ]}), encoding="utf-8")
+    assert RuleEngine(str(path)).decide("a") == {"x": 2, "y": 2, "task": "高"}
+
+
+def test_broken_file_keeps_old_rules(tmp_path):
+    path = tmp_path / "rules.json"
+    path.write_text(json.dumps({"rules": [
+        {"name": "a", "msg": {"any": ["a"]}, "action": {"type": "wait"}}]}), encoding="utf-8")
+    engine = RuleEngine(str(path), check_interval=0)
+    path.write_text('{"rules": [', encoding="utf-8")
+    os.utime(path, (os.path.getmtime(path) + 10,) * 2)
+    assert engine.decide("a") == {"action": "wait", "task": "a"}
+
+
+@pytest.mark.parametrize("keywords", [
+    ["自", "动", "自动", "长按", "以"],
+    ["he", "she", "his", "hers"],
+    ["掠夺", "掠夺了你的金库", "攻击", "试图攻击你的城市", "击你"],
+    ["aa", "aaa", "a", "b"],
+])
+def test_matcher_matches_naive_search(keywords):
+    rng = random.Random(0)
+    alphabet = sorted(set("".join(keywords))) + ["x"]
+    matcher = KeywordMatcher(keywords)
+    for _ in range(500):
+        text = "".join(rng.choice(alphabet) for _ in range(rng.randrange(12)))
+        assert matcher.scan(text) == {k for k in keywords if k in text}, text
@@ -0,0 +1,40 @@
+"""VariantScheduler 的默认尝试预算，以及预算之外的变体不会饿死"""
+from ocr_region import VARIANT_ORDER
+from variant_scheduler import VariantScheduler
+
+
+def _run(scheduler: VariantScheduler, region: str, hits=(), frames: int = 40) -> set:
+    """模拟 frames 帧的串行 smart_ocr，返回尝试过的变体"""
+    tried = set()
+    for _ in range(frames):
+        for n, variant in enumerate(scheduler.order(region)):
+            if not scheduler.within_budget(n, 0):
+                break
+            tried.add(variant)
+            scheduler.record(region, variant, variant in hits, 10)
+            if variant in hits:
+                break
+    return tried
+
+
+def test_default_budget_is_finite(monkeypatch):
+    monkeypatch.delenv("OCR_MAX_VARIANTS", raising=False)
+    monkeypatch.setenv("OCR_STATS_PATH", "")
+    scheduler = VariantScheduler.from_env(VARIANT_ORDER)
+    assert 0 < scheduler.max_variants < len(VARIANT_ORDER)
+    assert not scheduler.within_budget(scheduler.max_variants, 0)
+
+
+def test_empty_region_rotates_through_all_variants():
+    assert _run(VariantScheduler(VARIANT_ORDER), "消息区域") == set(VARIANT_ORDER)
+
+
+def test_late_variant_rises_to_the_top():
+    scheduler = VariantScheduler(VARIANT_ORDER)
+    _run(scheduler, "自动按钮", hits={"InvContrast"})
+    assert scheduler.order("自动按钮")[0] == "InvContrast"
+
+
+def test_budget_disabled():
+    scheduler = VariantScheduler(VARIANT_ORDER, max_variants=0)
+    assert scheduler.within_budget(len(VARIANT_ORDER), 1e6)
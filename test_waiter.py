@@ -0,0 +1,56 @@
+"""Waiter.wait_settle：先看到变化再判断稳定，grace 内没有变化就不再等待"""
+import time
+
+import numpy as np
+
+from frame import Frame
+from regions import COORDS, MSG_COORDS
+from waiter import Waiter
+
+REGIONS = {"消息区域": MSG_COORDS, "自动按钮": COORDS}
+STILL = Frame(array=np.full((720, 1280, 3), 100, np.uint8))
+CHANGED = Frame(array=np.full((720, 1280, 3), 200, np.uint8))
+
+
+def _waiter(probe) -> Waiter:
+    return Waiter(probe, REGIONS, poll=0.01, quiet=0.1, grace=0.3, path=None)
+
+
+def _script(*steps):
+    """steps: (开始时刻, 帧)...，按调用时的时刻返回对应的帧"""
+    start = time.monotonic()
+
+    def probe():
+        now = time.monotonic() - start
+        return [frame for at, frame in steps if at <= now][-1]
+    return probe
+
+
+def test_no_change_waits_grace_and_is_not_recorded():
+    waiter = _waiter(lambda: STILL)
+    elapsed = waiter.wait_settle("确定", max_s=2, min_s=0)
+    assert 0.3 <= elapsed < 0.5
+    assert "其他" not in waiter.summary()
+
+
+def test_late_reaction_is_not_mistaken_for_settled():
+    # 点击后 0.2 秒画面才开始变化：只按 quiet 判断会在 0.1 秒时就认为已经稳定
+    waiter = _waiter(_script((0, STILL), (0.2, CHANGED)))
+    elapsed = waiter.wait_settle("确定", max_s=2, min_s=0)
+    assert 0.3 <= elapsed < 0.5
+    assert waiter.summary()["其他"]["count"] == 1
+    assert waiter.summary()["其他"]["avg"] >= 0.2
+
+
+def test_change_against_baseline_counts_as_seen():
+    # 反应在第一次检测之前就已经结束：与操作之前的画面比较
+    waiter = _waiter(lambda: CHANGED)
+    elapsed = waiter.wait_settle("骰子", max_s=2, min_s=0, baseline=waiter.signatures(STILL))
+    assert 0.1 <= elapsed < 0.25
+    assert waiter.summary()["骰子"]["count"] == 1
+
+
+def test_max_s_bounds_the_wait():
+    frames = [STILL, CHANGED]
+    waiter = _waiter(lambda: frames[int(time.monotonic() * 50) % 2])
+    assert waiter.wait_settle("掠夺", max_s=0.2, min_s=0) < 0.3
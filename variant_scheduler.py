@@ -0,0 +1,186 @@
+import atexit
+import json
+import os
+import threading
+
+
+class VariantStats:
+    """单个 (区域, 变体) 的统计：尝试次数、命中次数、平均耗时"""
+
+    __slots__ = ("tries", "hits", "avg_ms")
+
+    def __init__(self, tries: int = 0, hits: int = 0, avg_ms: float = 0.0):
+        self.tries = tries
+        self.hits = hits
+        self.avg_ms = avg_ms
+
+    def record(self, hit: bool, ms: float, alpha: float = 0.2):
+        self.tries += 1
+        if hit:
+            self.hits += 1
+        # 耗时用指数滑动平均，适应机器负载变化
+        self.avg_ms = ms if self.tries == 1 else (1 - alpha) * self.avg_ms + alpha * ms
+
+    def to_dict(self) -> dict:
+        return {"tries": self.tries, "hits": self.hits, "avg_ms": round(self.avg_ms, 3)}
+
+
+class VariantScheduler:
+    """
+    根据每个区域的历史命中率和耗时，为 smart_ocr 安排变体的尝试顺序。
+
+    对相互独立的尝试，按 命中率/耗时 从大到小排序可以让"首次命中的期望耗时"最小。
+    命中率带先验 (prior_hits / prior_tries)，样本少的变体会得到乐观估计，从而仍有机会被尝试。
+
+    默认每次调用只尝试排在前面的 max_variants 个变体：区域里确实没有文字（例如没有弹窗时的消息区域）时，
+    原来每帧要把十个变体全部跑完才放弃。排在后面的变体不会饿死：前几个一直落空，命中率随之下降，
+    还没试过的变体靠先验得到的乐观估计会排到前面来。
+    """
+
+    def __init__(self, variants, path: str = None, max_variants: int = 4, max_ms: float = 0,
+                 adaptive: bool = True, prior_hits: float = 1.0, prior_tries: float = 2.0,
+                 save_every: int = 50, forward: bool = False):
+        self.variants = tuple(variants)
+        self.path = path
+        self.max_variants = max_variants  # 每次调用最多尝试多少个变体，0 表示不限
+        self.max_ms = max_ms              # 每次调用最多花费多少毫秒，0 表示不限
+        self.adaptive = adaptive
+        self.prior_hits = prior_hits
+        self.prior_tries = prior_tries
+        self.save_every = save_every
+        self._stats = {}
+        self._lock = threading.Lock()
+        self._dirty = 0
+        # forward=True 时另外记下每次结果，由 drain() 取走（OCR 工作进程把结果交回客户端进程汇总）
+        self._pending = [] if forward else None
+        if path:
+            self.load()
+
+    @classmethod
+    def from_env(cls, variants, **kwargs) -> "VariantScheduler":
+        """OCR_ADAPTIVE / OCR_STATS_PATH / OCR_MAX_VARIANTS / OCR_MAX_MS"""
+        return cls(
+            variants,
+            path=os.getenv("OCR_STATS_PATH", "ocr_stats.json") or None,
+            max_variants=int(os.getenv("OCR_MAX_VARIANTS", 4)),
+            max_ms=float(os.getenv("OCR_MAX_MS", 0)),
+            adaptive=os.getenv("OCR_ADAPTIVE", "1") != "0",
+            **kwargs,
+        )
+
+    def _get(self, region: str, variant: str) -> VariantStats:
+        key = (region, variant)
+        stats = self._stats.get(key)
+        if stats is None:
+            stats = self._stats[key] = VariantStats()
+        return stats
+
+    def order(self, region: str) -> list:
+        """返回该区域本次调用应尝试的变体顺序"""
+        if not self.adaptive:
+            return list(self.variants)
+        with self._lock:
+            stats = [self._stats.get((region, v)) for v in self.variants]
+        timed = [s.avg_ms for s in stats if s and s.tries]
+        # 没有耗时数据的变体用该区域的平均耗时代替
+        default_ms = sum(timed) / len(timed) if timed else 1.0
+
+        def score(item):
+            rank, s = item
+            tries = s.tries if s else 0
+            hits = s.hits if s else 0
+            p = (hits + self.prior_hits) / (tries + self.prior_tries)
+            ms = s.avg_ms if s and s.tries else default_ms
+            # 分数相同时保持默认顺序
+            return (-p / max(ms, 0.001), rank)
+
+        ranked = sorted(enumerate(stats), key=score)
+        return [self.variants[rank] for rank, _ in ranked]
+
+    def within_budget(self, tried: int, elapsed_ms: float) -> bool:
+        """已经尝试了 tried 个变体、耗时 elapsed_ms 后，是否还能继续尝试"""
+        if self.max_variants and tried >= self.max_variants:
+            return False
+        if self.max_ms and elapsed_ms >= self.max_ms:
+            return False
+        return True
+
+    def record(self, region: str, variant: str, hit: bool, ms: float):
+        with self._lock:
+            self._get(region, variant).record(hit, ms)
+            self._dirty += 1
+            if self._pending is not None:
+                self._pending.append((region, variant, hit, ms))
+            should_save = self.path and self._dirty >= self.save_every
+        if should_save:
+            self.save()
+
+    def drain(self) -> list:
+        """取走 forward=True 时积累的 [(区域, 变体, 命中, 耗时)]"""
+        with self._lock:
+            if not self._pending:
+                return []
+            pending, self._pending = self._pending, []
+        return pending
+
+    def summary(self, region: str) -> list:
+        """按当前顺序列出该区域各变体的统计，便于调试"""
+        rows = []
+        for v in self.order(region):
+            s = self._stats.get((region, v)) or VariantStats()
+            rows.append({"variant": v, **s.to_dict()})
+        return rows
+
+    def load(self):
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"[OCR] 读取变体统计失败: {e}")
+            return
+        with self._lock:
+            for region, variants in data.items():
+                for variant, s in variants.items():
+                    self._stats[(region, variant)] = VariantStats(
+                        int(s.get("tries", 0)), int(s.get("hits", 0)), float(s.get("avg_ms", 0.0))
+                    )
+
+    def save(self):
+        if not self.path:
+            return
+        with self._lock:
+            data = {}
+            for (region, variant), s in self._stats.items():
+                data.setdefault(region, {})[variant] = s.to_dict()
+            self._dirty = 0
+        tmp = f"{self.path}.tmp"
+        try:
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(data, f, ensure_ascii=False, indent=2)
+            os.replace(tmp, self.path)
+        except OSError as e:
+            print(f"[OCR] 保存变体统计失败: {e}")
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def get_variant_scheduler(variants) -> VariantScheduler:
+    """返回进程内唯一的变体调度器，退出时自动保存统计"""
+    global _scheduler
+    if _scheduler is None:
+        with _scheduler_lock:
+            if _scheduler is None:
+                _scheduler = VariantScheduler.from_env(variants)
+                atexit.register(_scheduler.save)
+    return _scheduler
+
+
+def set_variant_scheduler(scheduler: VariantScheduler) -> None:
+    """替换进程内的变体调度器（例如 OCR 工作进程不写文件，把结果交回客户端）"""
+    global _scheduler
+    with _scheduler_lock:
+        _scheduler = scheduler
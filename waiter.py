@@ -0,0 +1,266 @@
+"""
+事件驱动的等待：用廉价的区域签名比较代替固定的 sleep。
+
+- wait_change: 等到画面（任一监视区域）发生变化，或者超时
+- wait_settle: 等到画面先变化、再稳定（连续 quiet 秒没有变化），即点击后的动画已经播完
+- hold_until_change: 按住鼠标直到监视区域变化（骰子长按）
+
+每种任务（轰炸 / 掠夺 / 骰子 / 其他）动画实际用了多久会被记录下来 (WAIT_STATS_PATH)，
+之后按历史耗时决定开始检测的时间和最长等待时间。WAIT_EVENTS=0 时退回原来的固定 sleep。
+"""
+import atexit
+import json
+import os
+import threading
+import time
+
+from frame_cache import FrameCache
+
+TASK_TYPES = ("轰炸", "掠夺", "骰子")
+# 同一类任务的其他叫法：固定逻辑的轰炸序列叫"攻击-固定"，AI 有时也说"攻击城市"
+TASK_ALIASES = {"攻击": "轰炸"}
+OTHER_TASK = "其他"
+
+
+def task_type(task: str) -> str:
+    """把 AI / 固定逻辑给出的 task 描述归到动画时长相近的几类"""
+    for name in TASK_TYPES:
+        if name in (task or ""):
+            return name
+    for alias, name in TASK_ALIASES.items():
+        if alias in (task or ""):
+            return name
+    return OTHER_TASK
+
+
+class SettleStats:
+    """某类任务从操作到画面稳定的耗时（秒）：次数、滑动平均、最大值"""
+
+    __slots__ = ("count", "avg", "peak")
+
+    def __init__(self, count: int = 0, avg: float = 0.0, peak: float = 0.0):
+        self.count = count
+        self.avg = avg
+        self.peak = peak
+
+    def record(self, seconds: float, alpha: float = 0.2):
+        self.count += 1
+        self.avg = seconds if self.count == 1 else (1 - alpha) * self.avg + alpha * seconds
+        # 峰值缓慢衰减，偶尔一次特别长的动画不会永久拉高上限
+        self.peak = max(seconds, self.peak * 0.98)
+
+    def to_dict(self) -> dict:
+        return {"count": self.count, "avg": round(self.avg, 3), "peak": round(self.peak, 3)}
+
+
+class Waiter:
+    """
+    probe: 无参函数，返回一帧 (Frame)，应尽量便宜（见 Capture.probe）
+    regions: {区域名: (left, top, right, bottom)}，监视这些区域和整帧
+    poll: 两次检测之间的间隔（秒）
+    quiet: 连续多少秒没有变化视为稳定
+    grace: 操作之后多少秒内一直没有看到变化，就认为这次操作没有引起画面变化
+    min_samples: 某类任务至少有多少次记录后才按历史耗时调整等待
+    limits: 各处等待的上限（秒），默认与原来固定 sleep 的时长相同
+        idle: 无需操作 / 自动模式中，click: 单击之后以及连点之间，sequence: 连点结束后，
+        hold: 长按最长时间，hold_min: 长按最短时间
+    """
+
+    DEFAULT_LIMITS = {"idle": 1.0, "click": 1.0, "sequence": 10.0, "hold": 3.0, "hold_min": 1.0}
+
+    def __init__(self, probe, regions: dict, poll: float = 0.1, quiet: float = 0.4, grace: float = 0.8,
+                 mean_diff: float = 1.5, max_diff: float = 12.0, path: str = None,
+                 min_samples: int = 5, enabled: bool = True, limits: dict = None):
+        self.probe = probe
+        self.poll = poll
+        self.quiet = quiet
+        self.grace = grace
+        self.min_samples = min_samples
+        self.enabled = enabled
+        self.path = path
+        self.limits = {**self.DEFAULT_LIMITS, **(limits or {})}
+        # 只借用 FrameCache 的签名和比较，不缓存任何结果
+        self._diff = FrameCache(regions, mean_diff=mean_diff, max_diff=max_diff)
+        self._stats = {}
+        self._lock = threading.Lock()
+        self.saved_seconds = 0.0
+        if path:
+            self.load()
+
+    @classmethod
+    def from_env(cls, probe, regions: dict) -> "Waiter":
+        """
+        WAIT_EVENTS / WAIT_POLL / WAIT_QUIET / WAIT_GRACE / WAIT_STATS_PATH / WAIT_<IDLE|CLICK|SEQUENCE|HOLD|HOLD_MIN>，
+        变化阈值沿用 FRAME_CACHE_MEAN_DIFF / FRAME_CACHE_MAX_DIFF
+        """
+        limits = {name: float(os.getenv(f"WAIT_{name.upper()}", default))
+                  for name, default in cls.DEFAULT_LIMITS.items()}
+        return cls(
+            probe,
+            regions,
+            poll=float(os.getenv("WAIT_POLL", 0.1)),
+            quiet=float(os.getenv("WAIT_QUIET", 0.4)),
+            grace=float(os.getenv("WAIT_GRACE", 0.8)),
+            mean_diff=float(os.getenv("FRAME_CACHE_MEAN_DIFF", 1.5)),
+            max_diff=float(os.getenv("FRAME_CACHE_MAX_DIFF", 12)),
+            path=os.getenv("WAIT_STATS_PATH", "wait_stats.json") or None,
+            enabled=os.getenv("WAIT_EVENTS", "1") != "0",
+            limits=limits,
+        )
+
+    def signatures(self, frame=None) -> dict:
+        try:
+            return dict(self._diff.observe(frame if frame is not None else self.probe()))
+        except Exception as e:
+            print(f"[等待] 截图失败: {e}")
+            return {}
+
+    def differs(self, old: dict, new: dict, names=None) -> bool:
+        for name, sig in new.items():
+            if names is not None and name not in names:
+                continue
+            prev = old.get(name)
+            if prev is not None and prev.shape == sig.shape and self._diff.changed(prev, sig):
+                return True
+        return False
+
+    def wait_change(self, max_s: float, min_s: float = 0.0, baseline: dict = None, names=None) -> float:
+        """
+        等到画面相对 baseline（默认为调用时的画面）发生变化，返回实际等待的秒数。
+        names 指定只看哪些区域，默认所有区域和整帧。
+        """
+        if not self.enabled:
+            time.sleep(max_s)
+            return max_s
+        start = time.monotonic()
+        baseline = baseline if baseline is not None else self.signatures()
+        if min_s:
+            time.sleep(min_s)
+        while time.monotonic() - start < max_s:
+            if not baseline:
+                baseline = self.signatures()
+            elif self.differs(baseline, self.signatures(), names):
+                break
+            time.sleep(self.poll)
+        elapsed = time.monotonic() - start
+        self.saved_seconds += max(max_s - elapsed, 0)
+        return elapsed
+
+    def wait_settle(self, task: str, max_s: float, min_s: float = 0.2, kind: str = None,
+                    baseline: dict = None) -> float:
+        """
+        操作之后等到画面稳定（连续 quiet 秒没有变化），返回实际等待的秒数并记入该类任务（kind，
+        默认按 task 归类）的统计。有足够历史记录时，在预计动画结束前不做检测，最长等待时间也收紧到历史峰值附近。
+        游戏对点击的反应常常要过一两百毫秒才出现，刚点完时画面没动不等于已经稳定：先要看到一次变化
+        （与 baseline —— 操作之前的画面比较，或者轮询中前后两次比较）才开始计算 quiet；
+        grace 秒内始终没有变化时视为操作没有引起画面变化，不再等待，这次也不计入统计。
+        """
+        if not self.enabled:
+            time.sleep(max_s)
+            return max_s
+        kind = kind or task_type(task)
+        start = time.monotonic()
+        stats = self._stats.get(kind)
+        if stats is not None and stats.count >= self.min_samples:
+            min_s = max(min_s, stats.avg * 0.5)
+            max_s = min(max_s, stats.peak * 1.5 + self.quiet + 0.5)
+        min_s = min(min_s, max_s)
+        if min_s:
+            time.sleep(min_s)
+        last = self.signatures()
+        seen = bool(baseline) and self.differs(baseline, last)
+        still_since = time.monotonic()
+        while True:
+            now = time.monotonic()
+            if now - start >= max_s or now - still_since >= self.quiet and (seen or now - start >= self.grace):
+                break
+            time.sleep(self.poll)
+            current = self.signatures()
+            if self.differs(last, current):
+                seen = True
+                still_since = time.monotonic()
+            last = current or last
+        elapsed = time.monotonic() - start
+        self.saved_seconds += max(max_s - elapsed, 0)
+        if not seen:
+            print(f"[等待] {kind} 画面没有变化 (等待 {elapsed:.2f}s)")
+            return elapsed
+        # 画面最后一次变化的时刻就是动画结束的时刻
+        settled = max(still_since - start, min_s)
+        self.record(kind, settled)
+        print(f"[等待] {kind} 画面稳定用时 {settled:.2f}s (等待 {elapsed:.2f}s)")
+        return elapsed
+
+    def hold_until_change(self, page, x: int, y: int, task: str = None, names=None) -> float:
+        """
+        在 (x, y) 按住鼠标，直到 names 区域变化（例如长按触发了自动）或达到 hold 上限，返回按住的秒数。
+        按下本身也会让按钮变化，所以先按住 hold_min 秒（有历史记录时取以往触发时间的八成）再开始比较。
+        按住的时间按任务类别单独记录（"骰子-长按"），不和该类任务松开后的动画耗时混在一起。
+        """
+        kind = f"{task_type(task)}-长按"
+        max_s, min_s = self.limits["hold"], self.limits["hold_min"]
+        page.mouse.move(x, y)
+        page.mouse.down()
+        try:
+            if not self.enabled:
+                time.sleep(max_s)
+                return max_s
+            stats = self._stats.get(kind)
+            if stats is not None and stats.count >= self.min_samples:
+                min_s = max(min_s, stats.avg * 0.8)
+            min_s = min(min_s, max_s)
+            start = time.monotonic()
+            time.sleep(min_s)
+            baseline = self.signatures()
+            self.wait_change(max_s - min_s, baseline=baseline, names=names)
+            held = time.monotonic() - start
+            if held < max_s - self.poll:
+                # 只记录确实检测到变化的长按
+                self.record(kind, held)
+            return held
+        finally:
+            page.mouse.up()
+
+    def record(self, kind: str, seconds: float):
+        with self._lock:
+            stats = self._stats.get(kind)
+            if stats is None:
+                stats = self._stats[kind] = SettleStats()
+            stats.record(seconds)
+
+    def summary(self) -> dict:
+        with self._lock:
+            data = {kind: s.to_dict() for kind, s in self._stats.items()}
+        data["saved_seconds"] = round(self.saved_seconds, 1)
+        return data
+
+    def load(self):
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"[等待] 读取动画耗时统计失败: {e}")
+            return
+        with self._lock:
+            for kind, s in data.items():
+                self._stats[kind] = SettleStats(int(s.get("count", 0)), float(s.get("avg", 0.0)),
+                                                float(s.get("peak", 0.0)))
+
+    def save(self):
+        if not self.path:
+            return
+        with self._lock:
+            data = {kind: s.to_dict() for kind, s in self._stats.items()}
+        tmp = f"{self.path}.tmp"
+        try:
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(data, f, ensure_ascii=False, indent=2)
+            os.replace(tmp, self.path)
+        except OSError as e:
+            print(f"[等待] 保存动画耗时统计失败: {e}")
+
+    def save_at_exit(self) -> "Waiter":
+        atexit.register(self.save)
+        return self